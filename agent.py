@@ -0,0 +1,223 @@
+import asyncio
+import contextvars
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from google.genai import types
+
+import metrics
+
+# Per-request budgets
+MAX_TURNS = 5        # model round trips
+MAX_TOOL_CALLS = 8   # function calls across all turns
+TIME_BUDGET = 60     # seconds for the whole request (model + tools)
+TOOL_TIMEOUT = 20    # seconds for a single tool call
+
+# Tools are blocking SQLite calls; calls from one model turn run side by side here
+TOOL_THREADS = ThreadPoolExecutor(max_workers=8, thread_name_prefix="agent-tool")
+
+class BudgetExceeded(Exception):
+    pass
+
+class AgentExecutor:
+    """
+    Drives one chat request: streams the model's reply, runs every function call
+    of a turn concurrently, feeds the results back and repeats until the model
+    answers in plain text or a budget runs out.
+
+    run() is an async generator of events (dicts with a "type"):
+      text        {"text"}                     partial model output
+      tool_start  {"id", "name", "args"}
+      tool_end    {"id", "name", "ok", "ms"}
+      done        {"response"}                 final answer (text of the last turn)
+      error       {"detail"}
+    """
+
+    def __init__(self, client, model, config, tools, max_turns=MAX_TURNS, max_tool_calls=MAX_TOOL_CALLS,
+                 time_budget=TIME_BUDGET, tool_timeout=TOOL_TIMEOUT):
+        self.client = client
+        self.model = model
+        self.config = config
+        self.tools = tools
+        self.max_turns = max_turns
+        self.max_tool_calls = max_tool_calls
+        self.time_budget = time_budget
+        self.tool_timeout = tool_timeout
+
+    async def run(self, message):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.time_budget
+        calls_made = 0
+        text = ""
+        try:
+            chat = self.client.aio.chats.create(model=self.model, config=self.config)
+            for _ in range(self.max_turns):
+                text, calls = "", []
+                async for part in self._stream(chat, message, deadline):
+                    if part.function_call:
+                        calls.append(part.function_call)
+                    elif part.text:
+                        text += part.text
+                        yield {"type": "text", "text": part.text}
+                if not calls:
+                    yield {"type": "done", "response": text}
+                    return
+
+                allowed = max(0, self.max_tool_calls - calls_made)
+                calls_made += len(calls)
+                results = [None] * len(calls)
+                async for event in self._call_tools(calls[:allowed], results, calls_made - len(calls), deadline):
+                    yield event
+                for i in range(allowed, len(calls)):
+                    # Over budget: tell the model instead of running the call, so it can still answer
+                    results[i] = "Error: Tool call budget for this request is exhausted. Answer with what you have."
+                message = [types.Part.from_function_response(name=fn.name, response={"result": res})
+                           for fn, res in zip(calls, results)]
+            yield {"type": "done", "response": text}
+        except BudgetExceeded as e:
+            yield {"type": "error", "detail": str(e)}
+        except Exception as e:
+            print(f"Chat Error: {e}")
+            yield {"type": "error", "detail": f"Error interacting with Agent: {e}"}
+
+    async def _stream(self, chat, message, deadline):
+        """Yield the parts of one model turn, enforcing the request deadline between chunks."""
+        t0 = time.perf_counter()
+        try:
+            stream = await self._within(chat.send_message_stream(message), deadline)
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await self._within(chunks.__anext__(), deadline)
+                except StopAsyncIteration:
+                    return
+                for candidate in chunk.candidates or []:
+                    for part in (candidate.content.parts if candidate.content else None) or []:
+                        yield part
+        finally:
+            metrics.TURN_SECONDS.observe(time.perf_counter() - t0)
+
+    async def _within(self, awaitable, deadline):
+        remaining = deadline - asyncio.get_running_loop().time()
+        try:
+            if remaining <= 0: raise asyncio.TimeoutError
+            return await asyncio.wait_for(awaitable, remaining)
+        except asyncio.TimeoutError:
+            if asyncio.iscoroutine(awaitable): awaitable.close()
+            raise BudgetExceeded(f"Time budget of {self.time_budget}s exceeded")
+
+    async def _call_tools(self, calls, results, first_id, deadline):
+        """Run calls concurrently; fill results in call order and yield progress as each finishes."""
+        loop = asyncio.get_running_loop()
+
+        async def call(i, fn):
+            t0 = time.perf_counter()
+            tool = self.tools.get(fn.name)
+            args = dict(fn.args or {})
+            if tool is None:
+                return i, "Error: Tool not found", False, 0
+            print(f"Calling Tool: {fn.name}")
+            try:
+                timeout = min(self.tool_timeout, deadline - loop.time())
+                # Run in a copy of this context so a ?profile=1 request also sees the tool's SQL
+                run = contextvars.copy_context().run
+                res = await asyncio.wait_for(loop.run_in_executor(TOOL_THREADS, run, lambda: tool(**args)), timeout)
+                ok = True
+            except asyncio.TimeoutError:
+                res, ok = f"Error: {fn.name} timed out", False
+            except Exception as e:
+                res, ok = f"Error: {e}", False
+            seconds = time.perf_counter() - t0
+            metrics.TOOL_SECONDS.observe(seconds, fn.name, str(ok).lower())
+            return i, str(res), ok, round(seconds * 1000)
+
+        for i, fn in enumerate(calls):
+            yield {"type": "tool_start", "id": first_id + i, "name": fn.name, "args": dict(fn.args or {})}
+        for next_done in asyncio.as_completed([call(i, fn) for i, fn in enumerate(calls)]):
+            i, res, ok, ms = await next_done
+            results[i] = res
+            yield {"type": "tool_end", "id": first_id + i, "name": calls[i].name, "ok": ok, "ms": ms}
+        if loop.time() > deadline:
+            raise BudgetExceeded(f"Time budget of {self.time_budget}s exceeded")
+
+async def sse(events):
+    """Encode executor events as Server-Sent Events frames."""
+    async for event in events:
+        yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+async def collect(events):
+    """Drain executor events into the final answer (for the non-streaming endpoint)."""
+    response = ""
+    async for event in events:
+        if event["type"] == "done": response = event["response"]
+        elif event["type"] == "error": response = event["detail"]
+    return response
+
+# --- Offline testing ---
+
+class ScriptedClient:
+    """
+    Stand-in for genai.Client that replays a script instead of calling the model.
+    `turns` is one list per model turn; each item is a text chunk (str) or a
+    function call (name, args). Each chat records the messages it was sent in `sent`.
+    """
+
+    def __init__(self, turns, delay=0.0):
+        self.turns = turns
+        self.delay = delay
+        self.sessions = []
+        self.aio = SimpleNamespace(chats=SimpleNamespace(create=self._create))
+
+    def _create(self, model=None, config=None):
+        chat = ScriptedChat(list(self.turns), self.delay)
+        self.sessions.append(chat)
+        return chat
+
+class ScriptedChat:
+    def __init__(self, turns, delay):
+        self.turns = turns
+        self.delay = delay
+        self.sent = []
+
+    async def send_message_stream(self, message):
+        self.sent.append(message)
+        turn = self.turns.pop(0) if self.turns else ["(script exhausted)"]
+
+        async def chunks():
+            for item in turn:
+                await asyncio.sleep(self.delay)
+                if isinstance(item, str):
+                    part = types.Part(text=item)
+                else:
+                    name, args = item
+                    part = types.Part(function_call=types.FunctionCall(name=name, args=args))
+                yield types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))])
+        return chunks()
+
+if __name__ == "__main__":
+    import argparse
+    import db
+    import schema
+    import web_server
+    parser = argparse.ArgumentParser(description="Run the agent offline against a scripted model and print the event stream.")
+    parser.add_argument("--db", default=schema.DB_NAME)
+    parser.add_argument("--video", type=int, default=20)
+    args = parser.parse_args()
+
+    script = ScriptedClient([
+        ["Checking alerts and video stats... ",
+         ("get_security_briefing", {"limit": 3}), ("get_video_stats", {"video_id": args.video})],
+        ["Both tools returned. ", "Summary: see the briefing above."],
+    ])
+    pool = db.Pool(args.db)
+    executor = AgentExecutor(script, web_server.MODEL, web_server.AGENT_CONFIG, web_server.build_tools(pool, None))
+
+    async def main():
+        async for frame in sse(executor.run("Any alerts?")):
+            print(frame, end="")
+    asyncio.run(main())
+    sent = script.sessions[0].sent
+    print(f"Model received {len(sent)} messages; function responses: {[p.function_response.name for p in sent[1]]}")
+    pool.close()
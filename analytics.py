@@ -0,0 +1,219 @@
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+try:
+    import numpy as np
+except ImportError:  # optional: the API falls back to SQLite without it
+    np = None
+
+import schema
+from risk import FRESH_AGE, SLEEPER_AGE
+
+available = np is not None
+
+# Rows fetched per round trip while loading
+FETCH_CHUNK = 250_000
+
+# Likes are kept sorted by this key so any (video, time range) is one searchsorted slice.
+# Timestamps stay well below 2**40 (year 36812), video ids below 2**23.
+KEY_SHIFT = 40
+
+def _keys(video_ids, timestamps):
+    return (video_ids.astype(np.int64) << KEY_SHIFT) | timestamps
+
+def _cover(users, user_ids):
+    """Grow the per-user arrays to cover every id in user_ids (likes from unknown users)."""
+    need = int(user_ids.max()) + 1 if len(user_ids) else 0
+    if need > len(users["created_at"]):
+        for name, fill in (("created_at", 0), ("is_bot", False), ("username", None)):
+            users[name] = np.resize(users[name], need)
+            users[name][users["user_max"] + 1:] = fill
+    return users
+
+def _fetch(conn, sql, params, dtypes):
+    """Run a query and return its columns as NumPy arrays (fetched in chunks)."""
+    cur = conn.execute(sql, params)
+    chunks = []
+    while True:
+        rows = cur.fetchmany(FETCH_CHUNK)
+        if not rows: break
+        chunks.append(np.array(rows, dtype=np.int64).reshape(-1, len(dtypes)))
+    data = np.concatenate(chunks) if chunks else np.empty((0, len(dtypes)), dtype=np.int64)
+    return [data[:, i].astype(dt) for i, dt in enumerate(dtypes)]
+
+def _insert(likes, vids, ts, uids):
+    """The like arrays of `likes` with new likes merged in, after equal keys so earlier likes keep their place."""
+    new_keys = _keys(vids, ts)
+    order = np.argsort(new_keys, kind="stable")
+    new_keys = new_keys[order]
+    pos = np.searchsorted(likes.key, new_keys, side="right")
+    return {"video_id": np.insert(likes.video_id, pos, vids[order]),
+            "timestamp": np.insert(likes.timestamp, pos, ts[order]),
+            "user_id": np.insert(likes.user_id, pos, uids[order]),
+            "key": np.insert(likes.key, pos, new_keys)}
+
+class Engine:
+    """
+    In-memory columnar copy of likes + users for vectorized risk analytics.
+
+    likes: parallel arrays (video_id int32, timestamp int64, user_id int32) sorted by
+    (video_id, timestamp). users: created_at / is_bot / username arrays indexed by user id.
+    refresh() pulls only rows added since the last load (likes.id / users.id watermarks)
+    and swaps in a new snapshot, so readers never see a half-applied update.
+    """
+
+    def __init__(self):
+        self.snap = None
+        self._lock = threading.Lock()
+
+    # --- Loading ---
+
+    def load(self, conn):
+        t0 = time.perf_counter()
+        like_max = conn.execute("SELECT COALESCE(MAX(id), 0) FROM likes").fetchone()[0]
+        vids, ts, uids = _fetch(conn, """
+            SELECT video_id, timestamp, user_id FROM likes WHERE id <= ? ORDER BY video_id, timestamp
+        """, (like_max,), (np.int32, np.int64, np.int32))
+        self.snap = SimpleNamespace(
+            video_id=vids, timestamp=ts, user_id=uids, key=_keys(vids, ts), like_max=like_max,
+            **_cover(self._load_users(conn, 0, None), uids))
+        self.load_seconds = time.perf_counter() - t0
+        return self
+
+    def _load_users(self, conn, since, prev):
+        user_max = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+        params = (since, user_max)
+        ids, created, bots = _fetch(conn, "SELECT id, created_at, is_bot FROM users WHERE id > ? AND id <= ?",
+                                    params, (np.int64, np.int64, np.bool_))
+        size = max(user_max + 1, len(prev.created_at) if prev is not None else 0)
+        created_at = np.zeros(size, dtype=np.int64)
+        is_bot = np.zeros(size, dtype=np.bool_)
+        username = np.full(size, None, dtype=object)
+        if prev is not None:
+            created_at[:len(prev.created_at)] = prev.created_at
+            is_bot[:len(prev.is_bot)] = prev.is_bot
+            username[:len(prev.username)] = prev.username
+        created_at[ids] = created
+        is_bot[ids] = bots
+        username[ids] = [r[0] for r in conn.execute(
+            "SELECT username FROM users WHERE id > ? AND id <= ? ORDER BY id", params)]
+        return {"created_at": created_at, "is_bot": is_bot, "username": username, "user_max": user_max}
+
+    def refresh(self, conn):
+        """Merge in likes/users added since the last load. Returns the number of new likes."""
+        like_max, user_max = conn.execute(
+            "SELECT (SELECT COALESCE(MAX(id), 0) FROM likes), (SELECT COALESCE(MAX(id), 0) FROM users)").fetchone()
+        if like_max == self.snap.like_max and user_max == self.snap.user_max:
+            return 0
+        with self._lock:
+            old = self.snap
+            if like_max <= old.like_max and user_max <= old.user_max:
+                return 0  # another thread merged these rows while we waited
+            users = self._load_users(conn, old.user_max, old) if user_max != old.user_max else {
+                "created_at": old.created_at, "is_bot": old.is_bot, "username": old.username,
+                "user_max": old.user_max}
+            vids, ts, uids = _fetch(conn, """
+                SELECT video_id, timestamp, user_id FROM likes WHERE id > ? AND id <= ?
+            """, (old.like_max, like_max), (np.int32, np.int64, np.int32))
+            self.snap = SimpleNamespace(**_insert(old, vids, ts, uids), like_max=like_max, **_cover(users, uids))
+            return len(vids)
+
+    def __len__(self):
+        return len(self.snap.key) if self.snap else 0
+
+    # --- Queries ---
+
+    def _slice(self, snap, video_id, start, end):
+        lo = np.searchsorted(snap.key, (video_id << KEY_SHIFT) | start, side="left")
+        hi = np.searchsorted(snap.key, (video_id << KEY_SHIFT) | end, side="left")
+        return slice(lo, hi)
+
+    def _likes(self, snap, video_id, start, end):
+        """(user_id, timestamp) of one video's likes in [start, end), oldest first."""
+        s = self._slice(snap, video_id, start, end)
+        return snap.user_id[s], snap.timestamp[s]
+
+    def _users(self, snap, uids):
+        """(created_at, is_bot) of each user id."""
+        return snap.created_at[uids], snap.is_bot[uids]
+
+    def _usernames(self, snap, uids):
+        return snap.username[uids]
+
+    def window(self, video_id, start, end):
+        """
+        Likes of `video_id` in [start, end), oldest first, as arrays: user_id, username,
+        timestamp, created_at, is_bot, age (seconds since account creation), fresh, sleeper.
+        fresh/sleeper follow rollups.classify.
+        """
+        snap = self.snap
+        uids, ts = self._likes(snap, video_id, start, end)
+        created, bots = self._users(snap, uids)
+        age = ts - created
+        return SimpleNamespace(user_id=uids, username=self._usernames(snap, uids), timestamp=ts,
+                               created_at=created, is_bot=bots, age=age,
+                               fresh=age < FRESH_AGE, sleeper=bots & (age > SLEEPER_AGE))
+
+    def fresh_counts(self, windows):
+        """Number of fresh-account likes in each (video_id, start, end) window."""
+        snap = self.snap
+        counts = []
+        for video_id, start, end in windows:
+            uids, ts = self._likes(snap, video_id, start, end)
+            age = ts - self._users(snap, uids)[0]
+            counts.append(int(np.count_nonzero(age < FRESH_AGE)))
+        return counts
+
+    def aggregate(self, width=3600):
+        """
+        Per-(video, bucket) totals over every like, like the rollup tables:
+        arrays (video_id, bucket, count, fresh_count, sleeper_count) in key order.
+        """
+        snap = self.snap
+        bucket = snap.timestamp // width * width
+        age = snap.timestamp - snap.created_at[snap.user_id]
+        fresh = age < FRESH_AGE
+        sleeper = snap.is_bot[snap.user_id] & (age > SLEEPER_AGE)
+        # Likes are sorted by (video, timestamp), so equal (video, bucket) pairs are contiguous
+        group_key = _keys(snap.video_id, bucket)
+        starts = np.flatnonzero(np.r_[True, group_key[1:] != group_key[:-1]]) if len(group_key) else np.empty(0, np.int64)
+        ends = np.r_[starts[1:], len(group_key)]
+        cum_fresh = np.r_[0, np.cumsum(fresh)]
+        cum_sleeper = np.r_[0, np.cumsum(sleeper)]
+        return (snap.video_id[starts], bucket[starts], ends - starts,
+                cum_fresh[ends] - cum_fresh[starts], cum_sleeper[ends] - cum_sleeper[starts])
+
+def risk_labels(window):
+    """/api/activity labels for an Engine.window() result."""
+    return np.where(window.fresh, "Fresh Account", np.where(window.sleeper, "Sleeper Pattern", "Normal")).tolist()
+
+def load(db_name=schema.DB_NAME):
+    """Open a read-only connection, build an Engine and return it."""
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+    try:
+        return Engine().load(conn)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Load the columnar analytics engine and verify it against the rollups.")
+    parser.add_argument("--db", default=schema.DB_NAME)
+    args = parser.parse_args()
+
+    if not available:
+        raise SystemExit("numpy is not installed; the analytics engine is unavailable.")
+    engine = load(args.db)
+    print(f"Loaded {len(engine)} likes in {engine.load_seconds:.2f}s "
+          f"({sum(a.nbytes for a in vars(engine.snap).values() if hasattr(a, 'nbytes')) / 2**20:.0f} MB)")
+
+    conn = sqlite3.connect(args.db)
+    expected = conn.execute("""
+        SELECT video_id, hour_epoch, count, fresh_count, sleeper_count FROM likes_hourly ORDER BY video_id, hour_epoch
+    """).fetchall()
+    actual = list(zip(*(a.tolist() for a in engine.aggregate(3600))))
+    conn.close()
+    print("Hourly aggregates match likes_hourly." if actual == [tuple(r) for r in expected]
+          else "MISMATCH between engine aggregates and likes_hourly.")
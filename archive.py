@@ -0,0 +1,175 @@
+"""
+Parquet archive of partitioned likes, for investigations older than the raw likes kept in SQLite.
+
+    likes_archive/month=YYYY-MM/likes.parquet
+
+One file per archived month (see partitions.py), written from its likes_YYYY_MM
+table joined with the liker's created_at/is_bot, sorted by (video_id, timestamp)
+with one video per row group, so a per-video read only decodes that video's rows.
+Export months before `partitions.py compact` drops them; afterwards Archive
+serves their raw likes (memory-mapped, reading only the requested columns of the
+matching row groups) to /api/activity, the activity export, minute series and
+the agent's fetch_suspicious_users.
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional (pyarrow and numpy): without them compacted months have no raw likes
+    pa = None
+
+import schema
+from risk import FRESH_AGE, SLEEPER_AGE
+
+available = pa is not None
+
+ARCHIVE_DIR = "likes_archive"
+# Most rows per row group (the unit a video filter can skip); each video starts a new one
+ROW_GROUP = 65_536
+
+SCHEMA = pa.schema([
+    ("video_id", pa.int32()), ("timestamp", pa.int64()), ("user_id", pa.int64()), ("id", pa.int64()),
+    ("created_at", pa.int64()), ("is_bot", pa.bool_()),
+]) if available else None
+
+def month_label(ts):
+    return datetime.fromtimestamp(max(0, min(ts, 253402300799)), timezone.utc).strftime("%Y-%m")
+
+def month_path(directory, start):
+    return os.path.join(directory, f"month={month_label(start)}", "likes.parquet")
+
+# --- Export ---
+
+def export_partition(conn, name, start, directory=ARCHIVE_DIR):
+    """Write partition table `name` (the month starting at `start`) to its Parquet file. Returns rows written."""
+    path = month_path(directory, start)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cur = conn.execute(f"""
+        SELECT l.video_id, l.timestamp, l.user_id, l.id, u.created_at, u.is_bot
+        FROM {name} l JOIN users u ON l.user_id = u.id
+        ORDER BY l.video_id, l.timestamp
+    """)
+    tmp = os.path.join(os.path.dirname(path), ".likes.parquet.tmp")  # dot files are not part of the dataset
+    rows = 0
+    with pq.ParquetWriter(tmp, SCHEMA, compression="zstd") as writer:
+        def flush(group):
+            cols = list(zip(*group))
+            cols[5] = [bool(b) for b in cols[5]]
+            writer.write_table(pa.Table.from_arrays([pa.array(c, f.type) for c, f in zip(cols, SCHEMA)], schema=SCHEMA))
+        # One row group per video (split every ROW_GROUP rows)
+        group = []
+        for row in cur:
+            if group and (row[0] != group[0][0] or len(group) >= ROW_GROUP):
+                flush(group)
+                group = []
+            group.append(row)
+            rows += 1
+        if group: flush(group)
+    os.replace(tmp, path)
+    return rows
+
+def export(conn, directory=ARCHIVE_DIR, force=False):
+    """Export every live partition without a Parquet file yet (all of them with force). Returns {partition: rows}."""
+    written = {}
+    for name, start in conn.execute("SELECT name, start FROM likes_partitions WHERE compacted_at IS NULL ORDER BY start").fetchall():
+        if force or not os.path.exists(month_path(directory, start)):
+            written[name] = export_partition(conn, name, start, directory)
+    return written
+
+# --- Queries ---
+
+class Archive:
+    """
+    Reader over the archive's files. Each file's footer is parsed once into a
+    video_id -> row groups index (re-read when the directory changes); a query then
+    memory-maps only the months overlapping its range and decodes only the requested
+    columns of that video's row groups whose timestamp statistics overlap it.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self._mtime = None
+        self.files = []  # (month, path, metadata, {video_id: [(row_group, min_ts, max_ts)]})
+        self._lock = threading.Lock()
+
+    def _open(self):
+        mtime = os.stat(self.directory).st_mtime_ns if os.path.isdir(self.directory) else None
+        if mtime == self._mtime: return self.files
+        with self._lock:
+            files = []
+            for entry in sorted(os.listdir(self.directory)) if mtime is not None else []:
+                path = os.path.join(self.directory, entry, "likes.parquet")
+                if not entry.startswith("month=") or not os.path.exists(path): continue
+                meta = pq.read_metadata(path)
+                groups = {}
+                for i in range(meta.num_row_groups):
+                    vid, ts = meta.row_group(i).column(0).statistics, meta.row_group(i).column(1).statistics
+                    groups.setdefault(vid.min, []).append((i, ts.min, ts.max))
+                files.append((entry[len("month="):], path, meta, groups))
+            self.files, self._mtime = files, mtime
+        return self.files
+
+    def months(self):
+        return [f[0] for f in self._open()]
+
+    def scan(self, video_id, start, end, columns):
+        """Columns of one video's archived likes in [start, end) as NumPy arrays, in (month, timestamp) order."""
+        first, last = month_label(start), month_label(end - 1)
+        tables = []
+        for month, path, meta, groups in self._open():
+            if not first <= month <= last: continue
+            picked = [i for i, lo, hi in groups.get(video_id, ()) if hi >= start and lo < end]
+            if picked:
+                tables.append(pq.ParquetFile(path, memory_map=True, metadata=meta).read_row_groups(picked, columns=list(dict.fromkeys(columns + ["timestamp"]))))
+        if not tables: return {c: np.empty(0, np.int64) for c in columns}
+        t = pa.concat_tables(tables)
+        ts = t["timestamp"].to_numpy()
+        keep = (ts >= start) & (ts < end)
+        return {c: t[c].to_numpy()[keep] for c in columns}
+
+    def likes(self, video_id, start, end):
+        """(user_id, timestamp, created_at, is_bot, id) of one video's archived likes in [start, end), oldest first."""
+        cols = self.scan(video_id, start, end, ["user_id", "timestamp", "created_at", "is_bot", "id"])
+        return list(zip(*(c.tolist() for c in cols.values())))
+
+    def series(self, video_id, width, start, end):
+        """Rows of (bucket_epoch, count, fresh_count, sleeper_count) like rollups.series, from archived likes."""
+        ts, created, bot = self.scan(video_id, start, end, ["timestamp", "created_at", "is_bot"]).values()
+        if not len(ts): return []
+        buckets, idx = np.unique(ts // width * width, return_inverse=True)
+        age = ts - created
+        count = np.bincount(idx, minlength=len(buckets))
+        fresh = np.bincount(idx, weights=age < FRESH_AGE, minlength=len(buckets)).astype(np.int64)
+        sleeper = np.bincount(idx, weights=bot & (age > SLEEPER_AGE), minlength=len(buckets)).astype(np.int64)
+        return list(zip(buckets.tolist(), count.tolist(), fresh.tolist(), sleeper.tolist()))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export archived likes partitions to Parquet, or list the archive.")
+    parser.add_argument("command", choices=["export", "list"])
+    parser.add_argument("--db", default=schema.DB_NAME)
+    parser.add_argument("--dir", default=ARCHIVE_DIR)
+    parser.add_argument("--force", action="store_true", help="export: rewrite months already exported")
+    args = parser.parse_args()
+
+    if not available:
+        sys.exit("pyarrow and numpy are needed for the Parquet archive; install them.")
+    conn = sqlite3.connect(args.db)
+    schema.migrate(conn)
+    if args.command == "export":
+        t0 = time.time()
+        written = export(conn, args.dir, args.force)
+        for name, n in written.items():
+            print(f"{name}: {n} likes")
+        print(f"Exported {sum(written.values())} likes in {len(written)} months to {args.dir} in {time.time() - t0:.1f}s")
+    else:
+        for month, path, meta, _ in Archive(args.dir)._open():
+            print(f"{month}: {meta.num_rows} likes, {meta.num_row_groups} row groups, {os.path.getsize(path) / 2**20:.1f} MB")
+    conn.close()
@@ -0,0 +1,115 @@
+"""
+NumPy analytics engine vs the SQLite path.
+
+    python -m benchmarks.analytics --likes 10000000
+    python -m benchmarks.analytics --db social_media_logs.db
+
+Times engine load/memory, the /api/activity handler both ways over --windows
+random (video, hour) windows, fresh-account counts over every hourly spike
+(get_security_briefing), a full per-(video, hour) aggregate, and an incremental
+refresh after one ingest batch.
+"""
+import os
+import random
+import resource
+import sqlite3
+import tempfile
+import time
+
+import analytics
+import db
+import ingest
+import rollups
+import schema
+import web_server
+from benchmarks.load import build_db
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t0
+
+def sql_fresh_counts(conn, windows):
+    return [conn.execute("""
+        SELECT COALESCE(SUM(l.timestamp - u.created_at < 48 * 3600), 0)
+        FROM likes l JOIN users u ON l.user_id = u.id
+        WHERE l.video_id = ? AND l.timestamp >= ? AND l.timestamp < ?
+    """, w).fetchone()[0] for w in windows]
+
+def sql_aggregate(conn):
+    return conn.execute(f"""
+        SELECT l.video_id, l.timestamp / 3600 * 3600 as bucket, COUNT(*),
+               SUM({rollups.FRESH_SQL}), SUM({rollups.SLEEPER_SQL})
+        FROM likes l JOIN users u ON l.user_id = u.id
+        GROUP BY l.video_id, bucket
+    """).fetchall()
+
+def run(db_name, windows, batch):
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    engine, load_s = timed(analytics.load, db_name)
+    rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Engine load: {len(engine)} likes in {load_s:.1f}s, peak RSS +{(rss1 - rss0) / 1024:.0f} MB")
+
+    pool = db.Pool(db_name)
+    with pool.reader() as conn:
+        hours = conn.execute("SELECT video_id, hour_epoch FROM likes_hourly").fetchall()
+        spike_windows = [tuple(r) for r in conn.execute(
+            "SELECT video_id, start, end FROM spikes WHERE resolution = 'hour'")]
+    rng = random.Random(3)
+    sample = [(vid, time.strftime("%Y-%m-%d %H", time.gmtime(h))) for vid, h in rng.sample(hours, min(windows, len(hours)))]
+
+    def activity(engine_or_none):
+        return [web_server.get_video_activity(vid, hour, pool, engine_or_none, cold=None) for vid, hour in sample]
+
+    rows = []
+    (a, sql_s), (b, np_s) = timed(activity, None), timed(activity, engine)
+    rows.append((f"/api/activity x{len(sample)}", sql_s, np_s, a == b))
+
+    with pool.reader() as conn:
+        (a, sql_s), (b, np_s) = timed(sql_fresh_counts, conn, spike_windows), timed(engine.fresh_counts, spike_windows)
+        rows.append((f"fresh counts, {len(spike_windows)} spikes", sql_s, np_s, a == b))
+
+        (a, sql_s), (b, np_s) = timed(sql_aggregate, conn), timed(engine.aggregate, 3600)
+        rows.append(("per-(video, hour) aggregate", sql_s, np_s,
+                     [tuple(r) for r in a] == list(zip(*(x.tolist() for x in b)))))
+
+    print(f"\n{'':32} {'SQLite':>10} {'NumPy':>10} {'speedup':>8}  same result")
+    for name, sql_s, np_s, same in rows:
+        print(f"{name:32} {sql_s * 1000:8.0f}ms {np_s * 1000:8.0f}ms {sql_s / np_s:7.1f}x  {same}")
+
+    # Incremental refresh after one ingest batch vs a full reload
+    now = int(time.time())
+    with pool.reader() as conn:
+        users, videos = conn.execute("SELECT MAX(id) FROM users").fetchone()[0], conn.execute("SELECT MAX(id) FROM videos").fetchone()[0]
+    ingest.apply_batch(pool.writer, [(rng.randint(1, users), rng.randint(0, videos), now - rng.randint(0, 3600))
+                                     for _ in range(batch)], now)
+    with pool.reader() as conn:
+        added, refresh_s = timed(engine.refresh, conn)
+    print(f"\nIncremental refresh: {added} new likes merged in {refresh_s * 1000:.0f}ms (full load {load_s:.1f}s)")
+    pool.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="Existing database (a copy is modified by the refresh step)")
+    parser.add_argument("--likes", type=int, default=10_000_000, help="Size of the scratch database")
+    parser.add_argument("--windows", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=ingest.BATCH_SIZE)
+    args = parser.parse_args()
+
+    if not analytics.available:
+        raise SystemExit("numpy is not installed.")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "analytics.db")
+        if args.db:
+            src = sqlite3.connect(args.db)
+            dst = sqlite3.connect(db_name)
+            src.backup(dst)
+            src.close()
+            dst.close()
+        else:
+            t0 = time.time()
+            build_db(db_name, args.likes)
+            print(f"Built {args.likes} likes scratch database in {time.time() - t0:.1f}s")
+        schema.DB_NAME = web_server.DB_NAME = db_name
+        run(db_name, args.windows, args.batch)
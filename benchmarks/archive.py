@@ -0,0 +1,105 @@
+"""
+Parquet archive vs SQLite partitions for year-long per-video series.
+
+    python -m benchmarks.archive --likes 5000000
+    python -m benchmarks.archive --db social_media_logs.db
+
+Builds a scratch database of --likes likes spread over one year (or copies --db),
+archives every month but the current one into partitions (partitions.py) and exports
+them to Parquet (archive.py). Then times the per-minute series of --videos random
+videos over the archived range both ways: SQLite through partitions.likes_sql (one
+index range scan per month, joined to users) and Archive.series (row groups pruned
+by video_id, three columns decoded).
+"""
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import archive
+import partitions
+import rollups
+import schema
+from benchmarks.ingest import setup_db
+
+YEAR = 365 * 86400
+
+def build_db(path, likes, users=100_000, videos=500):
+    now = int(time.time())
+    setup_db(path, users, videos, now)
+    conn = sqlite3.connect(path)
+    rng = random.Random(2)
+    conn.executemany("INSERT INTO likes (user_id, video_id, timestamp) VALUES (?, ?, ?)",
+                     ((rng.randint(1, users), rng.randrange(videos), now - YEAR + i * YEAR // likes) for i in range(likes)))
+    conn.commit()
+    conn.close()
+    return now
+
+def sql_series(conn, video_id, width, start, end):
+    return [tuple(r) for r in conn.execute(f"""
+        SELECT l.timestamp / {width} * {width} as bucket, COUNT(*), SUM({rollups.FRESH_SQL}), SUM({rollups.SLEEPER_SQL})
+        FROM {partitions.likes_sql(conn, start, end)} l JOIN users u ON l.user_id = u.id
+        WHERE l.video_id = ? AND l.timestamp >= ? AND l.timestamp < ?
+        GROUP BY bucket ORDER BY bucket
+    """, (video_id, start, end))]
+
+def run(db_name, now, videos):
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    schema.migrate(conn)
+    t0 = time.time()
+    conn.execute("BEGIN")
+    moved = partitions.archive(conn, 1, now)
+    conn.execute("COMMIT")
+    print(f"Archived {sum(moved.values())} likes into {len(moved)} partitions in {time.time() - t0:.1f}s")
+
+    directory = os.path.join(os.path.dirname(db_name), archive.ARCHIVE_DIR)
+    t0 = time.time()
+    written = archive.export(conn, directory)
+    size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(directory) for f in files)
+    print(f"Exported {sum(written.values())} likes to Parquet in {time.time() - t0:.1f}s "
+          f"({size / 2**20:.0f} MB vs {os.path.getsize(db_name) / 2**20:.0f} MB SQLite)")
+
+    start = conn.execute("SELECT MIN(start) FROM likes_partitions").fetchone()[0]
+    end = partitions.hot_since(conn)
+    ids = [r[0] for r in conn.execute("SELECT id FROM videos")]
+    sample = random.Random(3).sample(ids, min(videos, len(ids)))
+    cold = archive.Archive(directory)
+    cold.series(sample[0], 60, start, end)  # dataset discovery
+
+    print(f"\nPer-video series over {(end - start) / 86400:.0f} days, {len(sample)} videos")
+    print(f"{'':12} {'SQLite':>10} {'Parquet':>10} {'speedup':>8}  same result")
+    for name, width in (("minute", 60), ("hour", 3600)):
+        t0 = time.perf_counter()
+        a = [sql_series(conn, vid, width, start, end) for vid in sample]
+        sql_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        b = [cold.series(vid, width, start, end) for vid in sample]
+        pq_s = time.perf_counter() - t0
+        print(f"{name:12} {sql_s / len(sample) * 1000:8.1f}ms {pq_s / len(sample) * 1000:8.1f}ms {sql_s / pq_s:7.1f}x  {a == b}")
+    conn.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="Existing database (a copy is partitioned and archived)")
+    parser.add_argument("--likes", type=int, default=5_000_000, help="Size of the scratch database")
+    parser.add_argument("--videos", type=int, default=50)
+    args = parser.parse_args()
+
+    if not archive.available:
+        raise SystemExit("pyarrow is not installed.")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "archive.db")
+        if args.db:
+            src = sqlite3.connect(args.db)
+            dst = sqlite3.connect(db_name)
+            src.backup(dst)
+            src.close()
+            dst.close()
+            now = sqlite3.connect(db_name).execute("SELECT MAX(timestamp) FROM likes").fetchone()[0]
+        else:
+            t0 = time.time()
+            now = build_db(db_name, args.likes)
+            print(f"Built {args.likes} likes scratch database in {time.time() - t0:.1f}s")
+        run(db_name, now, args.videos)
@@ -0,0 +1,80 @@
+"""
+Sustained ingest throughput through ingest.LikeWriter.
+
+    python -m benchmarks.ingest --likes 2000000
+
+Builds a scratch database (users + videos only), streams synthetic likes from a
+generator (so the producer holds no more than one chunk) and reports likes/sec
+and peak RSS. Like timestamps advance at --event-rate likes per second of event
+time, i.e. the stream looks like live traffic arriving at that rate.
+"""
+import os
+import random
+import resource
+import sqlite3
+import tempfile
+import time
+
+import ingest
+import risk
+import schema
+
+def setup_db(path, users, videos, now):
+    conn = sqlite3.connect(path)
+    schema.create_schema(conn)
+    rng = random.Random(1)
+    conn.executemany("INSERT INTO users (id, username, created_at, is_bot) VALUES (?, ?, ?, ?)",
+                     ((i, f"user_{i}", now - rng.randint(0, 700 * 86400), False) for i in range(1, users + 1)))
+    conn.executemany("INSERT INTO videos (id, title, upload_date, archetype) VALUES (?, ?, ?, ?)",
+                     ((i, f"Video Title {i}", now - 180 * 86400, "steady") for i in range(videos)))
+    risk.rebuild(conn, now)
+    conn.commit()
+    conn.close()
+
+def like_stream(n, users, videos, start, rate):
+    """n likes arriving at `rate` per second starting at `start`, uniform over users/videos."""
+    rng = random.Random(2)
+    for i in range(n):
+        yield rng.randint(1, users), rng.randrange(videos), start + i // rate
+
+def run(likes, users, videos, batch_size, event_rate):
+    now = int(time.time())
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        setup_db(path, users, videos, now)
+
+        writer = ingest.LikeWriter(path, batch_size)
+        t0 = time.perf_counter()
+        writer.submit(like_stream(likes, users, videos, now - 3600, event_rate))
+        writer.flush()
+        elapsed = time.perf_counter() - t0
+        writer.close()
+
+        conn = sqlite3.connect(path)
+        stored = conn.execute("SELECT COUNT(*) FROM likes").fetchone()[0]
+        conn.close()
+
+    stats = writer.stats()
+    return {
+        "likes": likes,
+        "stored": stored,
+        "elapsed_s": round(elapsed, 2),
+        "end_to_end_likes_per_s": round(likes / elapsed),
+        "writer_likes_per_s": stats["rows_per_second"],
+        "batches": stats["batches"],
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--likes", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--videos", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=ingest.BATCH_SIZE)
+    parser.add_argument("--event-rate", type=int, default=100_000)
+    args = parser.parse_args()
+
+    result = run(args.likes, args.users, args.videos, args.batch_size, args.event_rate)
+    for k, v in result.items():
+        print(f"{k:>24}: {v}")
@@ -0,0 +1,186 @@
+"""
+Latency of /api/users/risk and /api/activity under concurrent clients, pooled vs per-request connections.
+
+    python -m benchmarks.load --clients 200 --requests 10
+    python -m benchmarks.load --db social_media_logs.db
+
+Without --db a scratch database of --likes synthetic likes is built first (the
+generated demo database is small enough to sit in any page cache). Starts the
+API with uvicorn in a child process (once with the db.Pool, once with the old
+connect-per-request behaviour swapped in via dependency_overrides) and fires
+--clients concurrent httpx clients at it. Reports p50/p99 per endpoint.
+
+--direct skips HTTP and calls the handlers from a 40-thread pool (the size of
+the threadpool FastAPI runs sync endpoints on), isolating the database side when
+the client and server would otherwise compete for the same cores.
+"""
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import httpx
+
+import db
+import risk
+import rollups
+import schema
+import spikes
+from benchmarks.ingest import like_stream, setup_db
+
+class ConnectPerRequest:
+    """Baseline: a fresh sqlite3 connection for every request, as before db.Pool."""
+
+    def __init__(self, pool):
+        self.writer = pool.writer
+
+    @contextmanager
+    def reader(self):
+        conn = sqlite3.connect(schema.DB_NAME)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+def serve(db_name, port, mode):
+    import uvicorn
+    import web_server
+    schema.DB_NAME = web_server.DB_NAME = db_name
+    web_server.RUN_SCHEDULER = False  # no background detection runs mid-measurement
+    if mode == "per-request":
+        web_server.app.dependency_overrides[web_server.get_pool] = \
+            lambda: ConnectPerRequest(web_server.app.state.db)
+    uvicorn.run(web_server.app, host="127.0.0.1", port=port, log_level="warning")
+
+def build_db(path, likes, users=100_000, videos=500):
+    now = int(time.time())
+    setup_db(path, users, videos, now)
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO likes (user_id, video_id, timestamp) VALUES (?, ?, ?)",
+                     like_stream(likes, users, videos, now - likes, 1))
+    rollups.rebuild(conn)
+    spikes.detect_all(conn, now)
+    risk.rebuild(conn, now)
+    conn.commit()
+    conn.close()
+
+def pick_targets(db_name, n):
+    """Real (video_id, hour) pairs with traffic, so /api/activity returns rows."""
+    conn = sqlite3.connect(db_name)
+    rows = conn.execute("""
+        SELECT video_id, hour_epoch FROM likes_hourly ORDER BY count DESC LIMIT ?
+    """, (n,)).fetchall()
+    conn.close()
+    return [(vid, time.strftime("%Y-%m-%d %H", time.gmtime(h))) for vid, h in rows]
+
+def percentile(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(p / 100 * len(xs)))]
+
+async def hammer(base, clients, requests, targets):
+    latencies = {"/api/users/risk": [], "/api/activity": []}
+    errors = 0
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=120) as http:
+        async def client(i):
+            nonlocal errors
+            for j in range(requests):
+                if (i + j) % 2:
+                    path, params = "/api/users/risk", {"limit": 50}
+                else:
+                    vid, hour = targets[(i + j) % len(targets)]
+                    path, params = "/api/activity", {"video_id": vid, "hour": hour}
+                t0 = time.perf_counter()
+                r = await http.get(path, params=params)
+                latencies[path].append((time.perf_counter() - t0) * 1000)
+                if r.status_code != 200: errors += 1
+        await asyncio.gather(*(client(i) for i in range(clients)))
+    return latencies, errors
+
+def report(mode, latencies, errors, elapsed, clients):
+    total = sum(len(v) for v in latencies.values())
+    print(f"\n[{mode}] {total} requests from {clients} clients in {elapsed:.1f}s "
+          f"({total / elapsed:.0f} req/s, {errors} errors)")
+    for path, xs in latencies.items():
+        print(f"  {path:<18} p50 {percentile(xs, 50):7.1f} ms   p99 {percentile(xs, 99):7.1f} ms   "
+              f"mean {statistics.mean(xs):7.1f} ms")
+
+def run_direct(db_name, mode, clients, requests, threads=40):
+    import web_server
+    schema.DB_NAME = web_server.DB_NAME = db_name
+    web_server.RUN_SCHEDULER = False  # no background detection runs mid-measurement
+    pool = db.Pool(db_name)
+    conns = pool if mode == "pool" else ConnectPerRequest(pool)
+    targets = pick_targets(db_name, 50)
+
+    def call(i):
+        t0 = time.perf_counter()
+        if i % 2:
+            web_server.get_user_risk(50, None, conns)
+            return "/api/users/risk", (time.perf_counter() - t0) * 1000
+        vid, hour = targets[i % len(targets)]
+        web_server.get_video_activity(vid, hour, conns, None, cold=None)
+        return "/api/activity", (time.perf_counter() - t0) * 1000
+
+    latencies = {"/api/users/risk": [], "/api/activity": []}
+    with ThreadPoolExecutor(threads) as ex:
+        list(ex.map(call, range(threads * 4)))  # warm-up
+        t0 = time.perf_counter()
+        for path, ms in ex.map(call, range(clients * requests)):
+            latencies[path].append(ms)
+        elapsed = time.perf_counter() - t0
+    pool.close()
+    report(f"{mode}, direct", latencies, 0, elapsed, clients)
+
+def run(db_name, mode, clients, requests, port):
+    proc = multiprocessing.Process(target=serve, args=(db_name, port, mode), daemon=True)
+    proc.start()
+    base = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"{base}/api/videos", timeout=1)
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        targets = pick_targets(db_name, 50)
+        asyncio.run(hammer(base, 10, 2, targets))  # warm-up
+        t0 = time.perf_counter()
+        latencies, errors = asyncio.run(hammer(base, clients, requests, targets))
+        elapsed = time.perf_counter() - t0
+    finally:
+        proc.terminate()
+        proc.join()
+    report(mode, latencies, errors, elapsed, clients)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="Existing database to serve (default: build a scratch one)")
+    parser.add_argument("--likes", type=int, default=2_000_000, help="Size of the scratch database")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=10, help="Requests per client")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mode", choices=["both", "pool", "per-request"], default="both")
+    parser.add_argument("--direct", action="store_true", help="Call handlers in-process instead of over HTTP")
+    args = parser.parse_args()
+
+    modes = ["per-request", "pool"] if args.mode == "both" else [args.mode]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = args.db
+        if db_name is None:
+            db_name = os.path.join(tmp, "load.db")
+            t0 = time.time()
+            build_db(db_name, args.likes)
+            print(f"Built {args.likes} likes scratch database in {time.time() - t0:.1f}s")
+        for i, mode in enumerate(modes):
+            if args.direct:
+                run_direct(db_name, mode, args.clients, args.requests)
+            else:
+                run(db_name, mode, args.clients, args.requests, args.port + i)
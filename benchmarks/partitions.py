@@ -0,0 +1,126 @@
+"""
+Clustered (WITHOUT ROWID) vs rowid likes partitions: size and archived-range queries.
+
+    python -m benchmarks.partitions --likes 10000000
+    python -m benchmarks.partitions --db social_media_logs.db
+
+Builds a scratch database of --likes likes spread over one year (or copies --db),
+then archives every month but the current one twice: into rowid partitions with
+separate video and user indexes (the layout before partitions.PARTITION_SQL) and
+into the clustered layout. Reports the bytes per archived like of each (dbstat)
+and times, over the archived months:
+
+    activity      one video-hour of likes joined to users (/api/activity)
+    video days    a video's daily counts over the archived range
+    user history  a user's like count and last like across every partition
+    export scan   one month in (video_id, timestamp) order (archive.py export)
+"""
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import partitions
+import schema
+from benchmarks.archive import build_db
+
+def rowid_partition(conn, name):
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {name} (id INTEGER PRIMARY KEY, user_id INTEGER, video_id INTEGER, timestamp INTEGER)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_video_ts ON {name}(video_id, timestamp, user_id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_user_ts ON {name}(user_id, timestamp, video_id)")
+
+def archive(db_name, now, create):
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    schema.migrate(conn)
+    partitions.create_partition, saved = create, partitions.create_partition
+    try:
+        t0 = time.time()
+        conn.execute("BEGIN")
+        moved = partitions.archive(conn, 1, now)
+        conn.execute("COMMIT")
+        seconds = time.time() - t0
+    finally:
+        partitions.create_partition = saved
+    names = list(moved)
+    size = conn.execute("""
+        SELECT SUM(pgsize) FROM dbstat
+        WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name IN (SELECT value FROM json_each(?)))
+    """, (json.dumps(names),)).fetchone()[0]
+    conn.close()
+    return sum(moved.values()), seconds, size
+
+def workload(conn, rng, n):
+    start = conn.execute("SELECT MIN(start) FROM likes_partitions").fetchone()[0]
+    end = partitions.hot_since(conn)
+    videos = [r[0] for r in conn.execute("SELECT id FROM videos")]
+    users = conn.execute("SELECT MAX(id) FROM users").fetchone()[0]
+    source = partitions.likes_sql(conn, start, end)
+    hours = [(rng.choice(videos), start + rng.randrange((end - start) // 3600) * 3600) for _ in range(n)]
+    month = partitions.overlapping(conn)[0]
+    return {
+        "activity": [(f"""
+            SELECT u.username, u.is_bot, u.created_at, l.timestamp FROM {partitions.likes_sql(conn, h, h + 3600)} l
+            JOIN users u ON l.user_id = u.id WHERE l.video_id = ? AND l.timestamp >= ? AND l.timestamp < ?
+            ORDER BY l.timestamp""", (vid, h, h + 3600)) for vid, h in hours],
+        "video days": [(f"""
+            SELECT l.timestamp / 86400, COUNT(*) FROM {source} l
+            WHERE l.video_id = ? AND l.timestamp >= ? AND l.timestamp < ? GROUP BY 1""", (vid, start, end))
+            for vid in rng.sample(videos, min(n // 10, len(videos)))],
+        "user history": [(f"SELECT COUNT(*), MAX(l.timestamp) FROM {source} l WHERE l.user_id = ?", (rng.randint(1, users),))
+                         for _ in range(n)],
+        "export scan": [(f"SELECT video_id, timestamp, user_id, id FROM {month} ORDER BY video_id, timestamp", ())],
+    }
+
+def timed(db_name, queries):
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+    for sql, params in queries: conn.execute(sql, params).fetchall()  # warm the page cache
+    t0 = time.perf_counter()
+    rows = [conn.execute(sql, params).fetchall() for sql, params in queries]
+    seconds = (time.perf_counter() - t0) / len(queries)
+    conn.close()
+    return seconds, rows
+
+def run(db_name, now, queries):
+    copy = db_name.replace(".db", "_rowid.db")
+    src, dst = sqlite3.connect(db_name), sqlite3.connect(copy)
+    src.backup(dst)
+    src.close()
+    dst.close()
+
+    print(f"{'':14} {'rowid':>12} {'clustered':>12}")
+    a = archive(copy, now, rowid_partition)
+    b = archive(db_name, now, partitions.create_partition)
+    print(f"{'archive':14} {a[1]:11.1f}s {b[1]:11.1f}s   ({a[0]} likes moved)")
+    print(f"{'bytes/like':14} {a[2] / a[0]:12.1f} {b[2] / b[0]:12.1f}   ({a[2] / 2**20:.0f} MB vs {b[2] / 2**20:.0f} MB, -{100 - 100 * b[2] / a[2]:.0f}%)")
+
+    conn = sqlite3.connect(db_name)
+    work = workload(conn, random.Random(4), queries)
+    conn.close()
+    for name, qs in work.items():
+        (ta, ra), (tb, rb) = timed(copy, qs), timed(db_name, qs)
+        print(f"{name:14} {ta * 1000:10.2f}ms {tb * 1000:10.2f}ms   {ta / tb:.2f}x  same result: {ra == rb}")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="Existing database (a copy is archived both ways)")
+    parser.add_argument("--likes", type=int, default=10_000_000, help="Size of the scratch database")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "partitions.db")
+        if args.db:
+            src = sqlite3.connect(args.db)
+            dst = sqlite3.connect(db_name)
+            src.backup(dst)
+            src.close()
+            dst.close()
+            now = sqlite3.connect(db_name).execute("SELECT MAX(timestamp) FROM likes").fetchone()[0]
+        else:
+            t0 = time.time()
+            now = build_db(db_name, args.likes)
+            print(f"Built {args.likes} likes scratch database in {time.time() - t0:.1f}s")
+        run(db_name, now, args.queries)
@@ -0,0 +1,122 @@
+"""
+Serialization time and bytes on the wire of a 100k-row /api/activity response.
+
+    python -m benchmarks.responses --rows 100000
+
+Builds a scratch database with one video-hour of --rows likes (every tenth liker a
+fresh account, every seventh a bot), then times each stage of the response, best
+of --repeat runs:
+
+    rows      SQL rows -> dicts via activity_row (before) / tuples via activity_rows
+    encode    FastAPI's jsonable_encoder + JSONResponse (before) / responses.rows with
+              orjson and with stdlib json, as objects and as {"columns", "rows"}
+    compress  gzip and brotli (responses.GZIP_LEVEL / BROTLI_QUALITY) of both layouts
+
+and the whole request through the app (TestClient, SQL path) for each layout and
+Accept-Encoding, with the bytes that went over the wire.
+"""
+import os
+import statistics
+import sqlite3
+import tempfile
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import db
+import responses
+import schema
+from benchmarks.ingest import setup_db
+
+def build(path, n):
+    now = int(time.time())
+    hour = now // 3600 * 3600 - 3600
+    setup_db(path, n + 1000, 5, now)
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE users SET created_at = ? WHERE id % 10 = 0", (hour - 3600,))
+    conn.execute("UPDATE users SET is_bot = 1 WHERE id % 7 = 0")
+    conn.executemany("INSERT INTO likes (user_id, video_id, timestamp) VALUES (?, 1, ?)",
+                     ((i + 1, hour + i * 3600 // n) for i in range(n)))
+    conn.commit()
+    conn.close()
+    return hour
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return result, min(times) * 1000
+
+def stages(db_name, hour, repeat):
+    import web_server
+    conn = db.connect_reader(db_name)
+    rows = conn.execute("""
+        SELECT u.username, u.is_bot, u.created_at, l.timestamp FROM likes l JOIN users u ON l.user_id = u.id
+        WHERE l.video_id = 1 AND l.timestamp >= ? AND l.timestamp < ? ORDER BY l.timestamp
+    """, (hour, hour + 3600)).fetchall()
+    conn.close()
+    print(f"{len(rows)} rows\n")
+
+    dicts, t_dicts = best(lambda: [web_server.activity_row(r) for r in rows], repeat)
+    tuples, t_tuples = best(lambda: web_server.activity_rows(rows), repeat)
+    print(f"{'rows':10} {'dicts (before)':24} {t_dicts:8.1f} ms")
+    print(f"{'':10} {'tuples':24} {t_tuples:8.1f} ms\n")
+
+    before, t_before = best(lambda: JSONResponse(jsonable_encoder(dicts)).body, repeat)
+    print(f"{'encode':10} {'jsonable_encoder + json':24} {t_before:8.1f} ms {len(before):12,} bytes")
+    bodies = {}
+    saved = responses.orjson
+    for encoder in ("orjson", "json"):
+        if encoder == "json": responses.orjson = None
+        elif saved is None: continue
+        for layout in responses.LAYOUTS:
+            body, ms = best(lambda: responses.rows(web_server.ACTIVITY_COLUMNS, tuples, layout).body, repeat)
+            bodies[layout] = bodies.get(layout, body)
+            print(f"{'':10} {f'{encoder} {layout}':24} {ms:8.1f} ms {len(body):12,} bytes   {t_before / ms:5.1f}x")
+    responses.orjson = saved
+    print()
+
+    label = "compress"
+    for layout, body in bodies.items():
+        for encoding in ("gzip", "br") if responses.brotli is not None else ("gzip",):
+            out, ms = best(lambda: responses.Encoder(encoding).compress(body, True), repeat)
+            print(f"{label:10} {f'{encoding} {layout}':24} {ms:8.1f} ms {len(out):12,} bytes   {len(body) / len(out):5.1f}x smaller")
+            label = ""
+    print()
+
+def end_to_end(hour, repeat):
+    from fastapi.testclient import TestClient
+    import web_server
+    params = {"video_id": 1, "hour": time.strftime("%Y-%m-%d %H", time.gmtime(hour))}
+    label = "request"
+    with TestClient(web_server.app) as client:
+        client.get("/api/activity", params=params)  # warm-up
+        for layout in responses.LAYOUTS:
+            for encoding in ("identity", "gzip", "br") if responses.brotli is not None else ("identity", "gzip"):
+                times = []
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    with client.stream("GET", "/api/activity", params=dict(params, format=layout),
+                                       headers={"accept-encoding": encoding}) as r:
+                        wire = sum(len(chunk) for chunk in r.iter_raw())
+                    times.append((time.perf_counter() - t0) * 1000)
+                print(f"{label:10} {f'{layout} {encoding}':24} {statistics.median(times):8.1f} ms {wire:12,} bytes on the wire")
+                label = ""
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "responses.db")
+        hour = build(db_name, args.rows)
+        schema.DB_NAME = db_name
+        os.environ.update(DB_PATH=db_name, DETECTION_SCHEDULER="0")
+        stages(db_name, hour, args.repeat)
+        end_to_end(hour, args.repeat)
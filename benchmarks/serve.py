@@ -0,0 +1,141 @@
+"""
+Throughput of serve.py as worker processes are added.
+
+    python -m benchmarks.serve --workers 1,2,4,8 --seconds 20
+    python -m benchmarks.serve --db social_media_logs.db --loaders 8
+
+Without --db a scratch database of --likes likes is built first. For each worker
+count it starts `serve.py --workers N` (ANALYTICS_ENGINE=1, so the workers map one
+shared snapshot; no scheduler) and keeps it saturated for --seconds from --loaders
+client processes with --concurrency connections each, over a CPU-bound mix:
+
+    risk        /api/users/risk?limit=200 (scoring + a 200-row JSON body)
+    activity    /api/activity of busy video-hours (engine flags per like)
+    profile     /api/users/{username}
+
+Reports requests/s, the speedup and per-worker efficiency against one worker,
+p50/p99 latency and the workers' memory (summed PSS, so pages of the snapshot
+shared by every worker are counted once). The clients need cores too: scaling is
+only meaningful while workers + loaders stay within os.cpu_count().
+"""
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.load import build_db, percentile, pick_targets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def requests_for(db_name, n=50):
+    conn = sqlite3.connect(db_name)
+    users = [r[0] for r in conn.execute("SELECT u.username FROM users u JOIN user_risk r ON r.user_id = u.id ORDER BY r.risk_score DESC LIMIT ?", (n,))]
+    conn.close()
+    return ([("/api/users/risk", {"limit": 200})] +
+            [("/api/activity", {"video_id": vid, "hour": hour}) for vid, hour in pick_targets(db_name, n)] +
+            [(f"/api/users/{u}", {}) for u in users])
+
+async def drive(base, concurrency, seconds, mix):
+    done, errors, latencies = 0, 0, []
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=120) as http:
+        async def client(i):
+            nonlocal done, errors
+            j = i
+            while time.perf_counter() < deadline:
+                # Every third request is the risk ranking, the rest cycle through activity and profiles
+                path, params = mix[0] if j % 3 == 0 else mix[1 + j % (len(mix) - 1)]
+                t0 = time.perf_counter()
+                r = await http.get(path, params=params)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                done += 1
+                if r.status_code != 200: errors += 1
+                j += 1
+        await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return done, errors, latencies
+
+def loader(args):
+    return asyncio.run(drive(*args))
+
+def pss_mb(pid):
+    """Summed PSS of a process's children (the uvicorn workers; itself with one worker), in MB; None off Linux."""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = f.read().split() or [pid]
+        total = 0
+        for child in children:
+            with open(f"/proc/{child}/smaps_rollup") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("Pss:"))
+        return total / 1024
+    except (OSError, StopIteration):
+        return None
+
+def run(db_name, workers, loaders, concurrency, seconds, port, snapshot_dir):
+    env = dict(os.environ, ANALYTICS_ENGINE="1", DETECTION_SCHEDULER="0")
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "serve.py"), "--db", db_name, "--workers", str(workers),
+                             "--port", str(port), "--host", "127.0.0.1", "--snapshot-dir", snapshot_dir, "--log-level", "warning"],
+                            env=env, cwd=ROOT, stdout=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(600):
+            try:
+                if httpx.get(f"{base}/api/videos", timeout=1).status_code == 200: break
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        time.sleep(1)  # let every worker finish its lifespan
+        mix = requests_for(db_name)
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(loaders) as pool:
+            pool.map(loader, [(base, concurrency, 2, mix)] * loaders)  # warm-up
+            t0 = time.perf_counter()
+            results = pool.map(loader, [(base, concurrency, seconds, mix)] * loaders)
+            elapsed = time.perf_counter() - t0
+        memory = pss_mb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+    done = sum(r[0] for r in results)
+    latencies = [ms for r in results for ms in r[2]]
+    return done / elapsed, sum(r[1] for r in results), percentile(latencies, 50), percentile(latencies, 99), memory
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="Existing database to serve (default: build a scratch one)")
+    parser.add_argument("--likes", type=int, default=2_000_000, help="Size of the scratch database")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    parser.add_argument("--loaders", type=int, default=4, help="Client processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="Connections per client process")
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--port", type=int, default=8775)
+    args = parser.parse_args()
+
+    counts = [int(n) for n in args.workers.split(",")]
+    cores = os.cpu_count() or 1
+    print(f"{cores} cores, {args.loaders} client processes x {args.concurrency} connections")
+    if max(counts) + args.loaders > cores:
+        print(f"warning: {max(counts)} workers + {args.loaders} loaders exceed {cores} cores; scaling will flatten early")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = args.db
+        if db_name is None:
+            db_name = os.path.join(tmp, "serve.db")
+            t0 = time.time()
+            build_db(db_name, args.likes)
+            print(f"Built {args.likes} likes scratch database in {time.time() - t0:.1f}s")
+        print(f"{'workers':>7} {'req/s':>8} {'speedup':>8} {'eff.':>6} {'p50 ms':>8} {'p99 ms':>8} {'PSS MB':>8} {'errors':>7}")
+        base_rate = None
+        for i, n in enumerate(counts):
+            rate, errors, p50, p99, memory = run(db_name, n, args.loaders, args.concurrency, args.seconds,
+                                                 args.port + i, os.path.join(tmp, "snapshot"))
+            base_rate = base_rate or rate / counts[0]
+            speedup = rate / base_rate
+            print(f"{n:7} {rate:8.0f} {speedup:7.2f}x {speedup / n:6.0%} {p50:8.1f} {p99:8.1f} "
+                  f"{memory if memory is None else round(memory):>8} {errors:7}")
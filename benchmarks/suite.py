@@ -0,0 +1,245 @@
+"""
+Latency/throughput of every API endpoint and agent tool at several data scales.
+
+    python -m benchmarks.suite --scales 10k,1m --out bench.json
+    python -m benchmarks.suite --scales 10k,1m --out new.json --baseline bench.json
+    python -m benchmarks.suite --compare bench.json new.json
+
+Datasets are built once per scale with data_gen (fixed seed) under --data-dir and
+reused by later runs. Each scale runs in its own process, so its peak RSS is its
+own. Handlers and tools are called in-process (no HTTP): --iterations sequential
+calls give p50/p95/p99 and VM steps per call, then the same calls from --threads
+threads give throughput. VM steps (counted with a SQLite progress handler on
+every pool connection) stand in for rows scanned: sqlite3 exposes no per-query
+row counters, and unlike latency they do not depend on the machine.
+
+With --baseline (or --compare) any endpoint whose p95 or VM steps grew by more than
+--tolerance fails the run (exit code 1).
+"""
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import data_gen
+import db
+import profiles
+import schema
+import velocity
+
+# name -> data_gen.generate_data arguments
+SCALES = {
+    "10k": dict(likes=10_000, users=1_500, videos=50, attacks=3),
+    "1m": dict(likes=1_000_000, users=100_000, videos=500, attacks=10, botnets=3, attack_size=500),
+    "10m": dict(likes=10_000_000, users=1_000_000, videos=2_000, attacks=20, botnets=5, attack_size=2_000),
+    "100m": dict(likes=100_000_000, users=5_000_000, videos=10_000, attacks=50, botnets=10, attack_size=2_000),
+}
+SEED = 1
+NOW = 1_790_000_000  # fixed reference time, so every build of a scale is identical
+
+PROGRESS_STEPS = 100  # VM instructions per progress callback
+MIN_REGRESSION_MS = 1.0  # p95 changes smaller than this are noise
+
+# --- Datasets ---
+
+def dataset(data_dir, scale):
+    """Path of the scale's database, building it (and its labels) if missing."""
+    path = os.path.join(data_dir, f"bench_{scale}.db")
+    labels = os.path.join(data_dir, f"bench_{scale}.labels.json")
+    if not (os.path.exists(path) and os.path.exists(labels)):
+        os.makedirs(data_dir, exist_ok=True)
+        t0 = time.time()
+        data_gen.generate_data(path + ".tmp", seed=SEED, now=NOW, workers=os.cpu_count(),
+                               labels=labels, **SCALES[scale])
+        os.replace(path + ".tmp", path)
+        print(f"Built {scale} dataset in {time.time() - t0:.0f}s")
+    # Datasets cached by an older checkout are brought up to the current schema
+    conn = sqlite3.connect(path, isolation_level=None)
+    schema.migrate(conn, verbose=True)
+    conn.close()
+    return path, labels
+
+def workload(db_name, labels, rng, n=50):
+    """Realistic arguments: attacked (video, hour)s, detected spikes, a mix of bot and organic usernames."""
+    with open(labels) as f:
+        truth = json.load(f)
+    conn = sqlite3.connect(db_name)
+    hour = lambda ts: time.strftime("%Y-%m-%d %H", time.gmtime(ts))
+    windows = [(a["video_id"], hour(a["start"])) for a in truth["attacks"]]
+    windows += [(v, hour(s)) for v, s in conn.execute(
+        "SELECT video_id, start FROM spikes WHERE resolution = 'hour' ORDER BY score DESC LIMIT ?", (n,))]
+    bots = [i for ids in truth["kinds"].values() for i in ids]
+    max_user = conn.execute("SELECT MAX(id) FROM users").fetchone()[0]
+    ids = rng.sample(bots, min(n // 2, len(bots))) + [rng.randint(1, max_user) for _ in range(n // 2)]
+    usernames = [conn.execute("SELECT username FROM users WHERE id = ?", (i,)).fetchone()[0] for i in ids]
+    videos = [v for v, _ in windows] + [rng.randrange(conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0])
+                                         for _ in range(n)]
+    conn.close()
+    return {"windows": windows, "usernames": usernames, "videos": videos}
+
+def cases(pool, args):
+    """name -> fn(i) making the i-th call. Handlers get their Depends arguments explicitly."""
+    import web_server
+    with pool.writer.transaction() as conn:
+        tracker = velocity.load(conn, now=NOW)
+    profile_cache = profiles.ProfileCache(tracker=tracker)
+    tools = web_server.build_tools(pool, None, profile_cache=profile_cache)
+    w, u, v = args["windows"], args["usernames"], args["videos"]
+    return {
+        "GET /api/users/risk": lambda i: web_server.get_user_risk(50, None, pool, tracker=tracker),
+        "GET /api/users/risk?search": lambda i: web_server.get_user_risk(20, u[i % len(u)][5:8], pool, tracker=tracker),
+        "GET /api/users/{username}": lambda i: web_server.get_user_details_api(u[i % len(u)], pool, profile_cache),
+        "GET /api/likes/{video_id}": lambda i: web_server.get_video_likes_series(v[i % len(v)], None, None, "hour", 2000, pool, None),
+        "GET /api/activity": lambda i: web_server.get_video_activity(w[i % len(w)][0], w[i % len(w)][1], pool, None, cold=None),
+        "tool get_video_stats": lambda i: tools["get_video_stats"](video_id=v[i % len(v)]),
+        "tool analyze_hourly_spike": lambda i: tools["analyze_hourly_spike"](video_id=w[i % len(w)][0], target_hour=w[i % len(w)][1]),
+        "tool fetch_suspicious_users": lambda i: tools["fetch_suspicious_users"](video_id=w[i % len(w)][0], target_hour=w[i % len(w)][1]),
+        "tool get_user_details": lambda i: tools["get_user_details"](username=u[i % len(u)]),
+        "GET /api/clusters": lambda i: web_server.list_clusters(3, 20, pool),
+        "tool get_security_briefing": lambda i: tools["get_security_briefing"](limit=5),
+        "tool get_coordinated_clusters": lambda i: tools["get_coordinated_clusters"](limit=5),
+        "tool run_read_only_sql": lambda i: tools["run_read_only_sql"](
+            sql_query=f"SELECT user_id, timestamp FROM likes WHERE video_id = {v[i % len(v)]} ORDER BY timestamp DESC LIMIT 20"),
+    }
+
+# --- Measurement ---
+
+def percentile(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(p / 100 * len(xs)))]
+
+def count_vm_steps(pool, counter):
+    """
+    Install a progress handler adding to counter[0] on every connection of the pool.
+    Re-run before each case: sql_guard replaces the handler on the connection it uses
+    (so run_read_only_sql's own steps are not counted here; the tool reports them itself).
+    """
+    def tick():
+        counter[0] += PROGRESS_STEPS
+        return 0
+    conns = [pool._idle.get() for _ in range(pool.size)]
+    for conn in conns + [pool.writer.conn]:
+        conn.set_progress_handler(tick, PROGRESS_STEPS)
+    for conn in conns:
+        pool._idle.put(conn)
+
+def measure(fn, iterations, threads, steps):
+    for i in range(3): fn(i)  # warm-up
+    latencies, vm = [], []
+    for i in range(iterations):
+        before = steps[0]
+        t0 = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        vm.append(steps[0] - before)
+    with ThreadPoolExecutor(threads) as ex:
+        t0 = time.perf_counter()
+        list(ex.map(fn, range(iterations)))
+        throughput = iterations / (time.perf_counter() - t0)
+    return {
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "throughput_per_s": round(throughput, 1),
+        "vm_steps": round(sum(vm) / len(vm)),
+    }
+
+def run_scale(scale, data_dir, iterations, threads):
+    import web_server
+    db_name, labels = dataset(data_dir, scale)
+    schema.DB_NAME = web_server.DB_NAME = db_name
+    rng = random.Random(SEED)
+    args = workload(db_name, labels, rng)
+    pool = db.Pool(db_name)
+    steps = [0]
+    results = {}
+    for name, fn in cases(pool, args).items():
+        count_vm_steps(pool, steps)
+        results[name] = measure(fn, iterations, threads, steps)
+        r = results[name]
+        print(f"  [{scale}] {name:32} p50 {r['p50_ms']:8.2f}ms  p95 {r['p95_ms']:8.2f}ms  p99 {r['p99_ms']:8.2f}ms  "
+              f"{r['throughput_per_s']:8.0f}/s  {r['vm_steps']:>10} steps", flush=True)
+    with pool.reader() as conn:
+        likes = conn.execute("SELECT MAX(id) FROM likes").fetchone()[0]
+    pool.close()
+    return {
+        "likes": likes,
+        "db_mb": round(os.path.getsize(db_name) / 2**20, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "endpoints": results,
+    }
+
+def run(scales, data_dir, iterations, threads):
+    report = {
+        "meta": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "cpus": os.cpu_count(),
+                 "iterations": iterations, "threads": threads, "time": int(time.time())},
+        "scales": {},
+    }
+    ctx = multiprocessing.get_context("spawn")
+    for scale in scales:
+        print(f"Scale {scale}:")
+        with ctx.Pool(1) as proc:
+            report["scales"][scale] = proc.apply(run_scale, (scale, data_dir, iterations, threads))
+        print(f"  peak RSS {report['scales'][scale]['peak_rss_mb']} MB")
+    return report
+
+# --- Comparison ---
+
+def compare(baseline, current, tolerance):
+    """Regressions (as printable lines) of current vs baseline, for scales/endpoints present in both."""
+    regressions = []
+    for scale, cur in current["scales"].items():
+        base = baseline["scales"].get(scale)
+        if not base: continue
+        for name, r in cur["endpoints"].items():
+            b = base["endpoints"].get(name)
+            if not b: continue
+            if r["p95_ms"] > b["p95_ms"] * (1 + tolerance) and r["p95_ms"] - b["p95_ms"] > MIN_REGRESSION_MS:
+                regressions.append(f"[{scale}] {name}: p95 {b['p95_ms']}ms -> {r['p95_ms']}ms")
+            if r["vm_steps"] > b["vm_steps"] * (1 + tolerance) + PROGRESS_STEPS:
+                regressions.append(f"[{scale}] {name}: VM steps {b['vm_steps']} -> {r['vm_steps']}")
+    return regressions
+
+def check(baseline_path, current, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = compare(baseline, current, tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    print(f"{len(regressions)} regressions vs {baseline_path} (tolerance {tolerance:.0%})")
+    return not regressions
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", default="10k,1m", help=f"Comma-separated, from {list(SCALES)}")
+    parser.add_argument("--data-dir", default="bench_data")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--baseline", help="Fail if this run regresses against the given results file")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two results files without running")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[1]) as f:
+            sys.exit(0 if check(args.compare[0], json.load(f), args.tolerance) else 1)
+
+    scales = args.scales.split(",")
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown:
+        raise SystemExit(f"Unknown scales {unknown}; choose from {list(SCALES)}")
+    report = run(scales, args.data_dir, args.iterations, args.threads)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+    if args.baseline and not check(args.baseline, report, args.tolerance):
+        sys.exit(1)
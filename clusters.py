@@ -0,0 +1,255 @@
+import sqlite3
+import sys
+import time
+from collections import Counter, defaultdict
+from itertools import combinations
+
+try:
+    import numpy as np
+    from scipy import sparse
+    from scipy.sparse.csgraph import connected_components
+except ImportError:  # optional: clusters can still be served and updated incrementally without it
+    np = sparse = None
+
+import partitions
+import schema
+
+available = sparse is not None
+
+# Two users co-engage when they like the same video within the same WINDOW-second bucket.
+WINDOW = 60
+# Pairs that co-engaged in at least this many buckets are linked ("repeatedly").
+MIN_SHARED = 2
+# Buckets with more distinct users than this are skipped: a viral moment is not
+# coordination, and the pair count grows with the square of the bucket size.
+MAX_BUCKET_USERS = 500
+# Clusters smaller than this are stored but not reported.
+MIN_CLUSTER_SIZE = 3
+
+FETCH_CHUNK = 250_000
+
+# Tables (see schema.py):
+#   co_engagement(user_a < user_b, shared)   buckets each pair shared
+#   user_clusters(user_id, cluster_id)       connected components of pairs with shared >= min_shared
+#   clusters(id, size, edges, updated_at)    id = smallest member user id
+#   cluster_meta(window, min_shared, max_bucket_users, built_at)   parameters of the last rebuild
+
+# --- Full Rebuild ---
+
+def _fetch(conn, window):
+    cur = conn.execute("SELECT video_id, timestamp / ?, user_id FROM likes", (window,))
+    chunks = []
+    while True:
+        rows = cur.fetchmany(FETCH_CHUNK)
+        if not rows: break
+        chunks.append(np.array(rows, dtype=np.int64).reshape(-1, 3))
+    data = np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.int64)
+    return (data[:, 0] << 32) | data[:, 1], data[:, 2]
+
+def compute(conn, window=WINDOW, min_shared=MIN_SHARED, max_bucket_users=MAX_BUCKET_USERS):
+    """
+    Co-engagement graph from every like, as arrays:
+      edges     (user_a, user_b, shared) for every pair that shared a bucket (user_a < user_b)
+      clusters  (user_id, cluster_id) for every user in a component of >= 2 users
+    The graph is B^T B for the sparse bucket x user incidence matrix B; components
+    come from scipy's connected_components over the pairs with shared >= min_shared.
+    """
+    bucket, user = _fetch(conn, window)
+    # One entry per (bucket, user)
+    order = np.lexsort((user, bucket))
+    bucket, user = bucket[order], user[order]
+    first = np.ones(len(bucket), dtype=bool)
+    first[1:] = (bucket[1:] != bucket[:-1]) | (user[1:] != user[:-1])
+    bucket, user = bucket[first], user[first]
+
+    _, b_idx = np.unique(bucket, return_inverse=True)
+    sizes = np.bincount(b_idx)
+    keep = (sizes[b_idx] >= 2) & (sizes[b_idx] <= max_bucket_users)
+    _, b_idx = np.unique(b_idx[keep], return_inverse=True)
+    users, u_idx = np.unique(user[keep], return_inverse=True)
+
+    incidence = sparse.csr_matrix((np.ones(len(u_idx), dtype=np.int32), (b_idx, u_idx)),
+                                  shape=(int(b_idx.max()) + 1 if len(b_idx) else 0, len(users)))
+    shared = sparse.triu(incidence.T @ incidence, k=1).tocoo()
+    a, b, n = shared.row, shared.col, shared.data
+
+    strong = n >= min_shared
+    graph = sparse.coo_matrix((np.ones(strong.sum(), dtype=np.int8), (a[strong], b[strong])), shape=(len(users),) * 2)
+    _, labels = connected_components(graph, directed=False)
+    linked = np.zeros(len(users), dtype=bool)
+    linked[a[strong]] = linked[b[strong]] = True
+    cluster_id = np.full(labels.max() + 1 if len(labels) else 0, np.iinfo(np.int64).max)
+    np.minimum.at(cluster_id, labels[linked], users[linked])
+
+    return {
+        "edges": (users[a], users[b], n.astype(np.int64)),
+        "clusters": (users[linked], cluster_id[labels[linked]]),
+        "strong": (users[a[strong]], cluster_id[labels[a[strong]]]),
+    }
+
+def rebuild(conn, now=None, window=WINDOW, min_shared=MIN_SHARED, max_bucket_users=MAX_BUCKET_USERS):
+    """Recompute the graph and clusters from every like and replace the stored ones."""
+    if not available:
+        raise RuntimeError("numpy and scipy are required to rebuild clusters")
+    now = int(now if now is not None else time.time())
+    result = compute(conn, window, min_shared, max_bucket_users)
+    conn.execute("DELETE FROM co_engagement")
+    conn.execute("DELETE FROM user_clusters")
+    conn.execute("DELETE FROM clusters")
+    conn.execute("DELETE FROM cluster_meta")
+    conn.executemany("INSERT INTO co_engagement (user_a, user_b, shared) VALUES (?, ?, ?)",
+                     zip(*(x.tolist() for x in result["edges"])))
+    members, cids = result["clusters"]
+    conn.executemany("INSERT INTO user_clusters (user_id, cluster_id) VALUES (?, ?)",
+                     zip(members.tolist(), cids.tolist()))
+    ids, sizes = np.unique(cids, return_counts=True)
+    edges = np.zeros(len(ids), dtype=np.int64)
+    np.add.at(edges, np.searchsorted(ids, result["strong"][1]), 1)
+    conn.executemany("INSERT INTO clusters (id, size, edges, updated_at) VALUES (?, ?, ?, ?)",
+                     ((i, s, e, now) for i, s, e in zip(ids.tolist(), sizes.tolist(), edges.tolist())))
+    conn.execute("INSERT INTO cluster_meta (window, min_shared, max_bucket_users, built_at) VALUES (?, ?, ?, ?)",
+                 (window, min_shared, max_bucket_users, now))
+    return len(ids)
+
+# --- Incremental Updates ---
+
+def apply_likes(conn, likes, now=None):
+    """
+    Fold a batch of new likes (user_id, video_id, timestamp) into the graph.
+    Must run BEFORE the likes are inserted: the users already in each touched bucket
+    are read from likes (idx_likes_video_ts), and only new user x existing user and
+    new x new pairs are counted. Pairs reaching min_shared merge their clusters.
+    Does nothing until rebuild() has run (no cluster_meta row).
+    A bucket that grows past max_bucket_users stops gaining pairs but keeps the ones
+    it had; rebuild() drops such buckets entirely.
+    """
+    meta = conn.execute("SELECT window, min_shared, max_bucket_users FROM cluster_meta").fetchone()
+    if meta is None: return 0
+    window, min_shared, max_bucket_users = meta
+    now = int(now if now is not None else time.time())
+
+    touched = defaultdict(set)
+    for uid, vid, ts in likes:
+        touched[(vid, ts // window)].add(uid)
+    pairs = Counter()
+    for (vid, b), new in touched.items():
+        old = {r[0] for r in conn.execute(
+            "SELECT DISTINCT user_id FROM likes WHERE video_id = ? AND timestamp >= ? AND timestamp < ?",
+            (vid, b * window, (b + 1) * window))}
+        new -= old
+        if not new or len(old) + len(new) > max_bucket_users: continue
+        for u in new:
+            for v in old:
+                pairs[(u, v) if u < v else (v, u)] += 1
+        for u, v in combinations(sorted(new), 2):
+            pairs[(u, v)] += 1
+
+    merges = 0
+    for (a, b), n in pairs.items():
+        shared = conn.execute("""
+            INSERT INTO co_engagement (user_a, user_b, shared) VALUES (?, ?, ?)
+            ON CONFLICT (user_a, user_b) DO UPDATE SET shared = shared + excluded.shared
+            RETURNING shared
+        """, (a, b, n)).fetchone()[0]
+        if shared >= min_shared > shared - n:
+            merges += _link(conn, a, b, now)
+    return merges
+
+def _cluster(conn, user_id):
+    row = conn.execute("""
+        SELECT c.id, c.size, c.edges FROM user_clusters uc JOIN clusters c ON c.id = uc.cluster_id
+        WHERE uc.user_id = ?
+    """, (user_id,)).fetchone()
+    return tuple(row) if row else (None, 1, 0)
+
+def _link(conn, a, b, now):
+    """Record a new strong edge a-b; merges their clusters (singletons count as size 1). Returns 1 on a merge."""
+    ca, sa, ea = _cluster(conn, a)
+    cb, sb, eb = _cluster(conn, b)
+    if ca is not None and ca == cb:
+        conn.execute("UPDATE clusters SET edges = edges + 1, updated_at = ? WHERE id = ?", (now, ca))
+        return 0
+    new = min(ca if ca is not None else a, cb if cb is not None else b)
+    for cid, user in ((ca, a), (cb, b)):
+        if cid is None:
+            conn.execute("INSERT INTO user_clusters (user_id, cluster_id) VALUES (?, ?)", (user, new))
+        elif cid != new:
+            conn.execute("UPDATE user_clusters SET cluster_id = ? WHERE cluster_id = ?", (new, cid))
+    conn.execute("DELETE FROM clusters WHERE id IN (?, ?)", (ca, cb))
+    conn.execute("INSERT INTO clusters (id, size, edges, updated_at) VALUES (?, ?, ?, ?)",
+                 (new, sa + sb, ea + eb + 1, now))
+    return 1
+
+# --- Queries ---
+
+def top(conn, min_size=MIN_CLUSTER_SIZE, limit=20, sample=5):
+    """Largest clusters with member stats (bots, fresh/dormant accounts, mean risk) and their riskiest members."""
+    result = []
+    for c in conn.execute("SELECT id, size, edges, updated_at FROM clusters WHERE size >= ? ORDER BY size DESC, id LIMIT ?",
+                          (min_size, limit)).fetchall():
+        stats = conn.execute("""
+            SELECT SUM(r.is_bot), SUM(r.age_bucket = 'fresh'), SUM(r.age_bucket = 'dormant'), AVG(r.risk_score)
+            FROM user_clusters uc JOIN user_risk r ON r.user_id = uc.user_id WHERE uc.cluster_id = ?
+        """, (c[0],)).fetchone()
+        members = [r[0] for r in conn.execute("""
+            SELECT r.username FROM user_clusters uc JOIN user_risk r ON r.user_id = uc.user_id
+            WHERE uc.cluster_id = ? ORDER BY r.risk_score DESC, r.total_likes DESC LIMIT ?
+        """, (c[0], sample))]
+        result.append({
+            "id": c[0], "size": c[1], "edges": c[2], "updated_at": c[3],
+            "bots": stats[0] or 0, "fresh": stats[1] or 0, "dormant": stats[2] or 0,
+            "avg_risk": round(stats[3] or 0, 1), "sample": members,
+        })
+    return result
+
+def members(conn, cluster_id, columns, limit=100):
+    return conn.execute(f"""
+        SELECT {columns} FROM user_risk
+        WHERE user_id IN (SELECT user_id FROM user_clusters WHERE cluster_id = ?)
+        ORDER BY risk_score DESC, total_likes DESC LIMIT ?
+    """, (cluster_id, limit)).fetchall()
+
+def user_cluster(conn, user_id):
+    """{"id", "size"} of the user's cluster, or None."""
+    cid, size, _ = _cluster(conn, user_id)
+    return {"id": cid, "size": size} if cid is not None else None
+
+def check(conn):
+    """Differences between the stored clusters and a fresh compute() (empty when in sync)."""
+    meta = conn.execute("SELECT window, min_shared, max_bucket_users FROM cluster_meta").fetchone()
+    if meta is None: return ["clusters have not been built"]
+    fresh = compute(conn, *meta)
+    expected = dict(zip(*(x.tolist() for x in fresh["clusters"])))
+    stored = dict(conn.execute("SELECT user_id, cluster_id FROM user_clusters").fetchall())
+    problems = [f"user {u}: stored cluster {stored.get(u)}, expected {c}" for u, c in expected.items() if stored.get(u) != c]
+    problems += [f"user {u}: stored in cluster {c}, expected none" for u, c in stored.items() if u not in expected]
+    return problems
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Co-engagement clusters (coordinated like behaviour).")
+    parser.add_argument("command", choices=["rebuild", "check", "top"])
+    parser.add_argument("--db", default=schema.DB_NAME)
+    parser.add_argument("--window", type=int, default=WINDOW)
+    parser.add_argument("--min-shared", type=int, default=MIN_SHARED)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    schema.migrate(conn)
+    partitions.full_history(conn)  # include archived months
+    if args.command == "rebuild":
+        t0 = time.time()
+        conn.execute("BEGIN")
+        n = rebuild(conn, window=args.window, min_shared=args.min_shared)
+        conn.execute("COMMIT")
+        print(f"{n} clusters rebuilt in {time.time() - t0:.1f}s")
+    elif args.command == "check":
+        problems = check(conn)
+        for p in problems[:20]:
+            print(p)
+        print(f"{len(problems)} differences from a full recompute")
+        sys.exit(1 if problems else 0)
+    for c in top(conn, limit=10):
+        print(f"cluster {c['id']}: {c['size']} users, {c['edges']} links, {c['bots']} bots, "
+              f"{c['fresh']} fresh, avg risk {c['avg_risk']} e.g. {', '.join(c['sample'])}")
+    conn.close()
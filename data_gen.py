@@ -1,165 +1,286 @@
+import json
 import sqlite3
-import random
-from datetime import datetime, timedelta, timezone
+import time
+from collections import deque
+from multiprocessing import Pool
 
-DB_NAME = "social_media_logs.db"
+import numpy as np
 
-def create_db():
-    conn = sqlite3.connect(DB_NAME)
+import clusters
+import profiles
+import risk
+import rollups
+import schema
+import spikes
+
+DB_NAME = schema.DB_NAME
+
+DAY = 86400
+
+# Defaults reproduce the original demo database (1500 users, 50 videos, the attack on video 20),
+# plus two repeat attacks by the same accounts elsewhere, so coordinated clusters show up
+USERS = 1500
+VIDEOS = 50
+LIKES = 15_000  # organic likes; attack likes come on top
+USER_MIX = {"organic": 1000, "sleeper": 300, "fresh": 200}  # relative weights
+ARCHETYPES = {"viral": 10, "flop": 20, "steady": 40, "dead": 30}
+ATTACKS = 3
+ATTACK_VIDEO = 20
+ATTACK_MINUTES = 15
+
+# Relative organic volume per video, drawn uniformly from these ranges
+VOLUME = {"viral": (500, 2000), "steady": (100, 500), "flop": (50, 200), "dead": (0, 20)}
+
+CHUNK_SIZE = 500_000  # likes generated (and inserted) per task
+
+# --- Users & Videos ---
+
+def make_users(rng, users, mix, now):
+    """
+    Columns for every user. Ids are assigned explicitly in kind order (organic,
+    sleeper, fresh), so labels never depend on autoincrement. Usernames are a random
+    permutation, so nothing in the name gives the kind away.
+    """
+    weights = np.array(list(mix.values()), dtype=float)
+    counts = np.floor(users * weights / weights.sum()).astype(np.int64)
+    counts[0] += users - counts.sum()
+    kind = np.repeat(np.arange(len(mix)), counts)
+    ids = np.arange(1, users + 1)
+    created = np.empty(users, dtype=np.int64)
+    organic, sleeper, fresh = (kind == i for i in range(3))
+    # Organic: created over the last 2 years; sleepers: old accounts; fresh: < 48 hours ago
+    created[organic] = now - 730 * DAY + rng.integers(0, 700 * DAY, organic.sum())
+    created[sleeper] = now - 730 * DAY + rng.integers(0, 365 * DAY, sleeper.sum())
+    created[fresh] = now - 48 * 3600 + rng.integers(0, 2800 * 60, fresh.sum())
+    names = 10_000 + rng.permutation(users)
+    return ids, kind, created, names
+
+def make_videos(rng, videos, archetypes, now):
+    names = list(archetypes)
+    weights = np.array(list(archetypes.values()), dtype=float)
+    atype = rng.choice(len(names), size=videos, p=weights / weights.sum())
+    # Video 20 is the default attack target; keep its organic traffic steady
+    if videos > ATTACK_VIDEO and "steady" in names: atype[ATTACK_VIDEO] = names.index("steady")
+    upload = now - 180 * DAY + rng.integers(0, 170 * DAY, videos)
+    return [(i, names[atype[i]], int(upload[i])) for i in range(videos)]
+
+# --- Likes ---
+
+def plan_likes(rng, videos, likes, chunk_size):
+    """Split `likes` organic likes over videos by archetype volume, as tasks of <= chunk_size likes."""
+    volume = np.array([rng.integers(*VOLUME.get(atype, (0, 20)), endpoint=True) for _, atype, _ in videos], dtype=float)
+    if volume.sum() == 0: volume[:] = 1
+    per_video = np.floor(likes * volume / volume.sum()).astype(np.int64)
+    per_video[np.argmax(volume)] += likes - per_video.sum()
+    tasks = []
+    for (vid, atype, upload), n in zip(videos, per_video.tolist()):
+        for start in range(0, n, chunk_size):
+            tasks.append((vid, atype, upload, min(chunk_size, n - start)))
+    return tasks
+
+def organic_likes(task, seed, organic_users, now):
+    """One chunk of organic likes for one video: (user_id, video_id, timestamp) arrays."""
+    vid, atype, upload, n = task
+    rng = np.random.default_rng(seed)
+    days_live = max(0, (now - upload) // DAY)
+    if atype == "viral":
+        # Slow start, big peak, long tail
+        delay = rng.gamma(2, 5, n).astype(np.int64)
+    elif atype == "flop":
+        # Most likes on day one, nothing after a few days
+        delay = rng.gamma(1, 1, n).astype(np.int64)
+    elif atype == "steady":
+        delay = rng.integers(0, days_live, n, endpoint=True)
+    else:
+        delay = rng.integers(0, 10, n, endpoint=True)
+    ts = upload + np.minimum(delay, days_live) * DAY + rng.integers(0, DAY, n)
+    # Likes that would land in the future are spread over the video's lifetime instead
+    late = ts > now
+    ts[late] = upload + rng.integers(0, max(1, now - upload), late.sum())
+    users = rng.integers(1, organic_users + 1, n)
+    return users, np.full(n, vid, dtype=np.int64), ts
+
+def _run_task(args):
+    return organic_likes(*args)
+
+def generate_chunks(tasks, seeds, organic_users, now, workers):
+    """
+    Yield like chunks in task order. With workers > 1 the chunks are generated in a
+    process pool, at most 2 per worker ahead of the consumer so memory stays bounded.
+    """
+    jobs = [(task, seed, organic_users, now) for task, seed in zip(tasks, seeds)]
+    if workers <= 1:
+        yield from map(_run_task, jobs)
+        return
+    with Pool(workers) as pool:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.apply_async(_run_task, (job,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def make_attacks(rng, attacks, attack_size, attack_minutes, fresh_share, bots, videos, now, botnets=1):
+    """
+    Coordinated like bursts. The first hits video 20 yesterday at 14:00 (the demo
+    scenario); the rest hit random videos at random hours over the last 30 days.
+    Bots are split into `botnets` fixed groups and attack i is run by group
+    i % botnets, which reuses the same accounts (in the same order) every time, as real
+    botnets do. Each attack uses attack_size of them, fresh_share being fresh accounts
+    created before the attack starts (every eligible member if attack_size is None).
+    """
+    bot_ids, bot_kind, bot_created = bots
+    order = rng.permutation(len(bot_ids))
+    bot_ids, bot_kind, bot_created = bot_ids[order], bot_kind[order], bot_created[order]
+    net = np.arange(len(bot_ids)) % botnets
+    result = []
+    for i in range(attacks):
+        if i == 0 and len(videos) > ATTACK_VIDEO:
+            vid = ATTACK_VIDEO
+            start = (now - DAY) // DAY * DAY + 14 * 3600
+        else:
+            vid = int(rng.integers(0, len(videos)))
+            start = (now - int(rng.integers(1, 30 * DAY))) // 3600 * 3600
+        mine = net == i % botnets
+        sleepers = bot_ids[mine & (bot_kind == 1)]
+        fresh = bot_ids[mine & (bot_kind == 2) & (bot_created < start)]
+        if attack_size is None:
+            members = np.concatenate([sleepers, fresh])
+        else:
+            n_fresh = min(len(fresh), round(attack_size * fresh_share))
+            n_sleep = min(len(sleepers), attack_size - n_fresh)
+            members = np.concatenate([fresh[:n_fresh], sleepers[:n_sleep]])
+        members = rng.permutation(members)
+        ts = start + rng.integers(0, attack_minutes * 60, len(members))
+        result.append({"id": i, "botnet": i % botnets, "video_id": vid, "start": int(start),
+                       "end": int(start + attack_minutes * 60), "user_ids": members, "timestamps": ts})
+    return result
+
+# --- Database ---
+
+def create_db(db_name=DB_NAME):
+    conn = sqlite3.connect(db_name)
     c = conn.cursor()
+    for table in schema.DERIVED_TABLES:
+        c.execute(f"DROP TABLE IF EXISTS {table}")
     c.execute("DROP TABLE IF EXISTS likes")
     c.execute("DROP TABLE IF EXISTS videos")
     c.execute("DROP TABLE IF EXISTS users")
-    
-    c.execute("""CREATE TABLE users (
-        id INTEGER PRIMARY KEY,
-        username TEXT,
-        created_at TEXT, -- ISO format
-        is_bot BOOLEAN
-    )""")
-    
-    c.execute("""CREATE TABLE videos (
-        id INTEGER PRIMARY KEY,
-        title TEXT,
-        upload_date TEXT,
-        archetype TEXT -- 'viral', 'flop', 'steady', 'dead'
-    )""")
-    
-    c.execute("""CREATE TABLE likes (
-        id INTEGER PRIMARY KEY,
-        user_id INTEGER,
-        video_id INTEGER,
-        timestamp TEXT,
-        FOREIGN KEY(user_id) REFERENCES users(id),
-        FOREIGN KEY(video_id) REFERENCES videos(id)
-    )""")
-    conn.commit()
+
+    # Indexes are built once after the bulk load (much cheaper than maintaining them per insert)
+    schema.create_schema(conn, indexes=False)
+    # Throwaway database until generation finishes: no rollback journal, no fsync
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
     return conn
 
-def generate_data():
-    conn = create_db()
-    cursor = conn.cursor()
-    
-    print("Generating Users...")
-    users = []
-    # 1000 Organic Users (Created over last 2 years)
-    start_date = datetime.now(timezone.utc) - timedelta(days=730)
-    for i in range(1000):
-        created = start_date + timedelta(days=random.randint(0, 700))
-        users.append((f"user_{random.randint(10000, 99999)}", created.isoformat(), False))
-    
-    # 300 Sleeper Bots (Old accounts, inactive until attack)
-    for i in range(300):
-        created = start_date + timedelta(days=random.randint(0, 365))
-        # Anonymized: looks like normal user
-        users.append((f"user_{random.randint(10000, 99999)}", created.isoformat(), True))
-
-    # 200 Fresh Bots (Created very recently, < 48 hours ago)
-    recent_start = datetime.now(timezone.utc) - timedelta(hours=48)
-    for i in range(200):
-        created = recent_start + timedelta(minutes=random.randint(0, 2800))
-        # Anonymized
-        users.append((f"user_{random.randint(10000, 99999)}", created.isoformat(), True))
-
-    cursor.executemany("INSERT INTO users (username, created_at, is_bot) VALUES (?, ?, ?)", users)
-    
-    # Need to keep track of organic vs bot IDs for like generation?
-    # IDs are auto-increment.
-    # 1-1000: Organic
-    # 1001-1300: Sleepers
-    # 1301-1500: Fresh
-    # This assumption holds because of insertion order.
-    
-    print("Generating Videos...")
-    videos = []
-    archetypes = ['viral', 'flop', 'steady', 'dead']
-    # 50 Videos uploaded in last 6 months
-    vid_start = datetime.now(timezone.utc) - timedelta(days=180)
-    
-    for i in range(50):
-        upload = vid_start + timedelta(days=random.randint(0, 170))
-        atype = random.choices(archetypes, weights=[10, 20, 40, 30])[0]
-        # Make Video 20 specifically the attack target, steady usually
-        if i == 20: atype = 'steady' 
-        
-        videos.append((i, f"Video Title {i} ({atype})", upload.isoformat(), atype))
-        
-    cursor.executemany("INSERT INTO videos (id, title, upload_date, archetype) VALUES (?, ?, ?, ?)", videos)
-
-    print("Generating Likes (Attributes-based)...")
-    likes = []
-    
-    # Simulation Window: Last 6 months
-    # We iterate by hour? No, that's too slow.
-    # We iterate by video and generate based on its curve.
-    
-    for vid_id, title, upload_str, atype in videos:
-        upload_dt = datetime.fromisoformat(upload_str)
-        now = datetime.now(timezone.utc)
-        days_live = (now - upload_dt).days
-        if days_live < 0: continue
-        
-        # Determine total organic likes based on archetype
-        organic_volume = 0
-        if atype == 'viral': organic_volume = random.randint(500, 2000)
-        elif atype == 'steady': organic_volume = random.randint(100, 500)
-        elif atype == 'flop': organic_volume = random.randint(50, 200)
-        else: organic_volume = random.randint(0, 20)
-        
-        # Distribute likes
-        for _ in range(organic_volume):
-            # Choose a user (mostly organic)
-            uid = random.randint(1, 1000) # Organic users are 1-1000
-            
-            # Time distribution
-            delay_days = 0
-            if atype == 'viral':
-                # Viral: Slow start, huge spike, long tail
-                # Simplified: Gamma-ish distribution
-                delay_days = int(random.gammavariate(2, 5))
-            elif atype == 'flop':
-                # Flop: Huge start, effectively zero after 3 days
-                delay_days = int(random.gammavariate(1, 1))
-            elif atype == 'steady':
-                # Steady: Uniform-ish over time
-                delay_days = random.randint(0, days_live if days_live > 0 else 0)
-            else:
-                delay_days = random.randint(0, 10)
-
-            if delay_days > days_live: delay_days = days_live
-            
-            # Add random hour
-            like_time = upload_dt + timedelta(days=delay_days, hours=random.randint(0,23), minutes=random.randint(0,59))
-            likes.append((uid, vid_id, like_time.isoformat()))
-
-    # --- SIMULATE ATTACK ---
-    # Target: Video 20
-    # Time: Yesterday at 14:00
-    target_vid = 20
-    attack_time_base = datetime.now(timezone.utc) - timedelta(days=1)
-    attack_time_base = attack_time_base.replace(hour=14, minute=0, second=0, microsecond=0)
-    
-    print(f"Injecting Bot Attack on Video {target_vid} at {attack_time_base.isoformat()}...")
-    
-    # Attackers: 200 Fresh Bots + 100 Sleepers
-    # IDs: Fresh (1301-1500), Sleepers (1001-1300) -> Wait, user IDs are auto-assigned.
-    # Organic: 1-1000. Sleepers: 1001-1300. Fresh: 1301-1500.
-    
-    attackers = list(range(1001, 1500)) # All bots
-    random.shuffle(attackers)
-    
-    for uid in attackers:
-        # Tightly clustered around 14:00 - 14:15
-        offset = timedelta(minutes=random.randint(0, 15), seconds=random.randint(0, 59))
-        ts = attack_time_base + offset
-        likes.append((uid, target_vid, ts.isoformat()))
-        
-    print(f"Total Likes Generated: {len(likes)}")
-    cursor.executemany("INSERT INTO likes (user_id, video_id, timestamp) VALUES (?, ?, ?)", likes)
-    
+def write_labels(path, seed, ids, kind, attacks):
+    kinds = list(USER_MIX)
+    labels = {
+        "seed": seed,
+        "kinds": {k: ids[kind == i].tolist() for i, k in enumerate(kinds) if k != "organic"},
+        "attacks": [{"id": a["id"], "botnet": a["botnet"], "video_id": a["video_id"], "start": a["start"], "end": a["end"],
+                     "user_ids": sorted(a["user_ids"].tolist())} for a in attacks],
+    }
+    with open(path, "w") as f:
+        json.dump(labels, f)
+
+def generate_data(db_name=DB_NAME, users=USERS, videos=VIDEOS, likes=LIKES, user_mix=USER_MIX,
+                  archetypes=ARCHETYPES, attacks=ATTACKS, botnets=1, attack_size=None, attack_minutes=ATTACK_MINUTES,
+                  fresh_share=0.4, seed=None, workers=1, chunk_size=CHUNK_SIZE, labels=None, now=None):
+    """
+    Build a synthetic database. Organic likes are generated per video in chunks
+    (optionally across `workers` processes) and streamed straight into SQLite;
+    attacks are injected on top. `labels` is a JSON path for the ground truth
+    (bot ids by kind and each attack's botnet, video, window and members).
+    """
+    now = int(time.time()) if now is None else now
+    seq = np.random.SeedSequence(seed)
+    print(f"Seed: {seq.entropy}")
+    rng = np.random.default_rng(seq)
+    user_mix = {k: user_mix.get(k, 0) for k in USER_MIX}
+    conn = create_db(db_name)
+    t0 = time.time()
+
+    print(f"Generating {users} Users...")
+    ids, kind, created, names = make_users(rng, users, user_mix, now)
+    conn.executemany("INSERT INTO users (id, username, created_at, is_bot) VALUES (?, ?, ?, ?)",
+                     zip(ids.tolist(), (f"user_{n}" for n in names.tolist()), created.tolist(), (kind > 0).tolist()))
+
+    print(f"Generating {videos} Videos...")
+    vids = make_videos(rng, videos, archetypes, now)
+    conn.executemany("INSERT INTO videos (id, title, upload_date, archetype) VALUES (?, ?, ?, ?)",
+                     ((vid, f"Video Title {vid} ({atype})", upload, atype) for vid, atype, upload in vids))
+
+    tasks = plan_likes(rng, vids, likes, chunk_size)
+    print(f"Generating {likes} organic Likes in {len(tasks)} chunks ({workers} workers)...")
+    written = 0
+    organic_users = max(1, int((kind == 0).sum()))
+    for u, v, ts in generate_chunks(tasks, seq.spawn(len(tasks)), organic_users, now, workers):
+        conn.executemany("INSERT INTO likes (user_id, video_id, timestamp) VALUES (?, ?, ?)",
+                         zip(u.tolist(), v.tolist(), ts.tolist()))
+        written += len(u)
+        if len(u) == chunk_size: print(f"  {written}/{likes} likes ({written / (time.time() - t0):.0f}/s)")
+
+    bot = kind > 0
+    attack_list = make_attacks(rng, attacks, attack_size, attack_minutes, fresh_share,
+                               (ids[bot], kind[bot], created[bot]), vids, now, botnets)
+    for a in attack_list:
+        print(f"Injecting Bot Attack on Video {a['video_id']} at {schema.to_iso(a['start'])} ({len(a['user_ids'])} bots)...")
+        conn.executemany("INSERT INTO likes (user_id, video_id, timestamp) VALUES (?, ?, ?)",
+                         zip(a["user_ids"].tolist(), [a["video_id"]] * len(a["user_ids"]), a["timestamps"].tolist()))
+        written += len(a["user_ids"])
+    conn.commit()
+    print(f"Total Likes Generated: {written} ({time.time() - t0:.1f}s)")
+
+    print("Building indexes...")
+    schema.create_indexes(conn)
+    print("Building rollups and detecting spikes...")
+    rollups.rebuild(conn)
+    spikes.detect_all(conn, now)
+    print("Building user risk features...")
+    risk.rebuild(conn, now)
+    profiles.rebuild(conn)
+    if clusters.available:
+        print("Clustering co-engaged users...")
+        clusters.rebuild(conn, now)
     conn.commit()
+    conn.execute("PRAGMA journal_mode=DELETE")
     conn.close()
-    print("Database generation complete.")
+
+    if labels:
+        write_labels(labels, seq.entropy, ids, kind, attack_list)
+        print(f"Wrote ground-truth labels to {labels}")
+    print(f"Database generation complete ({time.time() - t0:.1f}s).")
 
 if __name__ == "__main__":
-    generate_data()
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate a synthetic social media database with organic and bot traffic.")
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--users", type=int, default=USERS)
+    parser.add_argument("--videos", type=int, default=VIDEOS)
+    parser.add_argument("--likes", type=int, default=LIKES, help="Organic likes (attack likes are added on top)")
+    parser.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in USER_MIX.items()),
+                        help="User kind weights, e.g. organic=90,sleeper=6,fresh=4")
+    parser.add_argument("--archetypes", default=",".join(f"{k}={v}" for k, v in ARCHETYPES.items()),
+                        help="Video archetype weights")
+    parser.add_argument("--attacks", type=int, default=ATTACKS)
+    parser.add_argument("--botnets", type=int, default=1, help="Fixed groups of bots; attack i is run by group i %% botnets")
+    parser.add_argument("--attack-size", type=int, help="Bots per attack (default: every bot)")
+    parser.add_argument("--attack-minutes", type=int, default=ATTACK_MINUTES)
+    parser.add_argument("--fresh-share", type=float, default=0.4, help="Share of fresh accounts in each attack")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--labels", help="Write ground-truth labels (JSON) to this path")
+    parser.add_argument("--now", type=int, help="Reference epoch time (default: current time); fix with --seed for identical output")
+    args = parser.parse_args()
+
+    def weights(spec):
+        return {k: float(v) for k, v in (item.split("=") for item in spec.split(","))}
+
+    generate_data(args.db, args.users, args.videos, args.likes, weights(args.mix), weights(args.archetypes),
+                  args.attacks, args.botnets, args.attack_size, args.attack_minutes, args.fresh_share, args.seed,
+                  args.workers, args.chunk_size, args.labels, args.now)
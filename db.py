@@ -0,0 +1,118 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+import schema
+
+# Read connections kept open for the API. Each request checks one out, so this
+# also caps how many handlers hit SQLite at once; the rest wait in acquire().
+POOL_SIZE = 8
+ACQUIRE_TIMEOUT = 30
+
+# Per-connection tuning
+MMAP_MB = 256
+READER_CACHE_MB = 64
+WRITER_CACHE_MB = 256
+STATEMENT_CACHE = 256  # prepared statements reused per connection (keyed on SQL text)
+
+def connect_writer(db_name=schema.DB_NAME):
+    """
+    Open a writer connection: WAL so readers are never blocked, relaxed fsync per commit.
+    Autocommit mode (isolation_level=None); callers issue BEGIN/COMMIT themselves.
+    """
+    conn = sqlite3.connect(db_name, check_same_thread=False, isolation_level=None,
+                           cached_statements=STATEMENT_CACHE, factory=metrics.TimedConnection)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    # Keep the hot index pages (likes by user, user_risk) resident between batches
+    conn.execute(f"PRAGMA cache_size=-{WRITER_CACHE_MB * 1024}")
+    # Checkpoint less often but in bigger, more sequential chunks
+    conn.execute("PRAGMA wal_autocheckpoint=10000")
+    return conn
+
+def connect_reader(db_name=schema.DB_NAME):
+    """Open a read-only connection (mode=ro + query_only) with mmap'd reads and sqlite3.Row rows."""
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE, factory=metrics.TimedConnection)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only=1")
+    conn.execute(f"PRAGMA mmap_size={MMAP_MB * 1024 * 1024}")
+    conn.execute(f"PRAGMA cache_size=-{READER_CACHE_MB * 1024}")
+    return conn
+
+class Writer:
+    """
+    The single writer connection, serialized by a lock.
+    `version` counts committed transactions; caches compare it to detect new data.
+    """
+
+    def __init__(self, db_name=schema.DB_NAME):
+        self.conn = connect_writer(db_name)
+        self.lock = threading.Lock()
+        self.version = 0
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+                self.conn.execute("COMMIT")
+                self.version += 1
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class Pool:
+    """
+    A fixed set of read-only connections plus the single Writer.
+    The writer is opened first so the database is in WAL mode before any reader attaches.
+    """
+
+    def __init__(self, db_name=schema.DB_NAME, size=POOL_SIZE):
+        self.db_name = db_name
+        self.writer = Writer(db_name)
+        self._idle = queue.LifoQueue()  # LIFO: reuse the connection with the warmest cache
+        for _ in range(size):
+            self._idle.put(connect_reader(db_name))
+        self.size = size
+        # Only for data_version (untimed: it runs on every cache lookup)
+        self._watch = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True, check_same_thread=False)
+        self._watch_lock = threading.Lock()
+
+    @contextmanager
+    def reader(self, timeout=ACQUIRE_TIMEOUT):
+        """Check out a read connection for the duration of the block."""
+        try:
+            conn = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection free after {timeout}s")
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction: conn.rollback()
+            self._idle.put(conn)
+
+    def data_version(self):
+        """
+        Changes whenever any other connection commits, in this process (the writer) or
+        another one (PRAGMA data_version); caches compare it to detect new data.
+        """
+        with self._watch_lock:
+            return self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def stats(self):
+        return {"size": self.size, "idle": self._idle.qsize()}
+
+    def close(self):
+        for _ in range(self.size):
+            self._idle.get().close()
+        self._watch.close()
+        self.writer.close()
@@ -0,0 +1,46 @@
+import csv
+import io
+import json
+
+import db
+
+# Rows fetched from SQLite (and encoded into one response chunk) at a time
+FETCH_ROWS = 1_000
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def stream(db_name, sql, params, fmt="ndjson", transform=None, head=()):
+    """
+    Generator of encoded chunks for a StreamingResponse. The query runs on a read-only
+    connection of its own for the whole export (a consistent WAL snapshot), not a pooled
+    one, so slow downloads cannot starve the API of readers. It is read FETCH_ROWS at
+    a time, so memory stays flat however many rows there are, and closed when the stream
+    ends or the generator is closed (client disconnect).
+    `transform` maps each row (sqlite3.Row) to the dict that is written; rows in `head`
+    (e.g. read from the Parquet archive) are written before the query's.
+    """
+    transform = transform or dict
+    head = list(head)
+    conn = db.connect_reader(db_name)
+    try:
+        cur = conn.execute(sql, params)
+        columns = None
+        while True:
+            rows, head = (head[:FETCH_ROWS], head[FETCH_ROWS:]) if head else (cur.fetchmany(FETCH_ROWS), head)
+            if not rows: break
+            records = [transform(r) for r in rows]
+            if fmt == "csv":
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                if columns is None:
+                    columns = list(records[0])
+                    writer.writerow(columns)
+                writer.writerows([r[c] for c in columns] for r in records)
+                yield buf.getvalue()
+            else:
+                yield "".join(json.dumps(r) + "\n" for r in records)
+    finally:
+        conn.close()
+
+def filename(name, fmt):
+    return {"Content-Disposition": f'attachment; filename="{name}.{fmt}"'}
@@ -0,0 +1,237 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+import clusters
+import db
+import profiles
+import risk
+import rollups
+import schema
+import spikes
+
+# Rows per write transaction and chunks buffered ahead of the writer.
+# Memory is bounded by BATCH_SIZE * QUEUE_CHUNKS rows regardless of input size.
+BATCH_SIZE = 20000
+QUEUE_CHUNKS = 8
+# Valid ids are positive SQLite integers; timestamps must be renderable by schema.to_iso
+MAX_ID = 2**63 - 1
+MAX_TIMESTAMP = 253402300799  # 9999-12-31T23:59:59Z
+
+class IngestError(Exception):
+    """A batch of likes the writer could not commit (the writer itself keeps running)."""
+
+# --- Parsing ---
+
+def to_like(record):
+    """Normalize a like record ({"user_id", "video_id", "timestamp"} or [user_id, video_id, timestamp])."""
+    if isinstance(record, dict):
+        uid, vid, ts = record["user_id"], record["video_id"], record["timestamp"]
+    else:
+        uid, vid, ts = record
+    if any(isinstance(v, bool) for v in (uid, vid, ts)):
+        raise ValueError(f"true/false is not an id or timestamp: {record}")
+    try:
+        if not isinstance(ts, int):
+            ts = int(ts) if isinstance(ts, float) else schema.to_epoch(ts)
+        uid, vid = int(uid), int(vid)
+    except OverflowError:  # int() of an infinite float (Infinity, 1e400)
+        raise ValueError(f"non-finite number: {record}")
+    if not (0 < uid <= MAX_ID and 0 < vid <= MAX_ID):
+        raise ValueError(f"user_id and video_id must be between 1 and {MAX_ID}: {record}")
+    if not 0 <= ts <= MAX_TIMESTAMP:
+        raise ValueError(f"timestamp out of range: {record}")
+    return uid, vid, ts
+
+def check_known(conn, likes):
+    """Raise ValueError if any like refers to a user or video that does not exist."""
+    for table, ids in (("users", {uid for uid, _, _ in likes}), ("videos", {vid for _, vid, _ in likes})):
+        known = {r[0] for r in conn.execute(f"SELECT id FROM {table} WHERE id IN (SELECT value FROM json_each(?))",
+                                            (json.dumps(sorted(ids)),))}
+        missing = sorted(ids - known)
+        if missing:
+            raise ValueError(f"unknown {table[:-1]} id(s): {missing[:10]}")
+
+def parse_ndjson(lines):
+    """Yield likes from an iterable of NDJSON lines (str or bytes). Blank lines are skipped."""
+    for line in lines:
+        line = line.strip()
+        if line: yield to_like(json.loads(line))
+
+def parse_body(body):
+    """Parse a request body that is either a JSON array of likes or NDJSON."""
+    text = body.decode() if isinstance(body, bytes) else body
+    if text.lstrip().startswith("["):
+        return [to_like(r) for r in json.loads(text)]
+    return list(parse_ndjson(text.splitlines()))
+
+def chunked(iterable, size=BATCH_SIZE):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+# --- Writing ---
+
+def apply_batch(writer, likes, now=None, tracker=None):
+    """
+    Insert a batch of likes and update every derived table (clusters, rollups,
+    spikes, user_risk, user_summary) in a single transaction on the db.Writer.
+    A velocity.Tracker, if given, records the likes in the same transaction (its spills go there).
+    """
+    now = int(now if now is not None else time.time())
+    with writer.transaction() as conn:
+        check_known(conn, likes)
+        # Before the insert: it compares the batch against the likes already stored
+        clusters.apply_likes(conn, likes, now)
+        conn.executemany("INSERT INTO likes (user_id, video_id, timestamp) VALUES (?, ?, ?)", likes)
+        rollups.apply_likes(conn, likes)
+        changed = spikes.apply_likes(conn, likes, now)
+        if changed: risk.refresh_spike_participation(conn, changed, now)
+        risk.apply_likes(conn, likes)
+        profiles.apply_likes(conn, likes)
+        if tracker is not None: tracker.apply(likes, conn)
+
+class LikeWriter:
+    """
+    Background writer thread. Producers submit() chunks of likes; the writer
+    groups them into transactions of up to batch_size rows. submit() blocks when
+    the queue is full, which bounds memory and applies backpressure.
+    A batch that fails to commit is retried chunk by chunk, so only the bad chunks are
+    dropped; their errors go to the Ticket they were submitted with (see flush()).
+    Pass `writer` to share an existing db.Writer (e.g. the API pool's) instead of opening one,
+    `tracker` to keep a velocity.Tracker current, and `on_batch` to be called after each commit.
+    """
+
+    def __init__(self, db_name=schema.DB_NAME, batch_size=BATCH_SIZE, queue_chunks=QUEUE_CHUNKS, writer=None, tracker=None,
+                 on_batch=None):
+        self.db_name = db_name
+        self.writer = writer
+        self.tracker = tracker
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_chunks)
+        self.rows_written = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+        self.failed_chunks = 0
+        self._thread = threading.Thread(target=self._run, name="like-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, likes, ticket=None):
+        """Queue likes; returns the Ticket (a new one unless given) that collects their errors."""
+        ticket = ticket if ticket is not None else Ticket()
+        for chunk in chunked(likes, self.batch_size):
+            self.queue.put((chunk, ticket))
+        return ticket
+
+    def flush(self, ticket=None):
+        """
+        Block until everything submitted so far is written. Raises IngestError if
+        any chunk submitted with `ticket` failed to commit.
+        """
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+        if ticket is not None and ticket.errors:
+            raise IngestError(f"{len(ticket.errors)} chunk(s) not committed: {ticket.errors[0]}") from ticket.errors[0]
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "rows_written": self.rows_written,
+            "batches": self.batches,
+            "write_seconds": round(self.write_seconds, 3),
+            "rows_per_second": round(self.rows_written / self.write_seconds) if self.write_seconds else 0,
+            "queued_chunks": self.queue.qsize(),
+            "failed_chunks": self.failed_chunks,
+        }
+
+    def _run(self):
+        writer = self.writer or db.Writer(self.db_name)
+        try:
+            while True:
+                # Drain whatever is already queued (up to batch_size rows) into one pass
+                item = self.queue.get()
+                chunks, rows, waiters, stop = [], 0, [], False
+                while True:
+                    if item is None: stop = True
+                    elif isinstance(item, threading.Event): waiters.append(item)
+                    else:
+                        chunks.append(item)
+                        rows += len(item[0])
+                    if stop or rows >= self.batch_size: break
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+
+                if chunks: self._write(writer, chunks)
+                for w in waiters: w.set()
+                if stop: break
+        finally:
+            if writer is not self.writer: writer.close()
+
+    def _write(self, writer, chunks):
+        t0 = time.perf_counter()
+        batch = [like for chunk, _ in chunks for like in chunk]
+        try:
+            apply_batch(writer, batch, tracker=self.tracker)
+        except Exception as e:
+            if len(chunks) > 1:
+                for chunk in chunks: self._write(writer, [chunk])
+                return
+            chunks[0][1].errors.append(e)
+            self.failed_chunks += 1
+            print(f"Ingest Error: {e}")
+            return
+        self.write_seconds += time.perf_counter() - t0
+        self.rows_written += len(batch)
+        self.batches += 1
+        if self.on_batch: self.on_batch()
+
+class Ticket:
+    """Errors of the chunks submitted together (one request, one file)."""
+
+    def __init__(self):
+        self.errors = []
+
+def ingest_file(path, db_name=schema.DB_NAME, batch_size=BATCH_SIZE):
+    """Stream an NDJSON (or JSON array) file of likes into the database."""
+    writer = LikeWriter(db_name, batch_size)
+    try:
+        with open(path) as f:
+            first = f.read(1)
+            f.seek(0)
+            if first == "[":
+                ticket = writer.submit(parse_body(f.read()))
+            else:
+                ticket = writer.submit(parse_ndjson(f))
+        writer.flush(ticket)
+    finally:
+        writer.close()
+    return writer.stats()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Stream likes from an NDJSON or JSON-array file into the database.")
+    parser.add_argument("path")
+    parser.add_argument("--db", default=schema.DB_NAME)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    schema.migrate(conn)
+    conn.close()
+
+    t0 = time.time()
+    stats = ingest_file(args.path, args.db, args.batch_size)
+    print(f"Ingested {stats['rows_written']} likes in {time.time() - t0:.2f}s ({stats['rows_per_second']} likes/sec while writing)")
@@ -0,0 +1,302 @@
+"""
+Request, SQL and agent instrumentation, exported in the Prometheus text format.
+
+    http_request_duration_seconds{route, method, status}   Middleware (until the body is sent)
+    sqlite_query_duration_seconds{query}                   TimedConnection (execute + fetches)
+    agent_tool_duration_seconds{tool, ok}                  agent.AgentExecutor
+    agent_model_turn_duration_seconds                      agent.AgentExecutor
+    detection_job_duration_seconds{job}                    scheduler.Scheduler
+
+With PROFILE_ENABLED=1, `?profile=1` on a GET request returns a profile of it instead
+of its body: where the time went (sampled stacks of every thread running app code, so
+handlers in the threadpool and agent tools are covered) and each SQL statement it ran.
+Off by default: a profile exposes SQL text, and its sampler adds load while it runs.
+"""
+import contextvars
+import functools
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Label sets kept per metric; later ones are counted under "other" (ad-hoc SQL from the agent)
+MAX_SERIES = 500
+# Sampling interval of ?profile=1 and the rows of each breakdown it returns
+PROFILE_INTERVAL = 0.001
+PROFILE_TOP = 25
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED") == "1"
+
+# --- Histograms ---
+
+class Histogram:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, seconds, *values):
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                if len(self._series) >= MAX_SERIES: values = ("other",) * len(values)
+                series = self._series.setdefault(values, [0] * (len(BUCKETS) + 2))
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for values, counts in series:
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values))
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {counts[-2]}')
+            labels = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_count{labels} {counts[-2]}")
+            lines.append(f"{self.name}_sum{labels} {counts[-1]:.6f}")
+        return lines
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+REGISTRY = []
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency by route template.", ("route", "method", "status"))
+QUERY_SECONDS = Histogram("sqlite_query_duration_seconds", "SQLite statement time (execute and fetches) by normalized SQL.", ("query",))
+TOOL_SECONDS = Histogram("agent_tool_duration_seconds", "Agent tool call latency.", ("tool", "ok"))
+TURN_SECONDS = Histogram("agent_model_turn_duration_seconds", "Model round trip (streamed reply) per agent turn.")
+JOB_SECONDS = Histogram("detection_job_duration_seconds", "Background detection job run (compute + apply).", ("job",))
+
+def render(gauges=None):
+    """Every histogram plus `gauges` ({name: value}) in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    for name, value in (gauges or {}).items():
+        lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+# --- SQL Timing ---
+
+# The current request's profile, if it asked for one (list of (sql, ms) statements)
+_statements = contextvars.ContextVar("profile_statements", default=None)
+
+@functools.lru_cache(maxsize=4096)
+def query_label(sql, _space=re.compile(r"\s+"), _literal=re.compile(r"\b\d+\b|'[^']*'")):
+    """SQL with whitespace collapsed and literals replaced, so queries built with f-strings share a series."""
+    return _literal.sub("?", _space.sub(" ", sql).strip())[:120]
+
+class TimedCursor(sqlite3.Cursor):
+    """Accumulates the time spent in execute and fetches; records it once when the cursor is released."""
+    _sql, _elapsed = None, 0.0
+
+    def _record(self):
+        if self._sql is None: return
+        sql, self._sql = self._sql, None
+        QUERY_SECONDS.observe(self._elapsed, query_label(sql))
+        statements = _statements.get()
+        if statements is not None: statements.append((sql, self._elapsed * 1000))
+
+    def execute(self, sql, params=()):
+        self._record()
+        self._sql, t0 = sql, time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._elapsed = time.perf_counter() - t0
+
+    def executemany(self, sql, params):
+        self._record()
+        self._sql, t0 = sql, time.perf_counter()
+        try:
+            return super().executemany(sql, params)
+        finally:
+            self._elapsed = time.perf_counter() - t0
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._elapsed += time.perf_counter() - t0
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchmany(size if size is not None else self.arraysize)
+        finally:
+            self._elapsed += time.perf_counter() - t0
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._elapsed += time.perf_counter() - t0
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            self._elapsed += time.perf_counter() - t0
+
+    def close(self):
+        self._record()
+        super().close()
+
+    def __del__(self):
+        self._record()
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection factory whose cursors (including conn.execute's) are TimedCursors."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # The C implementations of these do not go through cursor()
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+# --- Profiling ---
+
+ROOT = os.path.dirname(os.path.abspath(__file__)) + os.sep
+IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+
+class Sampler:
+    """
+    Samples the stack of every thread running app code (a frame under ROOT) every
+    `interval` seconds. Threads parked in a wait are skipped, so a worker blocked on
+    a queue does not count as busy. Other requests in flight are sampled too.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.rounds = 0
+        self.samples = 0
+        self.own = Counter()    # frame -> samples with it innermost (among app frames)
+        self.total = Counter()  # frame -> samples with it anywhere on the stack
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.wall = time.perf_counter() - self.t0
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.rounds += 1
+            for tid, frame in sys._current_frames().items():
+                if tid == me or frame.f_code.co_filename.endswith(IDLE_FILES): continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    if code.co_filename.startswith(ROOT) and code.co_filename != __file__:
+                        stack.append(f"{code.co_filename[len(ROOT):]}:{code.co_firstlineno}({code.co_name})")
+                    frame = frame.f_back
+                if not stack: continue
+                self.samples += 1
+                self.own[stack[0]] += 1
+                self.total.update(set(stack))
+
+    def report(self, top=PROFILE_TOP):
+        ms = self.wall * 1000 / self.rounds if self.rounds else 0  # time one sample stands for
+        return {
+            "samples": self.samples,
+            "functions": [{"function": f, "total_ms": round(n * ms, 1), "self_ms": round(self.own[f] * ms, 1)}
+                          for f, n in self.total.most_common(top)],
+        }
+
+def profile_report(sampler, statements, status, size, top=PROFILE_TOP):
+    by_query = {}
+    for sql, ms in statements:
+        entry = by_query.setdefault(query_label(sql), {"query": query_label(sql), "calls": 0, "ms": 0.0})
+        entry["calls"] += 1
+        entry["ms"] += ms
+    queries = sorted(by_query.values(), key=lambda q: -q["ms"])[:top]
+    for q in queries: q["ms"] = round(q["ms"], 3)
+    return {
+        "status": status,
+        "response_bytes": size,
+        "wall_ms": round(sampler.wall * 1000, 3),
+        "sql": {"statements": len(statements), "ms": round(sum(ms for _, ms in statements), 3), "queries": queries},
+        **sampler.report(top),
+    }
+
+# --- Middleware ---
+
+class Middleware:
+    """
+    ASGI middleware: observes every HTTP request in REQUEST_SECONDS under its route
+    template (e.g. /api/users/{username}), and when `profile` is set answers GET
+    ?profile=1 requests with a profile_report of the request instead of its response.
+    """
+
+    def __init__(self, app, profile=PROFILE_ENABLED):
+        self.app = app
+        self.profile = profile
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if (self.profile and scope["method"] == "GET"
+                and parse_qs(scope.get("query_string", b"").decode()).get("profile") == ["1"]):
+            return await self._profile(scope, receive, send)
+        status = 500
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start": status = message["status"]
+            await send(message)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            self._observe(scope, status, time.perf_counter() - t0)
+
+    def _observe(self, scope, status, seconds):
+        route = scope.get("route")
+        REQUEST_SECONDS.observe(seconds, getattr(route, "path", "unmatched"), scope["method"], str(status))
+
+    async def _profile(self, scope, receive, send):
+        status, size = 500, 0
+        async def capture(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start": status = message["status"]
+            elif message["type"] == "http.response.body": size += len(message.get("body", b""))
+        statements = []
+        token = _statements.set(statements)
+        try:
+            with Sampler() as sampler:
+                await self.app(scope, receive, capture)
+        finally:
+            _statements.reset(token)
+        self._observe(scope, status, sampler.wall)
+        body = json.dumps(profile_report(sampler, statements, status, size)).encode()
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
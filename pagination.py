@@ -0,0 +1,62 @@
+import base64
+import json
+
+# Keyset (cursor) pagination. A cursor is the sort key of the last row of a page,
+# so the next page is an index seek rather than an OFFSET walk.
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+def decode_cursor(token, size):
+    """The key list inside `token`; ValueError if it is not a cursor with `size` integers."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not (isinstance(key, list) and len(key) == size and all(isinstance(v, int) for v in key)):
+        raise ValueError("Invalid cursor")
+    return key
+
+# --- Risk ranking: (risk_score DESC, total_likes DESC, user_id ASC) ---
+
+RISK_ORDER = "ORDER BY risk_score DESC, total_likes DESC, user_id"
+
+def risk_page(conn, columns, limit, cursor=None):
+    """
+    One page of user_risk in ranking order, plus the cursor of the next page (None on the last).
+    idx_user_risk_score ends in the rowid (user_id), so the order is total and each step
+    below is a single seek into the index; the mixed sort directions rule out one row-value
+    comparison, so the rest of the page is filled in three contiguous ranges.
+    """
+    if cursor is None:
+        ranges = [("1", ())]
+    else:
+        s, t, uid = decode_cursor(cursor, 3)
+        ranges = [("risk_score = ? AND total_likes = ? AND user_id > ?", (s, t, uid)),
+                  ("risk_score = ? AND total_likes < ?", (s, t)),
+                  ("risk_score < ?", (s,))]
+    rows = []
+    for where, params in ranges:
+        rows += conn.execute(f"""
+            SELECT {columns}, risk_score as _s, total_likes as _t, user_id as _id FROM user_risk
+            WHERE {where} {RISK_ORDER} LIMIT ?
+        """, (*params, limit - len(rows))).fetchall()
+        if len(rows) == limit: break
+    next_cursor = encode_cursor([rows[-1]["_s"], rows[-1]["_t"], rows[-1]["_id"]]) if rows and len(rows) == limit else None
+    return rows, next_cursor
+
+# --- Likes in a window: (timestamp, user_id, id), the order of idx_likes_video_ts ---
+
+def likes_after(cursor):
+    """SQL condition (on likes aliased l) and params for rows after `cursor`."""
+    if cursor is None: return "1", ()
+    return "(l.timestamp, l.user_id, l.id) > (?, ?, ?)", tuple(decode_cursor(cursor, 3))
+
+def likes_cursor(rows, limit):
+    """Next-page cursor from rows selecting _ts, _uid and _id, or None on the last page."""
+    if not rows or len(rows) < limit: return None
+    return encode_cursor([rows[-1]["_ts"], rows[-1]["_uid"], rows[-1]["_id"]])
+
+def strip(row):
+    """Row as a dict without the _-prefixed key columns."""
+    return {k: row[k] for k in row.keys() if not k.startswith("_")}
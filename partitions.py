@@ -0,0 +1,274 @@
+"""
+Monthly partitions of old likes, inside the same database file.
+
+    likes                   hot likes: the last HOT_MONTHS months, plus late arrivals
+    likes_YYYY_MM           archived months, same columns as likes, clustered on (video_id, timestamp)
+    likes_partitions        catalog: (name, start, end, rows, compacted_at)
+    user_monthly            per-user monthly totals of compacted months
+
+archive() moves whole months out of likes; queries over a time range read from
+likes_sql(), which only includes the partitions the range overlaps. compact()
+rolls partitions past the retention window into user_monthly, drops them and
+their minute rollups; hourly/daily rollups and the per-user tables already hold
+their totals. Compaction is one-way: rebuilding derived tables afterwards
+recomputes them from the likes that remain. Export months to Parquet first
+(archive.py) to keep their raw likes queryable.
+"""
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from multiprocessing import Pool
+
+import schema
+
+# Months kept in the hot likes table (the current one included)
+HOT_MONTHS = 3
+# Months of raw likes kept at all (hot + archived) before compaction
+RETAIN_MONTHS = 12
+
+COLUMNS = "id, user_id, video_id, timestamp"
+
+# --- Months ---
+
+def month_start(ts, offset=0):
+    """Epoch of the first second of ts's month (UTC), shifted by `offset` months."""
+    dt = datetime.fromtimestamp(ts, timezone.utc)
+    months = dt.year * 12 + dt.month - 1 + offset
+    return int(datetime(months // 12, months % 12 + 1, 1, tzinfo=timezone.utc).timestamp())
+
+def table_name(start):
+    return datetime.fromtimestamp(start, timezone.utc).strftime("likes_%Y_%m")
+
+# --- Routing ---
+
+def overlapping(conn, start=None, end=None):
+    """Names of the live (uncompacted) partitions overlapping [start, end), oldest first."""
+    return [r[0] for r in conn.execute("""
+        SELECT name FROM likes_partitions
+        WHERE compacted_at IS NULL AND (? IS NULL OR end > ?) AND (? IS NULL OR start < ?)
+        ORDER BY start
+    """, (start, start, end, end))]
+
+def likes_sql(conn, start=None, end=None):
+    """
+    FROM-clause source of the likes in [start, end): "likes" when no archived month
+    overlaps (the common case, same plan as before), else a UNION ALL of likes and the
+    overlapping partitions. SQLite pushes the outer WHERE into each arm, so every
+    arm is still an index seek.
+    """
+    names = overlapping(conn, start, end)
+    if not names: return "likes"
+    return "(" + " UNION ALL ".join(f"SELECT {COLUMNS} FROM {t}" for t in ["likes"] + names) + ")"
+
+def hot_since(conn):
+    """Start of the likes only held in the hot table (the end of the newest partition), or None."""
+    return conn.execute("SELECT MAX(end) FROM likes_partitions").fetchone()[0]
+
+def compacted_until(conn):
+    """End of the compacted months (raw likes before it only survive in the Parquet archive), or None."""
+    return conn.execute("SELECT MAX(end) FROM likes_partitions WHERE compacted_at IS NOT NULL").fetchone()[0]
+
+def full_history(conn):
+    """
+    Shadow likes on this connection with a TEMP VIEW over likes and every live partition,
+    so whole-history jobs (rebuilds, consistency checks) see archived months. Read-only:
+    do not use on a connection that inserts likes.
+    """
+    conn.execute("DROP VIEW IF EXISTS temp.likes")
+    names = overlapping(conn)
+    if names:
+        conn.execute("CREATE TEMP VIEW likes AS " + " UNION ALL ".join(
+            f"SELECT {COLUMNS} FROM main.{t}" for t in ["likes"] + names))
+    return names
+
+# --- Archiving ---
+
+# Archived likes keep their ids but are never looked up or numbered by id, so a partition
+# is stored in (video_id, timestamp, user_id) order without a rowid b-tree: the table is
+# its own video index, and each like is stored twice instead of three times.
+PARTITION_SQL = """CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    video_id INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    PRIMARY KEY (video_id, timestamp, user_id, id)
+) WITHOUT ROWID"""
+
+def create_partition(conn, name):
+    conn.execute(PARTITION_SQL.format(name=name))
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_user_ts ON {name}(user_id, timestamp, video_id)")
+
+def pack(conn):
+    """
+    Rebuild partitions created as rowid tables (before the clustered layout) in place,
+    copying in primary key order along their old video index. Returns the packed names.
+    """
+    packed = []
+    for name in overlapping(conn):
+        if conn.execute("SELECT wr FROM pragma_table_list WHERE schema = 'main' AND name = ?", (name,)).fetchone()[0]:
+            continue
+        conn.execute(PARTITION_SQL.format(name=f"{name}_packed"))
+        conn.execute(f"INSERT INTO {name}_packed SELECT {COLUMNS} FROM {name} ORDER BY video_id, timestamp, user_id, id")
+        conn.execute(f"DROP TABLE {name}")
+        conn.execute(f"ALTER TABLE {name}_packed RENAME TO {name}")
+        create_partition(conn, name)
+        packed.append(name)
+    return packed
+
+def archive(conn, keep_months=HOT_MONTHS, now=None):
+    """
+    Move every month older than the last keep_months out of likes into its partition.
+    Rows are found per video through idx_likes_video_ts. The like with the highest id
+    always stays in likes, so new likes never reuse an archived id. Months already
+    compacted are left alone. Returns {partition: rows moved}.
+    """
+    now = int(now if now is not None else time.time())
+    cutoff = month_start(now, -(keep_months - 1))
+    oldest = conn.execute("SELECT MIN((SELECT MIN(timestamp) FROM likes WHERE video_id = v.id)) FROM videos v").fetchone()[0]
+    max_id = conn.execute("SELECT MAX(id) FROM likes").fetchone()[0]
+    compacted = {r[0] for r in conn.execute("SELECT name FROM likes_partitions WHERE compacted_at IS NOT NULL")}
+    moved = {}
+    start = month_start(oldest) if oldest is not None else cutoff
+    while start < cutoff:
+        end, name = month_start(start, 1), table_name(start)
+        if name not in compacted:
+            # Read along idx_likes_video_ts, which is already the partition's key order
+            month = "FROM videos v JOIN likes l ON l.video_id = v.id AND l.timestamp >= ? AND l.timestamp < ? AND l.id < ?"
+            create_partition(conn, name)
+            n = conn.execute(f"INSERT INTO {name} SELECT l.id, l.user_id, l.video_id, l.timestamp {month}", (start, end, max_id)).rowcount
+            if n:
+                conn.execute(f"DELETE FROM likes WHERE id IN (SELECT l.id {month})", (start, end, max_id))
+                conn.execute("""
+                    INSERT INTO likes_partitions (name, start, end, rows) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET rows = rows + excluded.rows
+                """, (name, start, end, n))
+                moved[name] = n
+            elif name not in overlapping(conn, start, end):
+                conn.execute(f"DROP TABLE {name}")
+        start = end
+    return moved
+
+# --- Fan-out ---
+
+def _query(db_name, sql, params):
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+def fan_out(db_name, sql, params=(), names=None, workers=None):
+    """
+    Run `sql` (with {likes} standing for the table) against each partition in `names`
+    (default: likes and every live partition) on a process pool, one read-only
+    connection per partition. Returns {name: rows}.
+    """
+    if names is None:
+        conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+        names = ["likes"] + overlapping(conn)
+        conn.close()
+    jobs = [(db_name, sql.format(likes=name), params) for name in names]
+    if len(jobs) == 1:
+        return {names[0]: _query(*jobs[0])}
+    with Pool(min(workers or os.cpu_count(), len(jobs))) as pool:
+        return dict(zip(names, pool.starmap(_query, jobs)))
+
+def aggregate(db_name, sql, params=(), start=None, end=None, keys=1, workers=None):
+    """
+    An additive aggregate (COUNT/SUM columns after `keys` group-by columns) over the
+    likes in [start, end), computed per partition in parallel and merged by summing.
+    `sql` reads from {likes}; partitions outside the range are never queried.
+    """
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+    names = ["likes"] + overlapping(conn, start, end)
+    conn.close()
+    merged = defaultdict(lambda: None)
+    for rows in fan_out(db_name, sql, params, names, workers).values():
+        for row in rows:
+            key, values = tuple(row[:keys]), row[keys:]
+            prev = merged[key]
+            merged[key] = values if prev is None else tuple(a + b for a, b in zip(prev, values))
+    return sorted(key + tuple(values) for key, values in merged.items())
+
+# --- Compaction ---
+
+USER_MONTH_SQL = """
+    SELECT user_id, COUNT(*), COUNT(DISTINCT video_id), MIN(timestamp), MAX(timestamp)
+    FROM {likes} GROUP BY user_id
+"""
+
+def compact(conn, db_name, retain_months=RETAIN_MONTHS, now=None, workers=None):
+    """
+    Roll every live partition older than retain_months into user_monthly (computed
+    in parallel, one process per partition), then drop it and its minute rollups.
+    `conn` must be a write connection to db_name with no pending changes to the
+    partitions (workers read committed data). Returns the compacted partition names.
+    """
+    now = int(now if now is not None else time.time())
+    cutoff = month_start(now, -(retain_months - 1))
+    parts = conn.execute("""
+        SELECT name, start, end FROM likes_partitions WHERE compacted_at IS NULL AND end <= ? ORDER BY start
+    """, (cutoff,)).fetchall()
+    if not parts: return []
+    summaries = fan_out(db_name, USER_MONTH_SQL, (), [p[0] for p in parts], workers)
+    for name, start, end in parts:
+        conn.executemany("""
+            INSERT INTO user_monthly (user_id, month, likes, videos, first_like, last_like) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, month) DO UPDATE SET
+                likes = likes + excluded.likes, videos = MAX(videos, excluded.videos),
+                first_like = MIN(first_like, excluded.first_like), last_like = MAX(last_like, excluded.last_like)
+        """, ((uid, start, n, v, first, last) for uid, n, v, first, last in summaries[name]))
+        conn.execute("DELETE FROM likes_minutely WHERE minute_epoch >= ? AND minute_epoch < ?", (start, end))
+        conn.execute(f"DROP TABLE {name}")
+        conn.execute("UPDATE likes_partitions SET compacted_at = ? WHERE name = ?", (now, name))
+    return [p[0] for p in parts]
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Archive old likes into monthly partitions, compact expired ones, or query across them.")
+    parser.add_argument("command", choices=["archive", "compact", "pack", "list", "stats"])
+    parser.add_argument("--db", default=schema.DB_NAME)
+    parser.add_argument("--keep-months", type=int, default=HOT_MONTHS, help="archive: months kept in the hot likes table")
+    parser.add_argument("--retain-months", type=int, default=RETAIN_MONTHS, help="compact: months of raw likes kept")
+    parser.add_argument("--now", type=int, help="Reference time (epoch seconds); default: now")
+    parser.add_argument("--start", help="stats: range start (epoch or ISO)")
+    parser.add_argument("--end", help="stats: range end (epoch or ISO)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    schema.migrate(conn)
+    t0 = time.time()
+    if args.command == "archive":
+        conn.execute("BEGIN")
+        moved = archive(conn, args.keep_months, args.now)
+        conn.execute("COMMIT")
+        for name, n in moved.items():
+            print(f"{name}: {n} likes archived")
+        print(f"Archived {sum(moved.values())} likes into {len(moved)} partitions in {time.time() - t0:.1f}s")
+    elif args.command == "compact":
+        conn.execute("BEGIN")
+        names = compact(conn, args.db, args.retain_months, args.now, args.workers)
+        conn.execute("COMMIT")
+        print(f"Compacted {names or 'nothing'} in {time.time() - t0:.1f}s (run VACUUM to return the space to the OS)")
+    elif args.command == "pack":
+        conn.execute("BEGIN")
+        names = pack(conn)
+        conn.execute("COMMIT")
+        print(f"Packed {names or 'nothing'} in {time.time() - t0:.1f}s (run VACUUM to return the space to the OS)")
+    elif args.command == "list":
+        for name, start, end, rows, compacted in conn.execute(
+                "SELECT name, start, end, rows, compacted_at FROM likes_partitions ORDER BY start"):
+            print(f"{name}: {rows} likes{' (compacted)' if compacted else ''}")
+        print(f"likes (hot): {conn.execute('SELECT COUNT(*) FROM likes').fetchone()[0]} likes")
+    else:
+        start = schema.to_epoch(args.start) if args.start and not args.start.isdigit() else int(args.start or 0)
+        end = schema.to_epoch(args.end) if args.end and not args.end.isdigit() else int(args.end or 2**62)
+        rows = aggregate(args.db, "SELECT video_id, COUNT(*) FROM {likes} WHERE timestamp >= ? AND timestamp < ? GROUP BY video_id",
+                         (start, end), start, end, workers=args.workers)
+        for vid, n in sorted(rows, key=lambda r: -r[1])[:10]:
+            print(f"video {vid}: {n} likes")
+        print(f"{sum(r[1] for r in rows)} likes in range ({time.time() - t0:.2f}s)")
+    conn.close()
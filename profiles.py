@@ -0,0 +1,272 @@
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import partitions
+import schema
+import velocity
+from schema import to_iso
+
+# Likes kept in each user's recent-activity ring
+RECENT = 5
+# Rendered profiles kept per process
+MAX_ENTRIES = 10_000
+
+# user_summary(user_id, total_likes, last_active, recent): one row per user with likes,
+# recent = JSON [[video_id, timestamp], ...] newest first, ordered by (timestamp, video_id) DESC.
+
+# --- Summary Table ---
+
+SUMMARY_SQL = f"""
+    SELECT s.user_id, s.total_likes, s.last_active,
+           (SELECT json_group_array(json_array(video_id, timestamp)) FROM (
+                SELECT video_id, timestamp FROM likes WHERE user_id = s.user_id
+                ORDER BY timestamp DESC, video_id DESC LIMIT {RECENT}
+           )) as recent
+    FROM (SELECT user_id, COUNT(*) as total_likes, MAX(timestamp) as last_active FROM likes GROUP BY user_id) s
+"""
+
+def rebuild(conn):
+    """Recompute user_summary from likes: one grouped pass plus a RECENT-row seek per user on idx_likes_user_ts."""
+    conn.execute("DELETE FROM user_summary")
+    conn.execute(f"INSERT INTO user_summary (user_id, total_likes, last_active, recent) {SUMMARY_SQL}")
+
+def apply_likes(conn, likes):
+    """Fold a batch of new likes (user_id, video_id, timestamp) into the touched users' summaries."""
+    new = defaultdict(list)
+    for uid, vid, ts in likes:
+        new[uid].append([vid, ts])
+    if not new: return
+    current = {r[0]: r[1:] for r in conn.execute("""
+        SELECT user_id, total_likes, last_active, recent FROM user_summary
+        WHERE user_id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(list(new)),))}
+    rows = []
+    for uid, added in new.items():
+        total, last, recent = current.get(uid, (0, None, "[]"))
+        ring = sorted(json.loads(recent) + added, key=lambda x: (x[1], x[0]), reverse=True)[:RECENT]
+        rows.append((uid, total + len(added), ring[0][1], json.dumps(ring, separators=(",", ":"))))
+    conn.executemany("INSERT OR REPLACE INTO user_summary (user_id, total_likes, last_active, recent) VALUES (?, ?, ?, ?)", rows)
+
+def check(conn):
+    """(user_id, expected, actual) for every user whose summary differs from SUMMARY_SQL over likes."""
+    expected = {r[0]: (r[1], r[2], json.loads(r[3])) for r in conn.execute(SUMMARY_SQL)}
+    actual = {r[0]: (r[1], r[2], json.loads(r[3]))
+              for r in conn.execute("SELECT user_id, total_likes, last_active, recent FROM user_summary")}
+    return sorted((uid, expected.get(uid), actual.get(uid))
+                  for uid in expected.keys() | actual.keys() if expected.get(uid) != actual.get(uid))
+
+# --- Rendering ---
+
+LOCATIONS = ["New York, USA", "London, UK", "Toronto, Canada", "Berlin, Germany", "Sydney, Australia", "Unknown Proxy", "Data Center (AWS-East)"]
+BIOS = [
+    "Just here for the vibes.", "Crypto enthusiast 🚀", "Travel | Food | Tech",
+    "Digital Nomad.", "Official Account.", "DM for collab.", "Automation script (DEBUG)", "..."
+]
+
+# Everything a rendered profile depends on, in one lookup (no likes access)
+KEY_SQL = """
+    SELECT u.id, u.username, u.created_at, u.is_bot,
+           COALESCE(s.total_likes, 0) as total_likes, s.last_active, COALESCE(s.recent, '[]') as recent,
+           c.id as cluster_id, c.size as cluster_size
+    FROM users u
+    LEFT JOIN user_summary s ON s.user_id = u.id
+    LEFT JOIN user_clusters uc ON uc.user_id = u.id
+    LEFT JOIN clusters c ON c.id = uc.cluster_id
+    WHERE u.username = ?
+"""
+
+def etag(key, now, speed=None):
+    """Validator for a profile: its inputs, plus the account age in hours while the narrative quotes it."""
+    age_hours = int((now - key["created_at"]) / 3600)
+    inputs = (tuple(key), age_hours if age_hours < 48 else None, sorted(speed.items()) if speed else None)
+    return '"' + hashlib.md5(repr(inputs).encode()).hexdigest() + '"'
+
+def video_titles(conn, video_ids):
+    return dict(conn.execute("SELECT id, title FROM videos WHERE id IN (SELECT value FROM json_each(?))",
+                             (json.dumps(sorted(set(video_ids))),)).fetchall())
+
+def render(conn, key, now, speed=None, titles=None):
+    """
+    The /api/users/{username} response for a KEY_SQL row and the user's velocity features
+    (if tracked). `titles` ({video_id: title}) saves the lookup of the recent videos.
+    """
+    username = key["username"]
+    recent = json.loads(key["recent"])
+    if titles is None: titles = video_titles(conn, [vid for vid, _ in recent])
+
+    # --- Mock Profile Generation (Deterministic) ---
+    h = int(hashlib.md5(username.encode()).hexdigest(), 16)
+    profile = {
+        "followers": (h % 5000) + 12,
+        "following": (h % 500) + 50,
+        "posts": (h % 100),
+        "location": LOCATIONS[h % len(LOCATIONS)],
+        "bio": BIOS[h % len(BIOS)],
+        "avatar": f"https://api.dicebear.com/7.x/identicon/svg?seed={username}"
+    }
+
+    # --- Risk Narrative Generation ---
+    age_hours = (now - key["created_at"]) / 3600
+    total_likes = key["total_likes"]
+
+    narrative = []
+    if age_hours < 48:
+        narrative.append(f"Account is extremely fresh (created {int(age_hours)} hours ago). High velocity activity immediately after creation suggests automated scripting.")
+    if speed and speed["score"] >= velocity.ALERT_SCORE:
+        narrative.append(f"Like velocity exceeds human click-rate benchmarks ({speed['per_minute']}/min, "
+                         f"{speed['per_hour']}/hour, {speed['per_day']}/day).")
+        if speed["interval_cv"] is not None and speed["interval_cv"] < velocity.REGULAR_CV:
+            narrative.append(f"Likes arrive at machine-regular intervals (every ~{speed['mean_interval']}s).")
+    if key["is_bot"]:
+        narrative.append(f"Pattern matches known botnet signature 'Spike-Walker-V2'. User was dormant until activation event.")
+    if not narrative:
+        narrative.append("User exhibits generally organic behavior, though minor anomalies in timing were flagged.")
+
+    return {
+        "id": key["id"],
+        "username": username,
+        "created_at": to_iso(key["created_at"]),
+        "is_bot": key["is_bot"],
+        "total_likes": total_likes,
+        "last_active": to_iso(key["last_active"]),
+        "recent_activity": [{"title": titles.get(vid), "timestamp": to_iso(ts)} for vid, ts in recent],
+        "profile": profile,
+        "risk_narrative": " ".join(narrative),
+        "cluster": {"id": key["cluster_id"], "size": key["cluster_size"]} if key["cluster_id"] is not None else None,
+        "velocity": speed,
+    }
+
+# --- Batch Lookup ---
+
+# Fields a batch lookup can return; BATCH_DEFAULT unless others are asked for.
+# The last five are rendered like /api/users/{username} and cost more per user.
+BATCH_FIELDS = ["id", "username", "created_at", "is_bot", "total_likes", "last_active", "risk_score",
+                "alert_reason", "in_attack", "velocity_score",
+                "recent_activity", "profile", "risk_narrative", "cluster", "velocity"]
+BATCH_DEFAULT = BATCH_FIELDS[:10]
+RENDERED = set(BATCH_FIELDS[10:])
+# Users per batch request
+MAX_BATCH = 5_000
+
+# KEY_SQL plus the risk columns, for a set of ids and usernames (a primary key or
+# idx_users_username seek per key)
+BATCH_SQL = """
+    SELECT u.id, u.username, u.created_at, u.is_bot,
+           COALESCE(s.total_likes, 0) as total_likes, s.last_active, COALESCE(s.recent, '[]') as recent,
+           c.id as cluster_id, c.size as cluster_size,
+           r.risk_score, r.alert_reason, r.in_spike as in_attack
+    FROM users u
+    LEFT JOIN user_summary s ON s.user_id = u.id
+    LEFT JOIN user_clusters uc ON uc.user_id = u.id
+    LEFT JOIN clusters c ON c.id = uc.cluster_id
+    LEFT JOIN user_risk r ON r.user_id = u.id
+    WHERE u.id IN (SELECT value FROM json_each(:ids)) OR u.username IN (SELECT value FROM json_each(:names))
+"""
+
+def batch(conn, ids=(), usernames=(), fields=None, tracker=None, now=None):
+    """
+    Profiles and risk scores of many users at once: one BATCH_SQL query, one for the
+    titles of their recent videos and one for spilled velocity state, however many users.
+    Returns (rows with `fields`, in request order: ids then usernames, each user once;
+    the ids/usernames not found).
+    """
+    now = now if now is not None else time.time()
+    fields = fields or BATCH_DEFAULT
+    keys = conn.execute(BATCH_SQL, {"ids": json.dumps(list(ids)), "names": json.dumps(list(usernames))}).fetchall()
+    by_id = {k["id"]: k for k in keys}
+    by_name = {k["username"]: k for k in keys}
+    rendered = RENDERED.intersection(fields)
+    speed = {}
+    if tracker is not None and {"velocity_score", "velocity", "risk_narrative"}.intersection(fields):
+        speed = tracker.features(by_id, now, conn)
+    titles = video_titles(conn, [vid for k in keys for vid, _ in json.loads(k["recent"])]) if "recent_activity" in rendered else {}
+
+    rows, seen, missing = [], set(), []
+    for ref, key in [(i, by_id.get(i)) for i in ids] + [(n, by_name.get(n)) for n in usernames]:
+        if key is None:
+            missing.append(ref)
+            continue
+        if key["id"] in seen: continue
+        seen.add(key["id"])
+        user_speed = speed.get(key["id"])
+        row = {
+            "id": key["id"],
+            "username": key["username"],
+            "created_at": to_iso(key["created_at"]),
+            "is_bot": key["is_bot"],
+            "total_likes": key["total_likes"],
+            "last_active": to_iso(key["last_active"]),
+            "risk_score": key["risk_score"],
+            "alert_reason": key["alert_reason"],
+            "in_attack": key["in_attack"],
+            "velocity_score": user_speed["score"] if user_speed else None,
+        }
+        if rendered: row.update(render(conn, key, now, user_speed, titles))
+        rows.append({f: row[f] for f in fields})
+    return rows, missing
+
+class ProfileCache:
+    """
+    LRU of rendered profiles keyed on username. Each entry keeps the ETag it was
+    rendered under; a lookup re-reads the KEY_SQL row (a few primary-key seeks) and
+    re-renders only if the ETag changed, so entries never need invalidating.
+    With a velocity.Tracker, profiles include the user's live velocity features.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, tracker=None):
+        self.max_entries = max_entries
+        self.tracker = tracker
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, conn, username, now=None):
+        """(etag, profile) for username, or None if there is no such user."""
+        now = now if now is not None else time.time()
+        key = conn.execute(KEY_SQL, (username,)).fetchone()
+        if key is None: return None
+        speed = self.tracker.features([key["id"]], now, conn)[key["id"]] if self.tracker is not None else None
+        tag = etag(key, now, speed)
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[0] == tag:
+                self._entries.move_to_end(username)
+                return entry
+        entry = (tag, render(conn, key, now, speed))
+        with self._lock:
+            self._entries[username] = entry
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Maintain the per-user summary table behind /api/users/{username}.")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--db", default=schema.DB_NAME)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    schema.migrate(conn)
+    partitions.full_history(conn)  # include archived months
+    if args.command == "rebuild":
+        t0 = time.time()
+        rebuild(conn)
+        conn.commit()
+        print(f"Rebuilt user_summary in {time.time() - t0:.2f}s")
+    else:
+        mismatches = check(conn)
+        for uid, expected, actual in mismatches[:20]:
+            print(f"MISMATCH user {uid}: expected {expected}, got {actual}")
+        print(f"{len(mismatches)} mismatching users.")
+        conn.close()
+        sys.exit(1 if mismatches else 0)
+    conn.close()
@@ -0,0 +1,148 @@
+"""
+Fast JSON responses and response compression for large result sets.
+
+Handlers returning many rows build them as tuples and return rows(), which encodes
+them once with orjson (stdlib json without it), skipping FastAPI's jsonable_encoder
+pass over every value. ?format=columnar returns {"columns": [...], "rows": [[...]]}
+instead of one object per row, so the keys are written once instead of per row.
+
+Compression is ASGI middleware: bodies of at least MIN_SIZE bytes in a compressible
+type are brotli- (if installed) or gzip-encoded as the client's Accept-Encoding
+allows. Streaming responses (exports) are compressed chunk by chunk, each chunk
+flushed so the client can decode it as it arrives.
+"""
+import json
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+try:
+    import numpy as np
+except ImportError:  # optional: iso_times formats one value at a time
+    np = None
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json is slower but produces the same document
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+import schema
+
+LAYOUTS = ("objects", "columnar")
+# Smallest body worth compressing, and the levels (fast ones: big bodies are compressed per request)
+MIN_SIZE = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+COMPRESSIBLE = ("application/json", "application/x-ndjson", "text/csv", "text/plain")
+
+# --- Encoding ---
+
+def dumps(content):
+    """content as compact UTF-8 JSON bytes (tuples become arrays)."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+class JSON(Response):
+    """JSONResponse encoded by dumps()."""
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
+
+def rows(columns, data, layout="objects", headers=None):
+    """A JSON response of tuple rows: a list of {column: value} objects, or {"columns", "rows"} when columnar."""
+    if layout == "columnar":
+        return JSON({"columns": list(columns), "rows": data}, headers=headers)
+    return JSON([dict(zip(columns, r)) for r in data], headers=headers)
+
+def iso_times(values):
+    """schema.to_iso of many epoch seconds in one vectorized pass (same strings)."""
+    if not len(values): return []
+    if np is None: return [schema.to_iso(int(v)) for v in values]
+    text = np.datetime_as_string(np.asarray(values, dtype=np.int64).astype("datetime64[s]"), unit="s")
+    return [t + "+00:00" for t in text.tolist()]
+
+# --- Compression ---
+
+def negotiate(accept_encoding):
+    """The encoding to use for an Accept-Encoding header: "br", "gzip" or None."""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    for encoding in ("br", "gzip") if brotli is not None else ("gzip",):
+        if offered.get(encoding, offered.get("*", 0)) > 0: return encoding
+    return None
+
+class Encoder:
+    def __init__(self, encoding):
+        self.brotli = encoding == "br"
+        self._c = brotli.Compressor(quality=BROTLI_QUALITY) if self.brotli else zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data, last):
+        """Compressed bytes for the next chunk; everything so far is decodable from them."""
+        if self.brotli:
+            return self._c.process(data) + (self._c.finish() if last else self._c.flush())
+        return self._c.compress(data) + self._c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+class Compression:
+    """ASGI middleware: brotli/gzip Content-Encoding for compressible bodies of MIN_SIZE bytes or more."""
+
+    def __init__(self, app, min_size=MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", "")) if scope["type"] == "http" else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        start, encoder = None, None
+
+        async def compressed(message):
+            nonlocal start, encoder
+            if message["type"] == "http.response.start":
+                start = message  # held until the first body chunk shows whether to compress
+                return
+            if message["type"] != "http.response.body" or (start is None and encoder is None):
+                if start is not None: await send(start)
+                start = None
+                return await send(message)
+            body, more = message.get("body", b""), message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(scope=start)
+                kind = headers.get("content-type", "")
+                if (not kind.startswith(COMPRESSIBLE) or "content-encoding" in headers
+                        or (not more and len(body) < self.min_size)):
+                    if kind.startswith(COMPRESSIBLE): headers.add_vary_header("Accept-Encoding")
+                    await send(start)
+                    start = None
+                    return await send(message)
+                encoder = Encoder(encoding)
+                body = encoder.compress(body, not more)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                start = None
+            else:
+                body = encoder.compress(body, not more)
+            await send({"type": "http.response.body", "body": body, "more_body": more})
+
+        await self.app(scope, receive, compressed)
@@ -0,0 +1,272 @@
+import bisect
+import json
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+
+import partitions
+import schema
+
+# Account age thresholds (seconds)
+FRESH_AGE = 48 * 3600
+SLEEPER_AGE = 90 * 86400
+
+# --- Scoring ---
+
+# A like participates in a spike if it falls inside any detected spike window
+# of the same video (see spikes.py). Expects the like aliased as `l`.
+IN_SPIKE_SQL = """EXISTS (
+    SELECT 1 FROM spikes s
+    WHERE s.video_id = l.video_id AND s.start <= l.timestamp AND s.end > l.timestamp
+)"""
+
+# SQL fragments shared by rebuild and incremental re-scoring. Expect :now bound.
+AGE_BUCKET_SQL = """CASE
+    WHEN :now - created_at < {fresh} THEN 'fresh'
+    WHEN :now - created_at > {sleeper} THEN 'dormant'
+    ELSE 'established'
+END""".format(fresh=FRESH_AGE, sleeper=SLEEPER_AGE)
+
+def score_sql(age="age_bucket", spike="in_spike"):
+    """
+    SET clause assigning risk_score and alert_reason from an age bucket and a
+    spike-participation expression. 'New Account' is account age alone: like
+    velocity is scored live by velocity.py. UPDATE reads pre-update column values, so
+    callers changing age_bucket/in_spike in the same statement pass the new
+    expressions here.
+    """
+    return f"""
+        risk_score = CASE
+            WHEN {age} = 'fresh' THEN 50
+            WHEN {age} = 'dormant' AND {spike} THEN 40
+            ELSE 0
+        END + (CASE WHEN {spike} THEN 50 ELSE 0 END),
+        alert_reason = CASE
+            WHEN {age} = 'fresh' THEN 'New Account'
+            WHEN {spike} AND {age} = 'dormant' THEN 'Sleeper Activation'
+            WHEN {spike} THEN 'Spike Participation'
+            ELSE 'Normal'
+        END"""
+
+# The on-the-fly formula get_user_risk used before materialization (two correlated
+# subqueries per user), with spike participation read from detected spikes.
+# Kept as the reference for check_consistency.
+FORMULA_SQL = f"""
+    WITH UserStats AS (
+        SELECT
+            u.id, u.created_at,
+            EXISTS (
+                SELECT 1 FROM likes l WHERE l.user_id = u.id AND {IN_SPIKE_SQL}
+            ) as in_attack,
+            (SELECT COUNT(*) FROM likes WHERE user_id = u.id) as total_likes
+        FROM users u
+    )
+    SELECT id, total_likes, in_attack,
+        CASE
+            WHEN :now - created_at < {FRESH_AGE} THEN 50
+            WHEN :now - created_at > {SLEEPER_AGE} AND in_attack THEN 40
+            ELSE 0
+        END + (CASE WHEN in_attack THEN 50 ELSE 0 END) as risk_score,
+        CASE
+            WHEN :now - created_at < {FRESH_AGE} THEN 'New Account'
+            WHEN in_attack AND :now - created_at > {SLEEPER_AGE} THEN 'Sleeper Activation'
+            WHEN in_attack THEN 'Spike Participation'
+            ELSE 'Normal'
+        END as alert_reason
+    FROM UserStats
+"""
+
+def _rescore(conn, where, params):
+    conn.execute(f"""
+        UPDATE user_risk SET
+            age_bucket = {AGE_BUCKET_SQL},
+            {score_sql(AGE_BUCKET_SQL)}
+        WHERE {where}
+    """, params)
+
+# --- Maintenance ---
+
+def rebuild(conn, now=None):
+    """Recompute user_risk for every user from scratch (one grouped pass over likes)."""
+    now = int(now if now is not None else time.time())
+    conn.execute("DELETE FROM user_risk")
+    conn.execute("""
+        INSERT INTO user_risk (user_id, username, created_at, is_bot, total_likes, first_like, last_like)
+        SELECT u.id, u.username, u.created_at, u.is_bot,
+               COALESCE(s.total_likes, 0), s.first_like, s.last_like
+        FROM users u
+        LEFT JOIN (
+            SELECT user_id, COUNT(*) as total_likes, MIN(timestamp) as first_like, MAX(timestamp) as last_like
+            FROM likes GROUP BY user_id
+        ) s ON s.user_id = u.id
+    """)
+    # Spikes are few; mark their participants from the spike side (idx_likes_video_ts)
+    conn.execute("""
+        UPDATE user_risk SET in_spike = 1
+        WHERE user_id IN (
+            SELECT l.user_id FROM spikes s
+            JOIN likes l ON l.video_id = s.video_id AND l.timestamp >= s.start AND l.timestamp < s.end
+        )
+    """)
+    _rescore(conn, "1", {"now": now})
+
+def add_users(conn, users, now=None):
+    """Register new users. `users` is an iterable of (id, username, created_at, is_bot)."""
+    now = int(now if now is not None else time.time())
+    rows = list(users)
+    conn.executemany("""
+        INSERT OR IGNORE INTO user_risk (user_id, username, created_at, is_bot) VALUES (?, ?, ?, ?)
+    """, rows)
+    _rescore_ids(conn, [r[0] for r in rows], now)
+
+def apply_likes(conn, likes):
+    """
+    Fold a batch of new likes into user_risk.
+    `likes` is an iterable of (user_id, video_id, timestamp). Only touched users are re-scored.
+    """
+    likes = likes if isinstance(likes, list) else list(likes)
+    if not likes: return
+    windows = _spike_windows(conn, {vid for _, vid, _ in likes},
+                             min(ts for _, _, ts in likes), max(ts for _, _, ts in likes))
+
+    # user_id -> [count, first, last, in_spike]
+    agg = defaultdict(lambda: [0, None, None, 0])
+    for uid, vid, ts in likes:
+        a = agg[uid]
+        a[0] += 1
+        if a[1] is None or ts < a[1]: a[1] = ts
+        if a[2] is None or ts > a[2]: a[2] = ts
+        if not a[3] and vid in windows:
+            starts, ends = windows[vid]
+            i = bisect.bisect_right(starts, ts) - 1
+            if i >= 0 and ts < ends[i]: a[3] = 1
+
+    # Stage the per-user deltas and apply them in one set-based UPDATE. The age bucket
+    # is left alone (refresh_ages owns it), so only the score index is touched.
+    conn.execute("""CREATE TEMP TABLE IF NOT EXISTS risk_batch (
+        user_id INTEGER PRIMARY KEY, count INTEGER, first INTEGER, last INTEGER, spike INTEGER
+    )""")
+    conn.executemany("INSERT INTO risk_batch VALUES (?, ?, ?, ?, ?)",
+                     [(uid, c, f, l, s) for uid, (c, f, l, s) in agg.items()])
+    conn.execute(f"""
+        UPDATE user_risk SET
+            total_likes = total_likes + b.count,
+            first_like = MIN(COALESCE(first_like, b.first), b.first),
+            last_like = MAX(COALESCE(last_like, b.last), b.last),
+            in_spike = MAX(in_spike, b.spike),
+            {score_sql("age_bucket", "MAX(in_spike, b.spike)")}
+        FROM risk_batch b
+        WHERE b.user_id = user_risk.user_id
+    """)
+    conn.execute("DELETE FROM risk_batch")
+
+def _spike_windows(conn, video_ids, start, end):
+    """
+    video_id -> (starts, ends): the detected spike windows overlapping [start, end]
+    for the given videos, merged into sorted disjoint intervals for bisecting.
+    """
+    rows = conn.execute("""
+        SELECT video_id, start, end FROM spikes
+        WHERE video_id IN (SELECT value FROM json_each(?)) AND start <= ? AND end > ?
+        ORDER BY video_id, start
+    """, (json.dumps(sorted(video_ids)), end, start))
+    windows = {}
+    for vid, s, e in rows:
+        starts, ends = windows.setdefault(vid, ([], []))
+        if ends and s <= ends[-1]:
+            ends[-1] = max(ends[-1], e)
+        else:
+            starts.append(s)
+            ends.append(e)
+    return windows
+
+def refresh_spike_participation(conn, windows, now=None):
+    """
+    Re-derive in_spike for every user who liked inside the given (video_id, start, end)
+    windows. Called with the windows spikes.apply_likes reports as newly detected or cleared.
+    """
+    now = int(now if now is not None else time.time())
+    ids = set()
+    for video_id, start, end in windows:
+        ids.update(r[0] for r in conn.execute(
+            "SELECT user_id FROM likes WHERE video_id = ? AND timestamp >= ? AND timestamp < ?",
+            (video_id, start, end)))
+    if not ids: return
+    conn.execute(f"""
+        UPDATE user_risk SET in_spike = EXISTS (
+            SELECT 1 FROM likes l WHERE l.user_id = user_risk.user_id AND {IN_SPIKE_SQL}
+        )
+        WHERE user_id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(sorted(ids)),))
+    _rescore_ids(conn, sorted(ids), now)
+
+def _rescore_ids(conn, ids, now):
+    if not ids: return
+    _rescore(conn, "user_id IN (SELECT value FROM json_each(:ids))", {"now": now, "ids": json.dumps(ids)})
+
+# Rows whose age bucket is out of date at :now (both branches use idx_user_risk_age)
+STALE_AGE_SQL = """
+    (age_bucket = 'fresh' AND created_at <= :now - {fresh})
+    OR (age_bucket = 'established' AND created_at < :now - {sleeper})
+""".format(fresh=FRESH_AGE, sleeper=SLEEPER_AGE)
+
+def ages_stale(conn, now=None):
+    """True if refresh_ages has work to do. Read-only, so callers can skip taking the writer."""
+    now = int(now if now is not None else time.time())
+    return conn.execute(f"SELECT EXISTS (SELECT 1 FROM user_risk WHERE {STALE_AGE_SQL})", {"now": now}).fetchone()[0] == 1
+
+def refresh_ages(conn, now=None):
+    """
+    Move users across the fresh/established/dormant boundaries as time passes.
+    Only rows whose bucket is stale are visited (idx_user_risk_age).
+    """
+    now = int(now if now is not None else time.time())
+    _rescore(conn, STALE_AGE_SQL, {"now": now})
+
+def check_consistency(conn, now=None):
+    """
+    Compare user_risk against FORMULA_SQL evaluated over the raw tables.
+    Returns a list of (user_id, expected, actual) tuples for mismatching users.
+    """
+    now = int(now if now is not None else time.time())
+    expected = {r[0]: tuple(r[1:]) for r in conn.execute(FORMULA_SQL, {"now": now})}
+    actual = {
+        r[0]: tuple(r[1:])
+        for r in conn.execute("SELECT user_id, total_likes, in_spike, risk_score, alert_reason FROM user_risk")
+    }
+    mismatches = []
+    for uid in expected.keys() | actual.keys():
+        if expected.get(uid) != actual.get(uid):
+            mismatches.append((uid, expected.get(uid), actual.get(uid)))
+    return sorted(mismatches)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Maintain the materialized user_risk table.")
+    parser.add_argument("command", choices=["rebuild", "refresh", "check"])
+    parser.add_argument("--db", default=schema.DB_NAME)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    schema.migrate(conn)
+    partitions.full_history(conn)  # include archived months
+    if args.command == "rebuild":
+        t0 = time.time()
+        rebuild(conn)
+        conn.commit()
+        print(f"Rebuilt user_risk in {time.time() - t0:.2f}s")
+    elif args.command == "refresh":
+        refresh_ages(conn)
+        conn.commit()
+        print("Refreshed account age buckets.")
+    else:
+        refresh_ages(conn)
+        conn.commit()
+        mismatches = check_consistency(conn)
+        for uid, expected, actual in mismatches[:20]:
+            print(f"MISMATCH user {uid}: expected {expected}, got {actual}")
+        print(f"{len(mismatches)} mismatching users.")
+        conn.close()
+        sys.exit(1 if mismatches else 0)
+    conn.close()
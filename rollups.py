@@ -0,0 +1,154 @@
+import json
+import sqlite3
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import partitions
+import schema
+from risk import FRESH_AGE, SLEEPER_AGE
+
+# resolution -> (table, bucket column, bucket width in seconds, label format)
+RESOLUTIONS = {
+    "minute": ("likes_minutely", "minute_epoch", 60, "%Y-%m-%d %H:%M"),
+    "hour": ("likes_hourly", "hour_epoch", 3600, "%Y-%m-%d %H:00"),
+    "day": ("likes_daily", "day_epoch", 86400, "%Y-%m-%d"),
+}
+
+# Per-like classification, same rules as the /api/activity risk labels.
+# Expects likes aliased `l` joined to users `u`.
+FRESH_SQL = f"(l.timestamp - u.created_at < {FRESH_AGE})"
+SLEEPER_SQL = f"(u.is_bot AND l.timestamp - u.created_at > {SLEEPER_AGE})"
+
+def classify(ts, created_at, is_bot):
+    """Return (is_fresh, is_sleeper) for a like at `ts` by a user created at `created_at`."""
+    age = ts - created_at
+    return age < FRESH_AGE, bool(is_bot) and age > SLEEPER_AGE
+
+# --- Maintenance ---
+
+def rebuild(conn):
+    """Recompute every rollup table from likes."""
+    for table, col, width, _ in RESOLUTIONS.values():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"""
+            INSERT INTO {table} (video_id, {col}, count, fresh_count, sleeper_count)
+            SELECT l.video_id, l.timestamp / {width} * {width} as bucket,
+                   COUNT(*), SUM({FRESH_SQL}), SUM({SLEEPER_SQL})
+            FROM likes l JOIN users u ON l.user_id = u.id
+            GROUP BY l.video_id, bucket
+        """)
+
+def user_info(conn, user_ids):
+    """user_id -> (created_at, is_bot) for a batch of ids (one query)."""
+    rows = conn.execute("""
+        SELECT id, created_at, is_bot FROM users WHERE id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(sorted(user_ids)),))
+    return {uid: (created_at, is_bot) for uid, created_at, is_bot in rows}
+
+def apply_likes(conn, likes, users=None):
+    """
+    Add a batch of new likes (user_id, video_id, timestamp) to every rollup.
+    `users` may pass a precomputed user_info() mapping to avoid the lookup.
+    """
+    likes = likes if isinstance(likes, list) else list(likes)
+    if not likes: return
+    if users is None:
+        users = user_info(conn, {uid for uid, _, _ in likes})
+
+    # Aggregate at the finest resolution once, then fold into the coarser ones.
+    # (video_id, bucket) -> [count, fresh, sleeper]
+    finest = min(RESOLUTIONS.values(), key=lambda r: r[2])[2]
+    agg = defaultdict(lambda: [0, 0, 0])
+    for uid, vid, ts in likes:
+        if uid not in users: continue  # as rebuild(), whose JOIN drops likes of unknown users
+        created_at, is_bot = users[uid]
+        fresh, sleeper = classify(ts, created_at, is_bot)
+        a = agg[(vid, ts // finest * finest)]
+        a[0] += 1
+        a[1] += fresh
+        a[2] += sleeper
+
+    for table, col, width, _ in RESOLUTIONS.values():
+        if width == finest:
+            level = agg
+        else:
+            level = defaultdict(lambda: [0, 0, 0])
+            for (vid, bucket), (n, f, s) in agg.items():
+                a = level[(vid, bucket // width * width)]
+                a[0] += n
+                a[1] += f
+                a[2] += s
+        conn.executemany(f"""
+            INSERT INTO {table} (video_id, {col}, count, fresh_count, sleeper_count) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(video_id, {col}) DO UPDATE SET
+                count = count + excluded.count,
+                fresh_count = fresh_count + excluded.fresh_count,
+                sleeper_count = sleeper_count + excluded.sleeper_count
+        """, [(vid, bucket, n, f, s) for (vid, bucket), (n, f, s) in level.items()])
+
+# --- Queries ---
+
+def series(conn, video_id, resolution="hour", start=None, end=None):
+    """Rows of (bucket_epoch, count, fresh_count, sleeper_count) in [start, end), oldest first."""
+    table, col, _, _ = RESOLUTIONS[resolution]
+    return conn.execute(f"""
+        SELECT {col}, count, fresh_count, sleeper_count FROM {table}
+        WHERE video_id = ? AND {col} >= ? AND {col} < ?
+        ORDER BY {col} ASC
+    """, (video_id, start if start is not None else 0, end if end is not None else 2**62)).fetchall()
+
+def label(bucket, resolution="hour"):
+    return datetime.fromtimestamp(bucket, timezone.utc).strftime(RESOLUTIONS[resolution][3])
+
+def lttb(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Returns the indices of the points to keep (always includes first and last; only
+    the first when threshold is 1, none when it is below 1).
+    """
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][:max(threshold, 0)]
+
+    keep = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        nxt_start = int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        span = nxt_end - nxt_start
+        avg_x = sum(xs[nxt_start:nxt_end]) / span
+        avg_y = sum(ys[nxt_start:nxt_end]) / span
+
+        # Pick the point in the current bucket forming the largest triangle
+        lo = int(i * every) + 1
+        hi = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return keep
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Rebuild the per-video like rollups.")
+    parser.add_argument("--db", default=schema.DB_NAME)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    schema.migrate(conn)
+    partitions.full_history(conn)  # include archived months
+    t0 = time.time()
+    rebuild(conn)
+    conn.commit()
+    print(f"Rebuilt rollups in {time.time() - t0:.2f}s")
+    conn.close()
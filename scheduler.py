@@ -0,0 +1,224 @@
+"""
+Background detection jobs and the precomputed alert ranking.
+
+    alerts            hourly spikes with their fresh-account likes, ranked by
+                      (fresh_bots, score); read by get_security_briefing and /api/alerts
+    detection_jobs    per job: likes.id processed up to, count and last timing of the
+                      runs that wrote (runs with nothing new only count in Scheduler.stats)
+
+A job's `compute` runs in a worker process on its own read-only connection and only
+looks at likes added since the job's watermark (the first run covers everything);
+its `apply` writes the result through the shared db.Writer, skipped when the result
+is empty: a commit bumps PRAGMA data_version, which would drop every cached agent tool
+result (tool_cache.py) once per interval on an idle database. The Scheduler thread
+runs every job each `interval` seconds and right after each ingest batch (notify()).
+"""
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+import schema
+
+INTERVAL = 60   # seconds between runs of a job
+WORKERS = 2     # processes computing jobs
+
+# --- Spike Alerts ---
+
+ALERT_SQL = """
+    SELECT s.video_id, s.start, s.end, s.count, h.fresh_count, s.baseline, s.score
+    FROM spikes s JOIN likes_hourly h ON h.video_id = s.video_id AND h.hour_epoch = s.start
+    WHERE s.resolution = 'hour'
+"""
+
+def spike_alerts(db_name, watermark=None):
+    """
+    Alert rows for the hourly spikes in the hours that received likes after `watermark`
+    (every spike when None), plus the hours of alerts whose spike has been cleared since.
+    Fresh-account likes come from the hourly rollup, which still holds archived and
+    compacted months. Returns (new watermark, touched hours or None for all, rows).
+    """
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+    try:
+        top = conn.execute("SELECT MAX(id) FROM likes").fetchone()[0] or 0
+        if watermark is None:
+            return top, None, conn.execute(ALERT_SQL).fetchall()
+        # New likes are a rowid range of the hot table (archive() always leaves the max id there)
+        touched = conn.execute("""
+            SELECT DISTINCT video_id, timestamp / 3600 * 3600 FROM likes WHERE id > ? AND id <= ?
+        """, (watermark, top)).fetchall()
+        # Spikes cleared outside ingest (spikes.py re-detection)
+        touched += conn.execute("""
+            SELECT video_id, start FROM alerts WHERE NOT EXISTS (
+                SELECT 1 FROM spikes s WHERE s.video_id = alerts.video_id AND s.resolution = 'hour' AND s.start = alerts.start)
+        """).fetchall()
+        if not touched: return top, [], []
+        rows = conn.execute(ALERT_SQL + """
+            AND (s.video_id, s.start) IN (SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))
+        """, (json.dumps(touched),)).fetchall()
+        return top, touched, rows
+    finally:
+        conn.close()
+
+def apply_spike_alerts(conn, result, now):
+    """Replace the alerts of the touched hours (all of them on a full run). Returns rows written."""
+    _, touched, rows = result
+    if touched is None:
+        conn.execute("DELETE FROM alerts")
+    else:
+        conn.execute("""
+            DELETE FROM alerts WHERE (video_id, start) IN (SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))
+        """, (json.dumps(touched),))
+    conn.executemany("INSERT INTO alerts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (tuple(r) + (now,) for r in rows))
+    return len(rows)
+
+def ranked(conn, limit=20):
+    """
+    Top `limit` alerts (with the video title) from the precomputed ranking, or None
+    if the job has never run on this database.
+    """
+    if conn.execute("SELECT 1 FROM detection_jobs WHERE job = 'spike_alerts' AND watermark IS NOT NULL").fetchone() is None:
+        return None
+    return conn.execute("""
+        SELECT a.video_id, v.title, a.start, a.end, a.total_likes, a.fresh_bots, a.baseline, a.score, a.updated_at
+        FROM alerts a JOIN videos v ON v.id = a.video_id
+        ORDER BY a.fresh_bots DESC, a.score DESC LIMIT ?
+    """, (limit,)).fetchall()
+
+# job -> (compute(db_name, watermark) in a worker, apply(conn, result, now) on the writer, interval)
+JOBS = {
+    "spike_alerts": (spike_alerts, apply_spike_alerts, float(os.getenv("ALERTS_INTERVAL", INTERVAL))),
+}
+
+# --- Running ---
+
+def run_job(writer, db_name, name, executor=None, now=None):
+    """
+    Run one job (compute in `executor`, inline without one), apply and record it.
+    Returns (rows written, or None if there was nothing new to apply, seconds).
+    """
+    compute, apply, _ = JOBS[name]
+    t0 = time.perf_counter()
+    with writer.lock:
+        row = writer.conn.execute("SELECT watermark FROM detection_jobs WHERE job = ?", (name,)).fetchone()
+    watermark = row[0] if row else None
+    result = executor.submit(compute, db_name, watermark).result() if executor else compute(db_name, watermark)
+    if watermark is not None and result[0] == watermark and result[1] == []:
+        seconds = time.perf_counter() - t0
+        metrics.JOB_SECONDS.observe(seconds, name)
+        return None, seconds
+    now = int(now if now is not None else time.time())
+    with writer.transaction() as conn:
+        rows = apply(conn, result, now)
+        seconds = time.perf_counter() - t0
+        conn.execute("""
+            INSERT INTO detection_jobs (job, watermark, runs, last_run, last_seconds) VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT (job) DO UPDATE SET watermark = excluded.watermark, runs = runs + 1,
+                last_run = excluded.last_run, last_seconds = excluded.last_seconds
+        """, (name, result[0], now, seconds))
+    metrics.JOB_SECONDS.observe(seconds, name)
+    return rows, seconds
+
+def reset(conn, names=None):
+    """Forget the watermarks, so the next run of each job recomputes everything."""
+    for name in names or JOBS:
+        conn.execute("UPDATE detection_jobs SET watermark = NULL WHERE job = ?", (name,))
+
+class Scheduler:
+    """
+    Thread that runs each job every `interval` seconds (its JOBS entry by default) and
+    as soon as notify() is called, computing on a process pool so request threads only
+    wait for the (short) apply under the writer lock. Notifications coalesce: a burst
+    of ingest batches triggers one run.
+    """
+
+    def __init__(self, writer, db_name=schema.DB_NAME, workers=WORKERS, intervals=None):
+        self.writer = writer
+        self.db_name = db_name
+        self.intervals = {name: (intervals or {}).get(name, job[2]) for name, job in JOBS.items()}
+        self.workers = workers
+        self.executor = self._executor()
+        self.stats = {name: {"runs": 0, "idle_runs": 0, "errors": 0, "rows": 0, "total_seconds": 0.0, "last_seconds": None,
+                             "last_run": None, "last_error": None} for name in JOBS}
+        self._due = dict.fromkeys(JOBS, 0.0)
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="detection-scheduler", daemon=True)
+        self._thread.start()
+
+    def _executor(self):
+        # spawn: forking a process that runs threads (uvicorn, the writer) can copy held locks
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def notify(self):
+        """Run every job now (called after an ingest batch commits)."""
+        self._due = dict.fromkeys(JOBS, 0.0)
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop:
+            for name in JOBS:
+                if time.monotonic() >= self._due[name] and not self._stop:
+                    self._due[name] = time.monotonic() + self.intervals[name]
+                    self._run_job(name)
+            self._wake.wait(max(0, min(self._due.values()) - time.monotonic()))
+            self._wake.clear()
+
+    def _run_job(self, name):
+        stats = self.stats[name]
+        try:
+            rows, seconds = run_job(self.writer, self.db_name, name, self.executor)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool): self.executor = self._executor()
+            stats["errors"] += 1
+            stats["last_error"] = str(e)
+            print(f"Detection job {name} failed: {e}")
+            return
+        stats["runs"] += 1
+        if rows is None: stats["idle_runs"] += 1
+        else: stats["rows"] = rows
+        stats["total_seconds"] += seconds
+        stats["last_seconds"] = round(seconds, 4)
+        stats["last_run"] = schema.to_iso(int(time.time()))
+
+    def report(self):
+        return {name: dict(s, interval=self.intervals[name], total_seconds=round(s["total_seconds"], 3),
+                           avg_seconds=round(s["total_seconds"] / s["runs"], 4) if s["runs"] else None)
+                for name, s in self.stats.items()}
+
+    def close(self):
+        self._stop = True
+        self._wake.set()
+        self._thread.join()
+        self.executor.shutdown(cancel_futures=True)
+
+if __name__ == "__main__":
+    import argparse
+    import db
+    parser = argparse.ArgumentParser(description="Run the background detection jobs once, or list the alert ranking.")
+    parser.add_argument("command", choices=["run", "rebuild", "list"])
+    parser.add_argument("--db", default=schema.DB_NAME)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    schema.migrate(conn)
+    conn.close()
+    writer = db.Writer(args.db)
+    if args.command in ("run", "rebuild"):
+        if args.command == "rebuild":
+            with writer.transaction() as conn:
+                reset(conn)
+        with ProcessPoolExecutor(WORKERS) as executor:
+            for name in JOBS:
+                rows, seconds = run_job(writer, args.db, name, executor)
+                print(f"{name}: {'up to date' if rows is None else f'{rows} rows'} in {seconds * 1000:.1f}ms")
+    else:
+        for r in ranked(writer.conn, args.limit) or []:
+            print(f"Video {r[0]} ('{r[1]}') @ {schema.to_iso(r[2])}: {r[5]} fresh of {r[4]} likes (z={r[7]})")
+    writer.close()
@@ -0,0 +1,473 @@
+import sqlite3
+import sys
+from datetime import datetime, timezone
+
+DB_NAME = "social_media_logs.db"
+
+# Schema versions are tracked in PRAGMA user_version.
+# 0: legacy layout written by the original data_gen.py (ISO text timestamps, no indexes)
+# 1: integer epoch-second timestamps + covering indexes on likes
+# 2: materialized user_risk feature table (see risk.py)
+# 3: per-video hourly/minute like rollups and detected spikes (see spikes.py)
+# 4: fresh/sleeper counts on the rollups plus a daily rollup (see rollups.py)
+# 5: unique usernames plus a trigram full-text index over them (see user_search.py)
+# 6: co-engagement graph and coordinated user clusters (see clusters.py)
+# 7: per-user like count / last active / recent likes summary (see profiles.py)
+# 8: spill table for the in-memory like velocity tracker (see velocity.py)
+# 9: monthly likes partitions catalog and compacted-month user totals (see partitions.py)
+# 10: precomputed alert ranking and detection job state (see scheduler.py)
+
+def to_epoch(value):
+    """Convert a datetime or ISO-8601 string to integer epoch seconds (UTC)."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def to_iso(ts):
+    """Render epoch seconds as an ISO-8601 UTC string (the format the API has always returned)."""
+    if ts is None: return None
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+# Tables computed from users/videos/likes; safe to drop and rebuild.
+DERIVED_TABLES = ["user_risk", "likes_hourly", "likes_minutely", "likes_daily", "spikes", "users_fts",
+                  "co_engagement", "user_clusters", "clusters", "cluster_meta", "user_summary",
+                  "user_velocity", "alerts", "detection_jobs"]
+
+def _table_exists(conn, name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (name,)).fetchone()
+    return row is not None
+
+# --- Table Definitions ---
+
+def create_tables(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        created_at INTEGER, -- epoch seconds (UTC)
+        is_bot BOOLEAN
+    )""")
+
+    conn.execute("""CREATE TABLE IF NOT EXISTS videos (
+        id INTEGER PRIMARY KEY,
+        title TEXT,
+        upload_date INTEGER, -- epoch seconds (UTC)
+        archetype TEXT -- 'viral', 'flop', 'steady', 'dead'
+    )""")
+
+    conn.execute("""CREATE TABLE IF NOT EXISTS likes (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        video_id INTEGER,
+        timestamp INTEGER, -- epoch seconds (UTC)
+        FOREIGN KEY(user_id) REFERENCES users(id),
+        FOREIGN KEY(video_id) REFERENCES videos(id)
+    )""")
+
+    # Derived per-user risk features, maintained by risk.py.
+    # age_bucket: 'fresh' (< 48h old), 'established', 'dormant' (> 90 days old)
+    conn.execute("""CREATE TABLE IF NOT EXISTS user_risk (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        created_at INTEGER,
+        is_bot BOOLEAN,
+        total_likes INTEGER NOT NULL DEFAULT 0,
+        first_like INTEGER,
+        last_like INTEGER,
+        age_bucket TEXT,
+        in_spike INTEGER NOT NULL DEFAULT 0,
+        risk_score INTEGER NOT NULL DEFAULT 0,
+        alert_reason TEXT NOT NULL DEFAULT 'Normal'
+    )""")
+
+    # Like counts per video per bucket, maintained by rollups.py.
+    # fresh_count: likes from accounts < 48h old; sleeper_count: bot accounts > 90 days old
+    for table, col in (("likes_minutely", "minute_epoch"), ("likes_hourly", "hour_epoch"), ("likes_daily", "day_epoch")):
+        conn.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+            video_id INTEGER,
+            {col} INTEGER, -- start of the bucket (epoch seconds)
+            count INTEGER NOT NULL DEFAULT 0,
+            fresh_count INTEGER NOT NULL DEFAULT 0,
+            sleeper_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (video_id, {col})
+        ) WITHOUT ROWID""")
+
+    # Buckets whose count deviates from their rolling baseline.
+    conn.execute("""CREATE TABLE IF NOT EXISTS spikes (
+        id INTEGER PRIMARY KEY,
+        video_id INTEGER,
+        resolution TEXT, -- 'hour' | 'minute'
+        start INTEGER, -- epoch seconds, inclusive
+        end INTEGER, -- epoch seconds, exclusive
+        count INTEGER,
+        baseline REAL, -- median of the baseline window
+        score REAL, -- robust z-score
+        detected_at INTEGER,
+        UNIQUE (video_id, resolution, start)
+    )""")
+
+    # Co-engagement graph, maintained by clusters.py: pairs of users (user_a < user_b)
+    # and the number of (video, time window) buckets they both liked in.
+    conn.execute("""CREATE TABLE IF NOT EXISTS co_engagement (
+        user_a INTEGER,
+        user_b INTEGER,
+        shared INTEGER NOT NULL,
+        PRIMARY KEY (user_a, user_b)
+    ) WITHOUT ROWID""")
+
+    # Connected components of strongly linked users; cluster id = smallest member id.
+    conn.execute("""CREATE TABLE IF NOT EXISTS user_clusters (
+        user_id INTEGER PRIMARY KEY,
+        cluster_id INTEGER NOT NULL
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS clusters (
+        id INTEGER PRIMARY KEY,
+        size INTEGER NOT NULL,
+        edges INTEGER NOT NULL, -- links (pairs over the shared threshold) inside the cluster
+        updated_at INTEGER
+    )""")
+    # Parameters of the last full rebuild (no row: never built, incremental updates are skipped)
+    conn.execute("""CREATE TABLE IF NOT EXISTS cluster_meta (
+        window INTEGER,
+        min_shared INTEGER,
+        max_bucket_users INTEGER,
+        built_at INTEGER
+    )""")
+
+    # Per-user profile summary, maintained by profiles.py.
+    # recent: JSON [[video_id, timestamp], ...] of the last few likes, newest first
+    conn.execute("""CREATE TABLE IF NOT EXISTS user_summary (
+        user_id INTEGER PRIMARY KEY,
+        total_likes INTEGER NOT NULL,
+        last_active INTEGER,
+        recent TEXT NOT NULL
+    )""")
+
+    # Velocity state of users evicted from the in-memory tracker (velocity.STATE bytes)
+    conn.execute("""CREATE TABLE IF NOT EXISTS user_velocity (
+        user_id INTEGER PRIMARY KEY,
+        last INTEGER, -- latest like (epoch seconds)
+        state BLOB NOT NULL
+    )""")
+
+    # Monthly partitions of archived likes (likes_YYYY_MM, see partitions.py)
+    conn.execute("""CREATE TABLE IF NOT EXISTS likes_partitions (
+        name TEXT PRIMARY KEY,
+        start INTEGER NOT NULL, -- month start (epoch seconds, UTC)
+        end INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        compacted_at INTEGER -- set once rolled into user_monthly and dropped
+    )""")
+    # Per-user totals of compacted months (their raw likes are gone)
+    conn.execute("""CREATE TABLE IF NOT EXISTS user_monthly (
+        user_id INTEGER,
+        month INTEGER, -- month start (epoch seconds, UTC)
+        likes INTEGER NOT NULL,
+        videos INTEGER NOT NULL,
+        first_like INTEGER,
+        last_like INTEGER,
+        PRIMARY KEY (user_id, month)
+    )""")
+
+    # Ranked alerts (hourly spikes with their fresh-account likes), maintained by scheduler.py
+    conn.execute("""CREATE TABLE IF NOT EXISTS alerts (
+        video_id INTEGER,
+        start INTEGER, -- spike hour (epoch seconds)
+        end INTEGER,
+        total_likes INTEGER NOT NULL,
+        fresh_bots INTEGER NOT NULL, -- likes from accounts < 48h old
+        baseline REAL,
+        score REAL, -- robust z-score of the spike
+        updated_at INTEGER,
+        PRIMARY KEY (video_id, start)
+    ) WITHOUT ROWID""")
+    # Background detection jobs: likes.id processed up to, and the last run's timing
+    conn.execute("""CREATE TABLE IF NOT EXISTS detection_jobs (
+        job TEXT PRIMARY KEY,
+        watermark INTEGER,
+        runs INTEGER NOT NULL DEFAULT 0,
+        last_run INTEGER,
+        last_seconds REAL
+    )""")
+
+def create_indexes(conn):
+    """
+    Secondary indexes. Kept separate from create_tables so bulk loaders can
+    insert first and build indexes once at the end.
+    """
+    # Per-video time series / hour drill-down. Includes user_id so the
+    # activity join never has to visit the table row.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_likes_video_ts ON likes(video_id, timestamp, user_id)")
+    # Per-user history (counts, last active, recent activity, spike participation).
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_likes_user_ts ON likes(user_id, timestamp, video_id)")
+    # Exact /api/users/{username} lookups; usernames are unique from schema 5 on
+    if not _index_exists(conn, "idx_users_username"): dedupe_usernames(conn)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+    # /api/users/risk walks this index and stops after `limit` rows
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_risk_score ON user_risk(risk_score DESC, total_likes DESC)")
+    # risk.refresh_ages only visits users about to cross an age threshold
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_risk_age ON user_risk(age_bucket, created_at)")
+    # Spike participation: "is (video, timestamp) inside a detected spike?"
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_spikes_video_start ON spikes(video_id, start)")
+    # Cluster membership lists / merges
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_clusters_cluster ON user_clusters(cluster_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clusters_size ON clusters(size DESC)")
+    # Alert ranking (briefing, /api/alerts) stops after `limit` rows
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_rank ON alerts(fresh_bots DESC, score DESC)")
+    create_user_search(conn)
+
+def _index_exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone() is not None
+
+def dedupe_usernames(conn):
+    """Rename colliding usernames (the original generator drew them at random) to username_id, keeping the oldest."""
+    conn.execute("""
+        UPDATE users SET username = username || '_' || id
+        WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY username)
+    """)
+    if _table_exists(conn, "user_risk"):
+        conn.execute("""
+            UPDATE user_risk SET username = u.username FROM users u
+            WHERE u.id = user_risk.user_id AND user_risk.username IS NOT u.username
+        """)
+
+def create_user_search(conn):
+    """
+    Trigram FTS5 index over users.username for substring/prefix search. It stores
+    only the index (content is read from users) and triggers keep it in sync.
+    Built in one pass when first created, so bulk loaders should call this after inserting users.
+    """
+    if _table_exists(conn, "users_fts"): return
+    conn.execute("""CREATE VIRTUAL TABLE users_fts USING fts5(
+        username, content='users', content_rowid='id', tokenize='trigram'
+    )""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF username ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+        INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+    END""")
+    conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+# --- Migrations ---
+
+def _migrate_1(conn):
+    """Convert ISO text timestamps to epoch integers and add likes indexes."""
+    if not _table_exists(conn, "likes"):
+        create_tables(conn)
+        create_indexes(conn)
+        return
+
+    # Rebuild each table so the columns get INTEGER affinity. likes is renamed
+    # first so its foreign keys follow the other tables into *_legacy.
+    for table in ("likes", "videos", "users"):
+        conn.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+    create_tables(conn)
+
+    epoch = "CAST(strftime('%s', {0}) AS INTEGER)"
+    conn.execute(f"""
+        INSERT INTO users (id, username, created_at, is_bot)
+        SELECT id, username, {epoch.format('created_at')}, is_bot FROM users_legacy
+    """)
+    conn.execute(f"""
+        INSERT INTO videos (id, title, upload_date, archetype)
+        SELECT id, title, {epoch.format('upload_date')}, archetype FROM videos_legacy
+    """)
+    conn.execute(f"""
+        INSERT INTO likes (id, user_id, video_id, timestamp)
+        SELECT id, user_id, video_id, {epoch.format('timestamp')} FROM likes_legacy
+    """)
+
+    for table in ("likes", "videos", "users"):
+        conn.execute(f"DROP TABLE {table}_legacy")
+    create_indexes(conn)
+
+def _migrate_2(conn):
+    """Add the materialized user_risk table and populate it."""
+    import risk
+    create_tables(conn)
+    create_indexes(conn)
+    risk.rebuild(conn)
+
+def _migrate_3(conn):
+    """Add like rollups and the spikes table; re-score risk against detected spikes."""
+    import risk
+    import rollups
+    import spikes
+    create_tables(conn)
+    create_indexes(conn)
+    rollups.rebuild(conn)
+    spikes.detect_all(conn)
+    risk.rebuild(conn)
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def _migrate_4(conn):
+    """Add fresh/sleeper counts to the rollups and a daily rollup table."""
+    import rollups
+    for table in ("likes_minutely", "likes_hourly"):
+        for col in ("fresh_count", "sleeper_count"):
+            if col not in _columns(conn, table):
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} INTEGER NOT NULL DEFAULT 0")
+    create_tables(conn)
+    rollups.rebuild(conn)
+
+def _migrate_5(conn):
+    """Make usernames unique and add the trigram username search index."""
+    conn.execute("DROP INDEX IF EXISTS idx_users_username")
+    create_tables(conn)
+    create_indexes(conn)
+
+def _migrate_6(conn):
+    """Add the co-engagement graph and user clusters (built now if numpy/scipy are installed)."""
+    import clusters
+    create_tables(conn)
+    create_indexes(conn)
+    if clusters.available: clusters.rebuild(conn)
+
+def _migrate_7(conn):
+    """Add the per-user summary table behind /api/users/{username}."""
+    import profiles
+    create_tables(conn)
+    profiles.rebuild(conn)
+
+def _migrate_8(conn):
+    """Add the spill table of the like velocity tracker."""
+    create_tables(conn)
+
+def _migrate_9(conn):
+    """Add the catalog of monthly likes partitions and the compacted-month summary."""
+    create_tables(conn)
+
+def _migrate_10(conn):
+    """Add the precomputed alert ranking and detection job state (filled by scheduler.py)."""
+    create_tables(conn)
+    create_indexes(conn)
+
+def _migrate_11(conn):
+    """Rename the age-only 'New Account Velocity' alert to 'New Account' (velocity is scored by velocity.py)."""
+    conn.execute("UPDATE user_risk SET alert_reason = 'New Account' WHERE alert_reason = 'New Account Velocity'")
+
+MIGRATIONS = [
+    (1, _migrate_1),
+    (2, _migrate_2),
+    (3, _migrate_3),
+    (4, _migrate_4),
+    (5, _migrate_5),
+    (6, _migrate_6),
+    (7, _migrate_7),
+    (8, _migrate_8),
+    (9, _migrate_9),
+    (10, _migrate_10),
+    (11, _migrate_11),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn, verbose=False):
+    """Apply every pending migration, each in its own transaction."""
+    current = get_version(conn)
+    for version, step in MIGRATIONS:
+        if version <= current: continue
+        if verbose: print(f"Migrating schema {current} -> {version}: {step.__doc__}")
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        current = version
+    return current
+
+def create_schema(conn, indexes=True):
+    """Create an empty database at the latest schema version."""
+    create_tables(conn)
+    if indexes: create_indexes(conn)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+# --- Query Plan Checks ---
+
+# One entry per hot endpoint query: (description, sql, params, index expected in the plan).
+PLAN_CHECKS = [
+    ("/api/activity hour drill-down",
+     """SELECT u.username, u.is_bot, u.created_at, l.timestamp FROM likes l JOIN users u ON l.user_id = u.id
+        WHERE l.video_id = ? AND l.timestamp >= ? AND l.timestamp < ? ORDER BY l.timestamp ASC""",
+     (20, 0, 3600), "idx_likes_video_ts"),
+    ("/api/users/{username} lookup",
+     "SELECT * FROM users WHERE username = ?",
+     ("user_1",), "idx_users_username"),
+    ("profiles.rebuild recent likes",
+     "SELECT video_id, timestamp FROM likes WHERE user_id = ? ORDER BY timestamp DESC, video_id DESC LIMIT 5",
+     (1,), "idx_likes_user_ts"),
+    ("/api/users/risk ranking",
+     "SELECT * FROM user_risk ORDER BY risk_score DESC, total_likes DESC LIMIT ?",
+     (20,), "idx_user_risk_score"),
+    ("/api/users/risk next page (keyset)",
+     "SELECT user_id FROM user_risk WHERE risk_score = ? AND total_likes < ? ORDER BY risk_score DESC, total_likes DESC, user_id LIMIT ?",
+     (5, 3, 20), "idx_user_risk_score"),
+    ("/api/activity next page (keyset)",
+     """SELECT l.user_id FROM likes l WHERE l.video_id = ? AND l.timestamp >= ? AND l.timestamp < ?
+        AND (l.timestamp, l.user_id, l.id) > (?, ?, ?) ORDER BY l.timestamp, l.user_id, l.id LIMIT ?""",
+     (20, 0, 3600, 0, 0, 0, 100), "idx_likes_video_ts"),
+    ("/api/likes/{video_id} rollup series",
+     "SELECT hour_epoch, count, fresh_count, sleeper_count FROM likes_hourly WHERE video_id = ? AND hour_epoch >= ? AND hour_epoch < ? ORDER BY hour_epoch",
+     (20, 0, 3600), "PRIMARY KEY"),
+    ("spike participation lookup",
+     "SELECT 1 FROM spikes WHERE video_id = ? AND start <= ? AND end > ?",
+     (20, 0, 0), "idx_spikes_video_start"),
+    ("risk.refresh_ages stale fresh accounts",
+     "SELECT user_id FROM user_risk WHERE age_bucket = 'fresh' AND created_at <= ?",
+     (0,), "idx_user_risk_age"),
+    ("security briefing alert ranking",
+     "SELECT video_id, start FROM alerts ORDER BY fresh_bots DESC, score DESC LIMIT ?",
+     (5,), "idx_alerts_rank"),
+]
+
+def explain(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a query."""
+    return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+def check_query_plans(conn):
+    """
+    Run EXPLAIN QUERY PLAN over PLAN_CHECKS.
+    Returns a list of (description, plan) for queries that do not use the expected index.
+    """
+    failures = []
+    for desc, sql, params, index in PLAN_CHECKS:
+        plan = explain(conn, sql, params)
+        full_scan = any(line.startswith("SCAN ") and " USING " not in line for line in plan)
+        if full_scan or not any(index in line for line in plan):
+            failures.append((desc, plan))
+    return failures
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Create/upgrade the social media logs database.")
+    parser.add_argument("db", nargs="?", default=DB_NAME)
+    parser.add_argument("--check", action="store_true", help="Verify endpoint queries use indexes (EXPLAIN QUERY PLAN)")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    version = migrate(conn, verbose=True)
+    print(f"Schema version: {version}")
+
+    if args.check:
+        failures = check_query_plans(conn)
+        for desc, plan in failures:
+            print(f"FAIL {desc}: {plan}")
+        print(f"{len(PLAN_CHECKS) - len(failures)}/{len(PLAN_CHECKS)} endpoint queries use an index.")
+        conn.close()
+        sys.exit(1 if failures else 0)
+    conn.close()
@@ -0,0 +1,96 @@
+"""
+Production serving: the API in several worker processes over one SQLite WAL database.
+
+    python serve.py --workers 4
+    ANALYTICS_ENGINE=1 python serve.py --workers 4 --snapshot-interval 60
+
+A single process runs the CPU-bound part of every request (risk scoring, the
+activity flags, JSON encoding) on one core; here uvicorn starts --workers processes
+sharing one listening socket. Each worker has its own connection pool and writer
+(SQLite serializes the writers, WAL keeps readers unblocked). This process:
+
+    - migrates the schema once, before any worker opens the database
+    - runs the detection scheduler (workers start with DETECTION_SCHEDULER=0) and
+      wakes it when likes.id moves, since ingest now commits in other processes
+    - with ANALYTICS_ENGINE=1, publishes the analytics snapshot the workers map
+      (snapshot.py) and republishes it every --snapshot-interval seconds while
+      likes keep arriving, so each worker's private tail stays small
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import analytics
+import db
+import scheduler
+import schema
+import snapshot
+
+POLL = 1.0                # seconds between checks for new likes
+SNAPSHOT_INTERVAL = 300   # seconds between snapshot publications (while likes arrive)
+
+def watch(db_name, stop, sched=None, snapshot_dir=None, interval=SNAPSHOT_INTERVAL, poll=POLL):
+    """
+    Until `stop` is set: wake `sched` whenever new likes are committed, and republish
+    the snapshot in `snapshot_dir` at most every `interval` seconds.
+    """
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+    seen = published = conn.execute("SELECT MAX(id) FROM likes").fetchone()[0]
+    last_publish = time.monotonic()
+    while not stop.wait(poll):
+        top = conn.execute("SELECT MAX(id) FROM likes").fetchone()[0]
+        if top != seen and sched is not None: sched.notify()
+        seen = top
+        if snapshot_dir and top != published and time.monotonic() - last_publish >= interval:
+            try:
+                t0 = time.time()
+                name, likes = snapshot.publish(db_name, snapshot_dir)
+                print(f"Published analytics snapshot {name} ({likes} likes) in {time.time() - t0:.1f}s")
+                published = top
+            except Exception as e:
+                print(f"Analytics snapshot publish failed: {e}")
+            last_publish = time.monotonic()
+    conn.close()
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Serve the API from several worker processes.")
+    parser.add_argument("--db", default=schema.DB_NAME)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--snapshot-dir", default=snapshot.SNAPSHOT_DIR)
+    parser.add_argument("--snapshot-interval", type=float, default=SNAPSHOT_INTERVAL)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    schema.migrate(conn)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+
+    run_scheduler = os.getenv("DETECTION_SCHEDULER", "1") == "1"
+    use_snapshot = os.getenv("ANALYTICS_ENGINE") == "1" and analytics.available
+    # Read by web_server in every worker
+    os.environ.update(DB_PATH=args.db, SERVE_WORKERS=str(args.workers), DETECTION_SCHEDULER="0")
+    if use_snapshot:
+        t0 = time.time()
+        name, likes = snapshot.publish(args.db, args.snapshot_dir)
+        print(f"Analytics snapshot {name} ready in {time.time() - t0:.1f}s")
+        os.environ["ANALYTICS_SNAPSHOT"] = args.snapshot_dir
+
+    writer = db.Writer(args.db) if run_scheduler else None
+    sched = scheduler.Scheduler(writer, args.db) if run_scheduler else None
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch, name="serve-watch", daemon=True,
+                               args=(args.db, stop, sched, args.snapshot_dir if use_snapshot else None, args.snapshot_interval))
+    watcher.start()
+    try:
+        uvicorn.run("web_server:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
+    finally:
+        stop.set()
+        watcher.join()
+        if sched is not None: sched.close()
+        if writer is not None: writer.close()
@@ -0,0 +1,249 @@
+"""
+Read-only analytics snapshots shared by the worker processes of serve.py.
+
+    analytics_snapshot/CURRENT                    name of the published snapshot
+    analytics_snapshot/<like_max>-<user_max>/     its arrays (.npy) and meta.json
+
+publish() writes the analytics.Engine arrays (likes sorted by (video_id, timestamp),
+created_at / is_bot / username by user id) to a new directory, then points CURRENT
+at it with os.replace, so readers see the old snapshot or the new one, never half
+of one. Shared is the Engine each worker uses instead of loading its own copy: it
+memory-maps the current snapshot read-only, so the pages sit once in the OS page
+cache however many workers map them. Likes added after the snapshot are kept per
+worker in a small in-memory tail (refresh() pulls them from SQLite, queries merge
+them in); when a newer snapshot is published the worker remaps and starts a new tail.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import time
+from types import SimpleNamespace
+
+try:
+    import numpy as np
+except ImportError:  # optional, as for analytics.py: without it there are no snapshots to share
+    np = None
+
+import analytics
+import schema
+from analytics import _fetch, _insert
+
+SNAPSHOT_DIR = "analytics_snapshot"
+# Snapshots kept on disk: the current one and the one before (a worker may be about to map it)
+KEEP = 2
+
+LIKE_ARRAYS = ("video_id", "timestamp", "user_id", "key")
+USER_ARRAYS = ("created_at", "is_bot", "username")
+
+def current(directory=SNAPSHOT_DIR):
+    """Name of the published snapshot, or None."""
+    try:
+        with open(os.path.join(directory, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _no_likes():
+    return SimpleNamespace(video_id=np.empty(0, np.int32), timestamp=np.empty(0, np.int64),
+                           user_id=np.empty(0, np.int32), key=np.empty(0, np.int64))
+
+def _tail_users(size):
+    return {"created_at": np.zeros(size, np.int64), "is_bot": np.zeros(size, np.bool_),
+            "username": np.full(size, None, dtype=object)}
+
+class Shared(analytics.Engine):
+    """
+    analytics.Engine over a memory-mapped snapshot (`base`) plus the likes and users
+    added since (`tail`, user arrays indexed from base.users_from). Without a
+    published snapshot the base is empty and the tail holds everything.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR):
+        super().__init__()
+        self.directory = directory
+        self.remaps = 0
+
+    # --- Loading ---
+
+    def _open(self, name):
+        if name is None:
+            base = SimpleNamespace(**vars(_no_likes()), created_at=np.zeros(1, np.int64), is_bot=np.zeros(1, np.bool_),
+                                   username=np.zeros(1, "S1"), like_max=0, user_max=0, uid_top=0)
+        else:
+            path = os.path.join(self.directory, name)
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            base = SimpleNamespace(**{a: np.load(os.path.join(path, f"{a}.npy"), mmap_mode="r")
+                                      for a in LIKE_ARRAYS + USER_ARRAYS}, **meta)
+        base.users_from = base.user_max + 1
+        # Likes of unknown users past user_max are covered by the tail's user arrays
+        tail = SimpleNamespace(**vars(_no_likes()), **_tail_users(max(0, base.uid_top + 1 - base.users_from)))
+        return SimpleNamespace(name=name, base=base, tail=tail, like_max=base.like_max, user_max=base.user_max)
+
+    def _remap(self):
+        name = current(self.directory)
+        if self.snap is not None and name == self.snap.name: return
+        with self._lock:
+            if self.snap is not None and name == self.snap.name: return
+            try:
+                self.snap = self._open(name)
+            except FileNotFoundError:  # pruned by a newer publish after we read CURRENT
+                self.snap = self._open(current(self.directory))
+            self.remaps += 1
+
+    def load(self, conn):
+        t0 = time.perf_counter()
+        self.snap = None
+        self.refresh(conn)
+        self.load_seconds = time.perf_counter() - t0
+        return self
+
+    def refresh(self, conn):
+        """Switch to a newly published snapshot, then pull what it lacks into the tail. Returns new likes."""
+        self._remap()
+        like_max, user_max = conn.execute(
+            "SELECT (SELECT COALESCE(MAX(id), 0) FROM likes), (SELECT COALESCE(MAX(id), 0) FROM users)").fetchone()
+        snap = self.snap
+        if like_max <= snap.like_max and user_max <= snap.user_max:
+            return 0
+        with self._lock:
+            old = self.snap
+            if like_max <= old.like_max and user_max <= old.user_max:
+                return 0
+            vids, ts, uids = _fetch(conn, """
+                SELECT video_id, timestamp, user_id FROM likes WHERE id > ? AND id <= ?
+            """, (old.like_max, max(like_max, old.like_max)), (np.int32, np.int64, np.int32))
+            first = old.base.users_from
+            size = max(user_max + 1, int(uids.max()) + 1 if len(uids) else 0, first + len(old.tail.created_at)) - first
+            users = _tail_users(size)
+            for a in USER_ARRAYS:
+                users[a][:len(old.tail.created_at)] = getattr(old.tail, a)
+            if user_max > old.user_max:
+                params = (old.user_max, user_max)
+                ids, created, bots = _fetch(conn, "SELECT id, created_at, is_bot FROM users WHERE id > ? AND id <= ?",
+                                            params, (np.int64, np.int64, np.bool_))
+                users["created_at"][ids - first] = created
+                users["is_bot"][ids - first] = bots
+                users["username"][ids - first] = [r[0] for r in conn.execute(
+                    "SELECT username FROM users WHERE id > ? AND id <= ? ORDER BY id", params)]
+            tail = SimpleNamespace(**_insert(old.tail, vids, ts, uids), **users)
+            self.snap = SimpleNamespace(name=old.name, base=old.base, tail=tail,
+                                        like_max=max(like_max, old.like_max), user_max=max(user_max, old.user_max))
+            return len(vids)
+
+    def __len__(self):
+        return len(self.snap.base.key) + len(self.snap.tail.key) if self.snap else 0
+
+    # --- Queries ---
+
+    def _likes(self, snap, video_id, start, end):
+        b, t = self._slice(snap.base, video_id, start, end), self._slice(snap.tail, video_id, start, end)
+        uids, ts = snap.base.user_id[b], snap.base.timestamp[b]
+        if t.stop > t.start:
+            # Tail likes go after base likes with the same timestamp, as Engine.refresh would insert them
+            uids, ts = np.concatenate((uids, snap.tail.user_id[t])), np.concatenate((ts, snap.tail.timestamp[t]))
+            order = np.argsort(ts, kind="stable")
+            uids, ts = uids[order], ts[order]
+        return uids, ts
+
+    def _split(self, snap, uids):
+        old = uids < snap.base.users_from
+        return old, uids[old], uids[~old] - snap.base.users_from
+
+    def _users(self, snap, uids):
+        old, base_ids, tail_ids = self._split(snap, uids)
+        if not len(tail_ids):
+            return snap.base.created_at[base_ids], snap.base.is_bot[base_ids]
+        created, bots = np.empty(len(uids), np.int64), np.empty(len(uids), np.bool_)
+        created[old], created[~old] = snap.base.created_at[base_ids], snap.tail.created_at[tail_ids]
+        bots[old], bots[~old] = snap.base.is_bot[base_ids], snap.tail.is_bot[tail_ids]
+        return created, bots
+
+    def _usernames(self, snap, uids):
+        old, base_ids, tail_ids = self._split(snap, uids)
+        names = np.empty(len(uids), dtype=object)
+        names[old] = [n.decode() if n else None for n in snap.base.username[base_ids].tolist()]
+        names[~old] = snap.tail.username[tail_ids]
+        return names
+
+    def merged(self, snap=None):
+        """The base and tail merged into plain Engine arrays (a private copy, for publish and aggregate)."""
+        snap = snap or self.snap
+        base, tail = snap.base, snap.tail
+        likes = _insert(base, tail.video_id, tail.timestamp, tail.user_id)
+        names = np.array([(n or "").encode() for n in tail.username.tolist()], dtype="S") if len(tail.username) else np.zeros(0, "S1")
+        return SimpleNamespace(**likes, like_max=snap.like_max, user_max=snap.user_max,
+                               created_at=np.concatenate((base.created_at[:base.users_from], tail.created_at)),
+                               is_bot=np.concatenate((base.is_bot[:base.users_from], tail.is_bot)),
+                               username=np.concatenate((base.username[:base.users_from], names)))
+
+    def aggregate(self, width=3600):
+        flat = analytics.Engine()
+        flat.snap = self.merged()
+        return flat.aggregate(width)
+
+# --- Publishing ---
+
+def publish(db_name=schema.DB_NAME, directory=SNAPSHOT_DIR, keep=KEEP):
+    """
+    Write a snapshot of the database (the current one plus the likes since, when there
+    is one) and make it current. Returns (name, likes), or (name, None) if the current
+    snapshot already covers every like and user.
+    """
+    os.makedirs(directory, exist_ok=True)
+    engine = Shared(directory)
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+    try:
+        engine.load(conn)
+    finally:
+        conn.close()
+    snap = engine.snap
+    name = f"{snap.like_max}-{snap.user_max}"
+    if name == snap.name: return name, None
+    flat = engine.merged(snap)
+    path, tmp = os.path.join(directory, name), os.path.join(directory, f".{name}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for a in LIKE_ARRAYS + USER_ARRAYS:
+        np.save(os.path.join(tmp, f"{a}.npy"), getattr(flat, a))
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({"like_max": flat.like_max, "user_max": flat.user_max,
+                   "uid_top": len(flat.created_at) - 1, "published_at": int(time.time())}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    with open(os.path.join(directory, ".CURRENT.tmp"), "w") as f:
+        f.write(name)
+    os.replace(os.path.join(directory, ".CURRENT.tmp"), os.path.join(directory, "CURRENT"))
+    # Workers still mapping a removed snapshot keep reading it until they remap (the pages stay until unmapped)
+    published = sorted((os.path.getmtime(os.path.join(directory, d)), d) for d in os.listdir(directory)
+                       if not d.startswith(".") and os.path.isdir(os.path.join(directory, d)))
+    for _, old in published[:-keep]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return name, len(flat.key)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Publish the shared analytics snapshot, or show the current one.")
+    parser.add_argument("command", choices=["publish", "show"])
+    parser.add_argument("--db", default=schema.DB_NAME)
+    parser.add_argument("--dir", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        if not analytics.available:
+            raise SystemExit("numpy is not installed; the analytics snapshot is unavailable.")
+        t0 = time.time()
+        name, likes = publish(args.db, args.dir)
+        print(f"Snapshot {name} is current" if likes is None else
+              f"Published snapshot {name} ({likes} likes) in {time.time() - t0:.1f}s")
+    else:
+        name = current(args.dir)
+        if name is None:
+            raise SystemExit(f"No snapshot published in {args.dir}.")
+        path = os.path.join(args.dir, name)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        size = sum(os.path.getsize(os.path.join(path, e)) for e in os.listdir(path))
+        print(f"{name}: likes up to id {meta['like_max']}, users up to id {meta['user_max']}, "
+              f"published {schema.to_iso(meta['published_at'])}, {size / 2**20:.0f} MB")
@@ -0,0 +1,129 @@
+import json
+import sqlite3
+import statistics
+import time
+
+import rollups
+import partitions
+import schema
+
+# resolution -> (baseline window in buckets, minimum likes for a bucket to count as a spike)
+# Counts come from the matching rollups.RESOLUTIONS table.
+DETECTION = {
+    "hour": (168, 20),   # baseline: previous 7 days
+    "minute": (60, 10),  # baseline: previous hour
+}
+
+# Robust z-score a bucket must reach to be flagged
+Z_THRESHOLD = 6.0
+
+def robust_score(count, baseline):
+    """
+    Robust z-score of `count` against the baseline window (median / MAD).
+    The scale is floored at a Poisson-like sqrt(median + 1) so that sparse,
+    mostly-zero windows don't turn every non-zero bucket into a spike.
+    Returns (score, median).
+    """
+    median = statistics.median(baseline) if baseline else 0
+    mad = statistics.median([abs(x - median) for x in baseline]) if baseline else 0
+    scale = max(1.4826 * mad, (median + 1) ** 0.5)
+    return (count - median) / scale, median
+
+# --- Detection ---
+
+def _baseline(conn, resolution, video_id, bucket):
+    """Counts of the `window` buckets preceding `bucket`, zero-filled."""
+    table, col, width, _ = rollups.RESOLUTIONS[resolution]
+    window, _ = DETECTION[resolution]
+    rows = conn.execute(f"""
+        SELECT {col}, count FROM {table}
+        WHERE video_id = ? AND {col} >= ? AND {col} < ?
+    """, (video_id, bucket - window * width, bucket)).fetchall()
+    counts = [0] * window
+    for b, n in rows:
+        counts[(b - (bucket - window * width)) // width] = n
+    return counts
+
+def evaluate(conn, resolution, candidates, now=None):
+    """
+    Score (video_id, bucket, count) candidates and sync the spikes table.
+    Returns the list of (video_id, start, end) windows whose spike status changed.
+    """
+    now = int(now if now is not None else time.time())
+    width = rollups.RESOLUTIONS[resolution][2]
+    min_likes = DETECTION[resolution][1]
+    changed = []
+    for video_id, bucket, count in candidates:
+        existing = conn.execute(
+            "SELECT 1 FROM spikes WHERE video_id = ? AND resolution = ? AND start = ?",
+            (video_id, resolution, bucket)).fetchone()
+        score, median = (0.0, 0) if count < min_likes else robust_score(count, _baseline(conn, resolution, video_id, bucket))
+        if score >= Z_THRESHOLD:
+            conn.execute("""
+                INSERT INTO spikes (video_id, resolution, start, end, count, baseline, score, detected_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(video_id, resolution, start) DO UPDATE SET
+                    count = excluded.count, baseline = excluded.baseline, score = excluded.score
+            """, (video_id, resolution, bucket, bucket + width, count, median, round(score, 2), now))
+            if not existing: changed.append((video_id, bucket, bucket + width))
+        elif existing:
+            conn.execute("DELETE FROM spikes WHERE video_id = ? AND resolution = ? AND start = ?",
+                         (video_id, resolution, bucket))
+            changed.append((video_id, bucket, bucket + width))
+    return changed
+
+def detect_all(conn, now=None):
+    """Re-run detection over every rollup bucket large enough to be a spike."""
+    conn.execute("DELETE FROM spikes")
+    for resolution, (_, min_likes) in DETECTION.items():
+        table, col, _, _ = rollups.RESOLUTIONS[resolution]
+        candidates = conn.execute(
+            f"SELECT video_id, {col}, count FROM {table} WHERE count >= ?", (min_likes,)).fetchall()
+        evaluate(conn, resolution, candidates, now)
+
+def apply_likes(conn, likes, now=None):
+    """
+    Re-evaluate only the buckets touched by a batch of new likes (user_id, video_id, timestamp).
+    Expects rollups.apply_likes to have been applied for the same batch. Returns the changed
+    spike windows so callers can refresh spike participation (risk.refresh_spike_participation).
+    """
+    changed = []
+    for resolution, (_, min_likes) in DETECTION.items():
+        table, col, width, _ = rollups.RESOLUTIONS[resolution]
+        touched = {(vid, ts // width * width) for _, vid, ts in likes}
+        # Counts only grow at ingest, so buckets still under min_likes can't have become spikes
+        candidates = conn.execute(f"""
+            SELECT r.video_id, r.{col}, r.count
+            FROM json_each(?) j
+            JOIN {table} r ON r.video_id = json_extract(j.value, '$[0]') AND r.{col} = json_extract(j.value, '$[1]')
+            WHERE r.count >= ?
+        """, (json.dumps(sorted(touched)), min_likes)).fetchall()
+        changed.extend(evaluate(conn, resolution, candidates, now))
+    return changed
+
+def spike_at(conn, video_id, ts):
+    """Return the hour-resolution spike row covering (video_id, ts), or None."""
+    return conn.execute("""
+        SELECT * FROM spikes
+        WHERE video_id = ? AND resolution = 'hour' AND start <= ? AND end > ?
+        ORDER BY start DESC LIMIT 1
+    """, (video_id, ts, ts)).fetchone()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Re-run spike detection over all history.")
+    parser.add_argument("--db", default=schema.DB_NAME)
+    args = parser.parse_args()
+
+    import risk
+    conn = sqlite3.connect(args.db)
+    schema.migrate(conn)
+    partitions.full_history(conn)  # include archived months
+    t0 = time.time()
+    detect_all(conn)
+    risk.rebuild(conn)
+    conn.commit()
+    for row in conn.execute("SELECT video_id, resolution, start, count, baseline, score FROM spikes ORDER BY score DESC LIMIT 20"):
+        print(f"Video {row[0]} {row[1]} @ {schema.to_iso(row[2])}: {row[3]} likes (baseline {row[4]}, z={row[5]})")
+    print(f"Spike detection complete in {time.time() - t0:.2f}s")
+    conn.close()
@@ -0,0 +1,143 @@
+import re
+import sqlite3
+import time
+
+import schema
+
+# Per-query budgets for model-written SQL
+MAX_ROWS = 20            # rows materialized (and returned to the agent)
+MAX_VM_STEPS = 50_000_000
+TIME_LIMIT = 2.0         # seconds
+PROGRESS_EVERY = 10_000  # VM instructions between budget checks
+# Largest string/blob a query may build (randomblob, zeroblob, printf widths, ||), and SQL text
+MAX_LENGTH = 1_000_000   # bytes
+MAX_SQL_LENGTH = 100_000
+
+# Full scans are refused on tables with at least this many rows
+LARGE_TABLE_ROWS = 100_000
+
+# Authorizer actions a read-only query needs; everything else (writes, ATTACH,
+# PRAGMA, transactions, schema changes) is denied
+ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+class QueryRejected(Exception):
+    pass
+
+def _authorizer(action, arg1, arg2, db_name, trigger):
+    return sqlite3.SQLITE_OK if action in ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+
+def _table_sizes(conn, tables):
+    """Row count of each table, capped at LARGE_TABLE_ROWS (so the check itself stays cheap)."""
+    return {t: conn.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM "{t}" LIMIT ?)', (LARGE_TABLE_ROWS,)).fetchone()[0]
+            for t in tables}
+
+def full_scans(conn, sql, params=()):
+    """
+    Tables a query would read in full, from its bytecode (EXPLAIN) rather than its
+    text, so aliases, quoting and schema prefixes make no difference: a cursor opened
+    on the table or one of its indexes that is walked from Rewind/Last with Next/Prev,
+    or counted whole (Count). A Next/Prev the program can never reach (the min/max
+    optimization reads one row and jumps past it) is not a walk.
+    """
+    roots = {r[0]: r[1] for r in conn.execute("SELECT rootpage, tbl_name FROM sqlite_master WHERE rootpage > 0")}
+    program = conn.execute(f"EXPLAIN {sql}", params).fetchall()
+    targets = {op[3] for op in program}  # p2: the jump target of every jump opcode (a register of the others)
+    opened, starts, steps = {}, set(), set()
+    for i, (addr, opcode, p1, p2, p3, *_) in enumerate(program):
+        if opcode == "OpenRead" and p3 == 0 and p2 in roots:
+            opened[p1] = roots[p2]
+        elif opcode in ("Rewind", "Last"):
+            starts.add(p1)
+        elif opcode in ("Next", "Prev"):
+            if i and program[i - 1][1] in ("Goto", "Halt") and addr not in targets: continue
+            steps.add(p1)
+        elif opcode == "Count":
+            starts.add(p1)
+            steps.add(p1)
+    return {table for cursor, table in opened.items() if cursor in starts and cursor in steps}
+
+def check_plan(conn, sql, params=()):
+    """Raise QueryRejected if the query reads a large table in full instead of through an index."""
+    scans = full_scans(conn, sql, params)
+    large = sorted(t for t, n in _table_sizes(conn, scans).items() if n >= LARGE_TABLE_ROWS)
+    if large:
+        raise QueryRejected(
+            f"Query would scan all of {', '.join(large)} (>= {LARGE_TABLE_ROWS:,} rows) without an index. "
+            "Filter likes on video_id (+ timestamp) or user_id, users on id or username, "
+            "or use get_security_briefing / get_video_stats for global questions.")
+
+def execute(conn, sql, params=(), max_rows=MAX_ROWS, max_steps=MAX_VM_STEPS, time_limit=TIME_LIMIT,
+            max_length=MAX_LENGTH):
+    """
+    Run one untrusted read-only query on `conn` under the budgets above.
+    Returns {"columns", "rows", "truncated", "stats": {"rows_returned", "vm_steps", "elapsed_ms"}}.
+    Raises QueryRejected (plan check / not a query / over budget) or sqlite3.Error (denied, invalid).
+    The authorizer, progress handler and length limits are restored before returning, so
+    pooled connections can be used. (One value like randomblob(300000000) costs memory
+    and time but almost no VM steps: only the length limit stops it.)
+    """
+    if not re.match(r"\s*(SELECT|WITH)\b", sql, re.IGNORECASE):
+        raise QueryRejected("Only SELECT queries are allowed.")
+
+    steps = 0
+    deadline = time.monotonic() + time_limit
+    def progress():
+        nonlocal steps
+        steps += PROGRESS_EVERY
+        return steps > max_steps or time.monotonic() > deadline  # non-zero aborts the query
+
+    t0 = time.perf_counter()
+    conn.set_authorizer(_authorizer)
+    length = conn.setlimit(sqlite3.SQLITE_LIMIT_LENGTH, max_length)
+    sql_length = conn.setlimit(sqlite3.SQLITE_LIMIT_SQL_LENGTH, MAX_SQL_LENGTH)
+    try:
+        check_plan(conn, sql, params)
+        conn.set_progress_handler(progress, PROGRESS_EVERY)
+        try:
+            cur = conn.execute(sql, params)
+            rows = cur.fetchmany(max_rows + 1)
+        except sqlite3.OperationalError as e:
+            if str(e) == "interrupted":
+                raise QueryRejected(f"Query exceeded its budget ({max_steps:,} VM steps / {time_limit}s) and was stopped.")
+            raise
+        finally:
+            conn.set_progress_handler(None, PROGRESS_EVERY)
+    except sqlite3.DataError as e:
+        raise QueryRejected(f"Query builds a value or has SQL text over its size limit ({max_length:,} / "
+                            f"{MAX_SQL_LENGTH:,} bytes): {e}")
+    finally:
+        conn.setlimit(sqlite3.SQLITE_LIMIT_LENGTH, length)
+        conn.setlimit(sqlite3.SQLITE_LIMIT_SQL_LENGTH, sql_length)
+        conn.set_authorizer(None)
+
+    truncated = len(rows) > max_rows
+    rows = rows[:max_rows]
+    return {
+        "columns": [d[0] for d in cur.description or []],
+        "rows": rows,
+        "truncated": truncated,
+        "stats": {
+            "rows_returned": len(rows),
+            # Stands in for rows scanned, which Python's sqlite3 cannot report (no
+            # sqlite3_stmt_status); approximate: counted in PROGRESS_EVERY increments
+            "vm_steps": steps,
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+        },
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a query through the guarded executor used by the agent.")
+    parser.add_argument("sql")
+    parser.add_argument("--db", default=schema.DB_NAME)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    try:
+        result = execute(conn, args.sql)
+    except (QueryRejected, sqlite3.Error) as e:
+        raise SystemExit(f"Rejected: {e}")
+    print(result["columns"])
+    for row in result["rows"]:
+        print(row)
+    print(f"{'(truncated) ' if result['truncated'] else ''}{result['stats']}")
@@ -0,0 +1,96 @@
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+# Defaults for the shared agent tool cache
+MAX_ENTRIES = 512
+TTL = 300  # seconds
+
+def _norm(value):
+    if isinstance(value, float) and value.is_integer(): return int(value)
+    if isinstance(value, str): return value.strip()
+    return value
+
+def normalize(defaults, args):
+    """
+    Canonical cache key for a call: defaults applied, floats that are whole numbers
+    as ints (the model often sends 20.0 for an integer), strings stripped.
+    """
+    merged = dict(defaults)
+    merged.update(args)
+    return tuple(sorted((k, _norm(v)) for k, v in merged.items()))
+
+class ToolCache:
+    """
+    Bounded LRU + TTL cache of tool results, keyed on (tool name, normalized args).
+    Every entry remembers the data version it was computed at; `version` is a
+    callable returning the current one (db.Pool.data_version), so any committed
+    write, from any process, makes older entries misses without having to walk the cache.
+    """
+
+    def __init__(self, version, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.stale = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                version, expires, value = entry
+                if version == self.version() and expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.stale += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, version):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def wrap(self, name, fn):
+        """Return fn with its results cached under `name`."""
+        defaults = {k: p.default for k, p in inspect.signature(fn).parameters.items()
+                    if p.default is not inspect.Parameter.empty}
+
+        @functools.wraps(fn)
+        def cached(**args):
+            key = (name, normalize(defaults, args))
+            hit, value = self.get(key)
+            if hit: return value
+            # Read the version before computing so a write landing mid-call can't be masked
+            version = self.version()
+            value = fn(**args)
+            self.put(key, value, version)
+            return value
+        return cached
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "data_version": self.version(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
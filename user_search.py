@@ -0,0 +1,89 @@
+import json
+
+# Columns returned by /api/users/risk and /api/users/search
+RISK_COLUMNS = """user_id as id, username, created_at, is_bot,
+                  in_spike as in_attack, total_likes, risk_score, alert_reason"""
+# Their names, in order
+RISK_FIELDS = [c.split(" as ")[-1].strip() for c in RISK_COLUMNS.split(",")]
+
+# Users walked down the risk ranking before consulting an index: a term that
+# matches densely (e.g. "user_1") finds its top-N here without an index lookup.
+WALK_ROWS = 1_000
+# A term matching more users than this is cheaper to answer by walking the whole
+# ranking (idx_user_risk_score) than by ranking every match.
+MAX_CANDIDATES = 20_000
+
+def like_pattern(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def candidates(conn, term, prefix=False):
+    """
+    Ids of users whose username contains `term` (trigram index users_fts) or starts
+    with it (range over idx_users_username). None when the index can't narrow the
+    search: substrings shorter than a trigram, or more than MAX_CANDIDATES matches.
+    """
+    if prefix:
+        rows = conn.execute("SELECT id FROM users WHERE username >= ? AND username < ? LIMIT ?",
+                            (term, term + "\U0010ffff", MAX_CANDIDATES + 1))
+    elif len(term) >= 3:
+        phrase = '"' + term.replace('"', '""') + '"'
+        rows = conn.execute("SELECT rowid FROM users_fts WHERE users_fts MATCH ? LIMIT ?",
+                            (phrase, MAX_CANDIDATES + 1))
+    else:
+        return None
+    ids = [r[0] for r in rows]
+    return ids if len(ids) <= MAX_CANDIDATES else None
+
+def find_users(conn, term, limit, prefix=False, columns=RISK_COLUMNS):
+    """
+    Top `limit` users (by risk score) whose username contains `term` (case-insensitive,
+    like LIKE and the trigram index), or with `prefix`, starts with it (case-sensitive,
+    like the username index).
+    """
+    if prefix:
+        match, params = "substr(username, 1, ?) = ?", (len(term), term)
+    else:
+        match, params = "username LIKE ? ESCAPE '\\'", (like_pattern(term),)
+    order = "ORDER BY risk_score DESC, total_likes DESC"
+
+    # The first WALK_ROWS of the ranking, in rank order: if `limit` of them match, they are the top-N
+    rows = conn.execute(f"""
+        SELECT {columns} FROM (SELECT * FROM user_risk {order} LIMIT ?)
+        WHERE {match} {order} LIMIT ?
+    """, (WALK_ROWS, *params, limit)).fetchall()
+    if len(rows) == limit:
+        return rows
+
+    ids = candidates(conn, term, prefix)
+    if ids is not None:
+        # Selective term: rank just the matches
+        return conn.execute(f"""
+            SELECT {columns} FROM user_risk
+            WHERE user_id IN (SELECT value FROM json_each(?)) AND {match}
+            {order} LIMIT ?
+        """, (json.dumps(ids), *params, limit)).fetchall()
+    # Too many matches to rank individually: walk the whole ranking
+    return conn.execute(f"""
+        SELECT {columns} FROM user_risk WHERE {match} {order} LIMIT ?
+    """, (*params, limit)).fetchall()
+
+if __name__ == "__main__":
+    import argparse
+    import sqlite3
+    import time
+    import schema
+    parser = argparse.ArgumentParser(description="Search usernames the way the API does and time it.")
+    parser.add_argument("term")
+    parser.add_argument("--db", default=schema.DB_NAME)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--prefix", action="store_true")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    t0 = time.perf_counter()
+    rows = find_users(conn, args.term, args.limit, args.prefix, "username, risk_score, alert_reason")
+    elapsed = (time.perf_counter() - t0) * 1000
+    for row in rows:
+        print(row)
+    print(f"{len(rows)} users in {elapsed:.1f}ms")
@@ -0,0 +1,276 @@
+import json
+import sqlite3
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # optional: without it likes are not velocity-scored (velocity_score is null)
+    np = None
+
+import schema
+
+available = np is not None
+
+# Sliding windows (seconds) and the like counts within them that no human reaches
+WINDOWS = (60, 3600, 86400)
+LIMITS = (6, 60, 300)
+# Timestamps kept per user for inter-like interval statistics
+RING = 8
+# Intervals needed, and the mean interval / coefficient of variation below which
+# a user's timing counts as machine-regular
+MIN_INTERVALS = 4
+REGULAR_MEAN = 300
+REGULAR_CV = 0.25
+# Score at which a user's velocity is flagged
+ALERT_SCORE = 50
+
+# Memory for user state; users beyond what fits are evicted (least recently active first)
+MEMORY_MB = 64
+EVICT_FRACTION = 0.1
+
+# One slot per tracked user (68 bytes). count[w] = [current, previous] bucket of WINDOWS[w];
+# the current bucket is the one holding `last`. ring holds the last RING like timestamps.
+STATE = np.dtype([
+    ("user", "i8"),
+    ("last", "i8"),
+    ("head", "u4"),
+    ("count", "u4", (len(WINDOWS), 2)),
+    ("ring", "u4", (RING,)),
+]) if available else None
+
+class Tracker:
+    """
+    Per-user sliding-window like counters in a fixed-size NumPy array.
+    Each window keeps two buckets (current and previous) and estimates the count over
+    the last W seconds as current + previous * (unelapsed share of the current bucket).
+    Users are found through a sorted id array (12 bytes per user, no Python objects).
+    When the array is full the least recently active users are written to the
+    user_velocity table and read back if they like again.
+    """
+
+    def __init__(self, memory_mb=MEMORY_MB):
+        self.capacity = int(memory_mb * 2**20 // STATE.itemsize)
+        self.state = np.zeros(self.capacity, STATE)
+        self.ids = np.empty(0, np.int64)   # sorted user ids in memory
+        self.slots = np.empty(0, np.int32)  # their slots
+        self.free = np.arange(self.capacity, dtype=np.int32)[::-1].copy()
+        self.n_free = self.capacity
+        self.evicted = 0
+        self.like_max = 0  # likes.id the tracker has seen up to (for sync)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    # --- Slot Index ---
+
+    def _find(self, users):
+        """Slots of sorted unique user ids (-1 where not in memory)."""
+        pos = np.searchsorted(self.ids, users)
+        found = pos < len(self.ids)
+        found[found] = self.ids[pos[found]] == users[found]
+        return np.where(found, self.slots[np.minimum(pos, len(self.slots) - 1)] if len(self.slots) else -1, -1)
+
+    def _admit(self, users, conn, keep):
+        """Give new users slots, evicting idle users first if needed, and restore any spilled state."""
+        if len(users) > self.capacity - len(keep):
+            raise ValueError(f"{len(users)} new users do not fit in {self.capacity} velocity slots")
+        if len(users) > self.n_free:
+            self._evict(max(len(users) - self.n_free, int(self.capacity * EVICT_FRACTION)), conn, keep)
+        slots = self.free[self.n_free - len(users):self.n_free].copy()
+        self.n_free -= len(users)
+        self.state[slots] = 0
+        self.state["user"][slots] = users
+        if conn is not None:
+            spilled = conn.execute("SELECT user_id, state FROM user_velocity WHERE user_id IN (SELECT value FROM json_each(?))",
+                                   (json.dumps(users.tolist()),)).fetchall()
+            if spilled:
+                for uid, blob in spilled:
+                    self.state[slots[np.searchsorted(users, uid)]] = np.frombuffer(blob, STATE)[0]
+                conn.execute("DELETE FROM user_velocity WHERE user_id IN (SELECT value FROM json_each(?))",
+                             (json.dumps([uid for uid, _ in spilled]),))
+        pos = np.searchsorted(self.ids, users)
+        self.ids = np.insert(self.ids, pos, users)
+        self.slots = np.insert(self.slots, pos, slots)
+        return slots
+
+    def _evict(self, n, conn, keep):
+        """Move the n least recently active users (other than slots in `keep`) to user_velocity."""
+        last = self.state["last"][self.slots]
+        last[np.isin(self.slots, keep)] = np.iinfo(np.int64).max
+        n = min(n, len(self.slots) - len(keep))
+        victims = np.argpartition(last, n - 1)[:n] if n < len(last) else np.arange(len(last))
+        slots = self.slots[victims]
+        if conn is not None:
+            conn.executemany("INSERT OR REPLACE INTO user_velocity (user_id, last, state) VALUES (?, ?, ?)",
+                             ((int(s["user"]), int(s["last"]), s.tobytes()) for s in self.state[slots]))
+        self.ids = np.delete(self.ids, victims)
+        self.slots = np.delete(self.slots, victims)
+        self.free[self.n_free:self.n_free + n] = slots
+        self.n_free += n
+        self.evicted += n
+
+    # --- Updates ---
+
+    def apply(self, likes, conn=None):
+        """
+        Record a batch of likes (user_id, video_id, timestamp). `conn` (in a write
+        transaction) receives evicted users and supplies spilled ones; without it
+        evicted state is dropped.
+        """
+        likes = np.asarray(likes, dtype=np.int64).reshape(-1, 3)
+        if not len(likes): return
+        with self._lock:
+            users, like_user = np.unique(likes[:, 0], return_inverse=True)
+            slots = self._find(users)
+            new = slots < 0
+            if new.any(): slots[new] = self._admit(users[new], conn, slots[~new])
+            # Each user's likes in time order; the k-th like of every user is recorded in round k
+            slot, ts = slots[like_user], likes[:, 2]
+            order = np.lexsort((ts, slot))
+            slot, ts = slot[order], ts[order]
+            starts = np.flatnonzero(np.r_[True, slot[1:] != slot[:-1]])
+            rank = np.arange(len(slot)) - np.repeat(starts, np.diff(np.r_[starts, len(slot)]))
+            for k in range(rank.max() + 1):
+                m = rank == k
+                self._record(slot[m], ts[m])
+
+    def sync(self, conn):
+        """
+        Record the likes committed since the last sync, by any process. For trackers
+        not fed by ingest (the workers of serve.py); these never spill, since the
+        user_velocity table would be shared between the workers.
+        """
+        with self._sync_lock:
+            likes = np.array(conn.execute("SELECT id, user_id, video_id, timestamp FROM likes WHERE id > ? ORDER BY id",
+                                          (self.like_max,)).fetchall(), dtype=np.int64).reshape(-1, 4)
+            if not len(likes): return 0
+            step = max(1, self.capacity // 2)  # distinct users per apply() must fit in the slots
+            for i in range(0, len(likes), step):
+                self.apply(likes[i:i + step, 1:])
+            self.like_max = int(likes[-1, 0])
+            return len(likes)
+
+    def _record(self, slots, ts):
+        """One like each for distinct slots."""
+        st = self.state
+        last = st["last"][slots]
+        count = st["count"][slots]
+        for w, width in enumerate(WINDOWS):
+            cur, prev = count[:, w, 0], count[:, w, 1]
+            held, bucket = last // width, ts // width
+            same, step, jump, late = bucket == held, bucket == held + 1, bucket > held + 1, bucket == held - 1
+            count[:, w, 1] = np.where(step, cur, np.where(jump, 0, prev + late))
+            count[:, w, 0] = np.where(same, cur + 1, np.where(step | jump, 1, cur))
+        st["count"][slots] = count
+        head = st["head"][slots]
+        st["ring"][slots, head % RING] = ts
+        st["head"][slots] = head + 1
+        st["last"][slots] = np.maximum(last, ts)
+
+    # --- Scoring ---
+
+    def features(self, user_ids, now=None, conn=None):
+        """
+        user_id -> {score, per_minute, per_hour, per_day, mean_interval, interval_cv}
+        for the given users (all zeros for users never seen). Spilled users are read
+        from user_velocity through `conn`.
+        """
+        now = int(now if now is not None else time.time())
+        users = np.unique(np.asarray(list(user_ids), dtype=np.int64))
+        with self._lock:
+            slots = self._find(users)
+            rows = np.zeros(len(users), STATE)
+            rows[slots >= 0] = self.state[slots[slots >= 0]]
+        known = slots >= 0
+        if conn is not None and not known.all():
+            for uid, blob in conn.execute("SELECT user_id, state FROM user_velocity WHERE user_id IN (SELECT value FROM json_each(?))",
+                                          (json.dumps(users[~known].tolist()),)):
+                i = np.searchsorted(users, uid)
+                rows[i], known[i] = np.frombuffer(blob, STATE)[0], True
+        result = {int(u): dict(IDLE) for u in users[~known]}
+        if known.any():
+            result.update((int(u), f) for u, f in zip(users[known], score(rows[known], now)))
+        return result
+
+IDLE = {"score": 0, "per_minute": 0, "per_hour": 0, "per_day": 0, "mean_interval": None, "interval_cv": None}
+
+def score(rows, now):
+    """Velocity features and score (0-100) for an array of STATE rows at time `now`."""
+    rates = []
+    for w, width in enumerate(WINDOWS):
+        cur, prev = rows["count"][:, w, 0].astype(float), rows["count"][:, w, 1].astype(float)
+        held, current = rows["last"] // width, now // width
+        unelapsed = 1 - (now % width) / width
+        rates.append(np.where(held == current, cur + prev * unelapsed, np.where(held == current - 1, cur * unelapsed, 0)))
+    # Rate part: how far past the human limit the busiest window is (70 points)
+    rate = np.max([r / limit for r, limit in zip(rates, LIMITS)], axis=0)
+    points = 70 * np.minimum(rate, 1)
+
+    # Regularity part: short, evenly spaced intervals between the last RING likes (30 points)
+    kept = np.minimum(rows["head"], RING).astype(np.int64)
+    ring = np.where(np.arange(RING) < kept[:, None], rows["ring"].astype(float), np.inf)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        gaps = np.diff(np.sort(ring, axis=1), axis=1)  # inf/nan past the kept timestamps
+        valid = np.isfinite(gaps)
+        n = valid.sum(axis=1)
+        mean = np.where(valid, gaps, 0).sum(axis=1) / n
+        cv = np.sqrt(np.where(valid, (gaps - mean[:, None]) ** 2, 0).sum(axis=1) / n) / mean
+    regular = (n >= MIN_INTERVALS) & (mean < REGULAR_MEAN) & (cv < REGULAR_CV)
+    points = points + 30 * regular
+
+    return [{
+        "score": int(round(p)),
+        "per_minute": int(round(m)), "per_hour": int(round(h)), "per_day": int(round(d)),
+        "mean_interval": None if k < 2 else int(round(g)),
+        "interval_cv": None if k < 2 or not np.isfinite(c) else round(float(c), 2),
+    } for p, m, h, d, k, g, c in zip(points.tolist(), *(r.tolist() for r in rates), kept.tolist(), mean.tolist(), cv.tolist())]
+
+def load(conn, memory_mb=MEMORY_MB, now=None, spill=True):
+    """
+    A Tracker replaying the last day of likes (the longest window), read per video
+    through idx_likes_video_ts. Clears user_velocity, whose spilled state it supersedes;
+    `conn` must be writable (users that do not fit are spilled to it). With
+    spill=False `conn` is only read and users that do not fit are dropped (see sync()).
+    """
+    now = int(now if now is not None else time.time())
+    t0 = time.time()
+    tracker = Tracker(memory_mb)
+    if spill: conn.execute("DELETE FROM user_velocity")
+    tracker.like_max = conn.execute("SELECT COALESCE(MAX(id), 0) FROM likes").fetchone()[0]
+    likes = np.array(conn.execute("""
+        SELECT l.user_id, l.video_id, l.timestamp FROM videos v
+        JOIN likes l ON l.video_id = v.id AND l.timestamp > ? AND l.timestamp <= ? AND l.id <= ?
+    """, (now - max(WINDOWS), now, tracker.like_max)).fetchall(), dtype=np.int64).reshape(-1, 3)
+    likes = likes[np.argsort(likes[:, 2], kind="stable")]
+    step = max(1, tracker.capacity // 2)  # distinct users per apply() must fit in the slots
+    for i in range(0, len(likes), step):
+        tracker.apply(likes[i:i + step], conn if spill else None)
+    tracker.load_seconds = time.time() - t0
+    return tracker
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay the last day of likes into a velocity tracker and show the fastest users.")
+    parser.add_argument("--db", default=schema.DB_NAME)
+    parser.add_argument("--memory-mb", type=float, default=MEMORY_MB)
+    parser.add_argument("--now", type=int, help="Reference time (epoch seconds); default: latest like")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    if not available:
+        raise SystemExit("numpy is not installed; velocity scoring is unavailable.")
+    conn = sqlite3.connect(args.db)
+    schema.migrate(conn)
+    now = args.now or conn.execute("SELECT MAX(timestamp) FROM likes").fetchone()[0]
+    tracker = load(conn, args.memory_mb, now)
+    print(f"Tracked {len(tracker)} users ({tracker.evicted} spilled) in {tracker.load_seconds:.2f}s, "
+          f"{tracker.capacity} slots / {tracker.state.nbytes / 2**20:.0f} MB")
+    users = tracker.state["user"][tracker.slots]
+    ranked = sorted(tracker.features(users, now, conn).items(), key=lambda kv: -kv[1]["score"])[:args.top]
+    for uid, f in ranked:
+        print(f"user {uid}: {f}")
+    conn.rollback()  # the replay's spill is only for this process
+    conn.close()
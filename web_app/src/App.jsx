@@ -131,14 +131,53 @@ function App() {
     if (!input.trim()) return
     const msg = input
     setInput('')
-    setMessages(prev => [...prev, { role: 'user', text: msg }])
+    setMessages(prev => [...prev, { role: 'user', text: msg }, { role: 'agent', text: '', tools: [] }])
     setAnalyzing(true)
 
+    // Patch the agent message being streamed (always the last one)
+    const updateReply = fn => setMessages(prev => [...prev.slice(0, -1), fn(prev[prev.length - 1])])
+
+    // Agent events arrive as Server-Sent Events (see agent.py): text, tool_start, tool_end, done, error
+    const handleEvent = ev => {
+      if (ev.type === 'text') {
+        updateReply(m => ({ ...m, text: m.text + ev.text }))
+      } else if (ev.type === 'tool_start') {
+        updateReply(m => ({ ...m, tools: [...m.tools, { id: ev.id, name: ev.name, status: 'running' }] }))
+      } else if (ev.type === 'tool_end') {
+        updateReply(m => ({
+          ...m, tools: m.tools.map(t => t.id === ev.id ? { ...t, status: ev.ok ? 'done' : 'failed', ms: ev.ms } : t)
+        }))
+      } else if (ev.type === 'done') {
+        updateReply(m => ({ ...m, text: m.text || ev.response }))
+      } else if (ev.type === 'error') {
+        updateReply(m => ({ ...m, text: m.text ? `${m.text}\n\n${ev.detail}` : ev.detail }))
+      }
+    }
+
     try {
-      const res = await axios.post(`${API_URL}/chat`, { message: msg })
-      setMessages(prev => [...prev, { role: 'agent', text: res.data.response }])
+      // EventSource only supports GET, so read the POST response body as a stream
+      const res = await fetch(`${API_URL}/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message: msg })
+      })
+      if (!res.ok) throw new Error(res.statusText)
+      const reader = res.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        const frames = buffer.split('\n\n')
+        buffer = frames.pop()
+        for (const frame of frames) {
+          const data = frame.split('\n').find(line => line.startsWith('data: '))
+          if (data) handleEvent(JSON.parse(data.slice(6)))
+        }
+      }
     } catch (err) {
-      setMessages(prev => [...prev, { role: 'agent', text: 'Connection Error.' }])
+      updateReply(m => ({ ...m, text: 'Connection Error.' }))
     } finally {
       setAnalyzing(false)
     }
@@ -345,10 +384,20 @@ function App() {
         <div className="chat-messages">
           {messages.map((m, i) => (
             <div key={i} className={`msg ${m.role}`}>
+              {m.tools?.length > 0 && (
+                <div style={{ fontSize: '0.75rem', color: '#94a3b8', marginBottom: m.text ? '0.5rem' : 0 }}>
+                  {m.tools.map(t => (
+                    <div key={t.id}>
+                      {t.status === 'running' ? '⏳' : t.status === 'done' ? '✓' : '✗'} {t.name}
+                      {t.ms !== undefined && ` (${t.ms} ms)`}
+                    </div>
+                  ))}
+                </div>
+              )}
               {m.text}
             </div>
           ))}
-          {analyzing && <div className="spinner">Analyst is typing...</div>}
+          {analyzing && !messages[messages.length - 1].text && <div className="spinner">Analyst is typing...</div>}
           <div ref={messagesEndRef} />
         </div>
         <div style={{ display: 'flex', gap: '0.5rem' }}>
@@ -1,19 +1,105 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import sqlite3
+import json
 import os
+import sqlite3
+from contextlib import asynccontextmanager
 import datetime
 from datetime import timedelta
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 
+import agent
+import analytics
+import archive
+import clusters
+import db
+import export
+import ingest
+import metrics
+import pagination
+import partitions
+import profiles
+import responses
+import risk
+import rollups
+import scheduler
+import schema
+import spikes
+import snapshot
+import sql_guard
+import tool_cache
+import user_search
+import velocity
+from schema import to_iso
+
 # Load environment
 load_dotenv()
 API_KEY = os.getenv("GOOGLE_API_KEY")
+# ANALYTICS_ENGINE=1 serves the per-like risk endpoints from the in-memory NumPy engine (analytics.py)
+USE_ANALYTICS = os.getenv("ANALYTICS_ENGINE") == "1"
+VELOCITY_MEMORY_MB = float(os.getenv("VELOCITY_MEMORY_MB", velocity.MEMORY_MB))
+# DETECTION_SCHEDULER=0 disables the background detection jobs (see scheduler.py)
+RUN_SCHEDULER = os.getenv("DETECTION_SCHEDULER", "1") == "1"
+# Set by serve.py: number of worker processes sharing the database, and the directory
+# of the analytics snapshot they map instead of each loading the engine (see snapshot.py)
+WORKERS = int(os.getenv("SERVE_WORKERS", "1"))
+SNAPSHOT_DIR = os.getenv("ANALYTICS_SNAPSHOT")
+
+# DB_PATH selects another database file (serve.py hands --db to its workers this way)
+DB_NAME = schema.DB_NAME = os.getenv("DB_PATH", schema.DB_NAME)
 
-app = FastAPI(title="Social Media Fraud Detection API")
+@asynccontextmanager
+async def lifespan(app):
+    # One pool per process: read-only connections for handlers and tools, one shared writer
+    app.state.db = db.Pool(DB_NAME)
+    # Agent tool results, invalidated whenever anything commits (e.g. an ingest batch)
+    app.state.tool_cache = tool_cache.ToolCache(app.state.db.data_version)
+    # Per-user like velocity, replayed from the last day of likes and fed by ingest (see velocity.py).
+    # With several workers each one follows the likes table instead, as ingest lands in any of them.
+    app.state.velocity = None
+    if not velocity.available:
+        print("numpy is not installed; likes are not velocity-scored.")
+    elif WORKERS > 1:
+        with app.state.db.reader() as conn:
+            app.state.velocity = velocity.load(conn, VELOCITY_MEMORY_MB, spill=False)
+    else:
+        with app.state.db.writer.transaction() as conn:
+            app.state.velocity = velocity.load(conn, VELOCITY_MEMORY_MB)
+    if app.state.velocity is not None:
+        print(f"Velocity tracker loaded {len(app.state.velocity)} active users in {app.state.velocity.load_seconds:.1f}s")
+    # Rendered /api/users/{username} responses, revalidated per request by ETag (see profiles.py)
+    app.state.profile_cache = profiles.ProfileCache(tracker=app.state.velocity)
+    app.state.ingest_writer = None
+    # Alert ranking and other detection jobs, recomputed periodically and after each ingest batch
+    app.state.scheduler = scheduler.Scheduler(app.state.db.writer, DB_NAME) if RUN_SCHEDULER else None
+    # One model client reused by every chat request
+    app.state.model_client = genai.Client(api_key=API_KEY) if API_KEY else None
+    # Raw likes of compacted months, read from Parquet (see archive.py)
+    app.state.archive = archive.Archive() if archive.available else None
+    app.state.analytics = None
+    if USE_ANALYTICS:
+        if analytics.available and SNAPSHOT_DIR:
+            with app.state.db.reader() as conn:
+                app.state.analytics = snapshot.Shared(SNAPSHOT_DIR).load(conn)
+            print(f"Analytics snapshot {app.state.analytics.snap.name} mapped, {len(app.state.analytics)} likes")
+        elif analytics.available:
+            app.state.analytics = analytics.load(DB_NAME)
+            print(f"Analytics engine loaded {len(app.state.analytics)} likes in {app.state.analytics.load_seconds:.1f}s")
+        else:
+            print("ANALYTICS_ENGINE is set but numpy is not installed; serving from SQLite.")
+    yield
+    if app.state.ingest_writer is not None:
+        app.state.ingest_writer.close()
+    if app.state.scheduler is not None:
+        app.state.scheduler.close()
+    app.state.db.close()
+
+app = FastAPI(title="Social Media Fraud Detection API", lifespan=lifespan)
 
 # Enable CORS for React frontend (localhost:5173)
 app.add_middleware(
@@ -22,229 +108,483 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Readable by the dashboard: the keyset cursor and profile ETags
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+# brotli/gzip for large bodies, per Accept-Encoding (see responses.py)
+app.add_middleware(responses.Compression)
+# Latency histograms per route, and ?profile=1 on GET endpoints (PROFILE_ENABLED=1)
+app.add_middleware(metrics.Middleware)
+
+def get_pool(request: Request) -> db.Pool:
+    """Dependency: the process-wide connection pool opened by lifespan."""
+    return request.app.state.db
+
+def sync_velocity(state, pool):
+    """With several workers, catch the velocity tracker up with likes ingested by the others."""
+    if WORKERS > 1 and state.velocity is not None:
+        with pool.reader() as conn:
+            state.velocity.sync(conn)
+
+def get_profile_cache(request: Request, pool: db.Pool = Depends(get_pool)) -> profiles.ProfileCache:
+    sync_velocity(request.app.state, pool)
+    return request.app.state.profile_cache
+
+def get_velocity(request: Request, pool: db.Pool = Depends(get_pool)) -> velocity.Tracker:
+    """Dependency: the like velocity tracker (None without numpy)."""
+    sync_velocity(request.app.state, pool)
+    return request.app.state.velocity
+
+def get_archive(request: Request) -> archive.Archive:
+    return request.app.state.archive
+
+def get_analytics(request: Request, pool: db.Pool = Depends(get_pool)):
+    """Dependency: the analytics engine caught up with the database, or None when disabled."""
+    engine = request.app.state.analytics
+    if engine is not None:
+        with pool.reader() as conn:
+            engine.refresh(conn)
+    return engine
+
+@app.exception_handler(TimeoutError)
+def pool_exhausted(request: Request, exc: TimeoutError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+def parse_hour(hour):
+    """Parse 'YYYY-MM-DD HH' (UTC) into the epoch second the hour starts at. Raises ValueError."""
+    target_dt = datetime.datetime.strptime(hour, "%Y-%m-%d %H").replace(tzinfo=datetime.timezone.utc)
+    return int(target_dt.timestamp())
+
+def parse_layout(format):
+    """?format= of the row endpoints: 'objects' (default) or 'columnar' (see responses.rows)."""
+    if format not in responses.LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use one of {list(responses.LAYOUTS)}")
+    return format
+
+def parse_time(value):
+    """Parse an optional query param given as epoch seconds or an ISO-8601 date/datetime (UTC)."""
+    if value is None or value == "": return None
+    if value.lstrip("-").isdigit(): return int(value)
+    return schema.to_epoch(value)
+
+def hour_label(hour_index):
+    """Format an hour index (epoch // 3600) as 'YYYY-MM-DD HH:00'."""
+    return datetime.datetime.fromtimestamp(hour_index * 3600, datetime.timezone.utc).strftime("%Y-%m-%d %H:00")
 
-DB_NAME = "social_media_logs.db"
+def fresh_count(conn, video_id, start, end, cold=None):
+    """
+    Likes on a video in [start, end) from accounts under 48 hours old, read from likes and
+    any partitions the range overlaps (and compacted months from the Parquet archive `cold`).
+    """
+    n = conn.execute(f"""
+        SELECT COALESCE(SUM(l.timestamp - u.created_at < 48 * 3600), 0)
+        FROM {partitions.likes_sql(conn, start, end)} l JOIN users u ON l.user_id = u.id
+        WHERE l.video_id = ? AND l.timestamp >= ? AND l.timestamp < ?
+    """, (video_id, start, end)).fetchone()[0]
+    until = partitions.compacted_until(conn)
+    if cold is not None and until is not None and start < until:
+        n += sum(ts - created < 48 * 3600 for _, ts, created, _, _ in cold.likes(video_id, start, min(end, until)))
+    return n
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+def cold_activity(conn, cold, video_id, start, end):
+    """
+    Likes on a video in [start, end) from compacted months, read from the Parquet archive
+    `cold` (none without one), as {username, is_bot, created_at, timestamp} dicts plus
+    the _ts/_uid/_id keyset columns, in keyset order.
+    """
+    until = partitions.compacted_until(conn)
+    if cold is None or until is None or start >= until: return []
+    rows = cold.likes(video_id, start, min(end, until))
+    names = dict(conn.execute("SELECT id, username FROM users WHERE id IN (SELECT value FROM json_each(?))",
+                              (json.dumps(sorted({r[0] for r in rows})),)).fetchall()) if rows else {}
+    return sorted(({"username": names.get(uid), "is_bot": int(bot), "created_at": created, "timestamp": ts,
+                    "_ts": ts, "_uid": uid, "_id": like_id} for uid, ts, created, bot, like_id in rows),
+                  key=lambda r: (r["_ts"], r["_uid"], r["_id"]))
 
 # --- User Risk Analysis Endpoint ---
 
 @app.get("/api/users/risk")
-def get_user_risk(limit: int = 20, search: str = None): # Default limit 20
+def get_user_risk(limit: int = 20, search: str = None, pool: db.Pool = Depends(get_pool),
+                  cursor: str = None, format: str = "objects",
+                  tracker: velocity.Tracker = Depends(get_velocity)): # Default limit 20
     """
-    Calculate and return users sorted by Risk Score.
-    Includes 'alert_reason'.
+    Return users sorted by their materialized Risk Score.
+    Includes 'alert_reason' and the live 'velocity_score' (see velocity.py).
+    Pages: pass the X-Next-Cursor header of a response as `cursor` for the next page
+    (not combined with search). format=columnar returns {"columns", "rows"}.
     """
-    conn = get_db_connection()
-    try:
-        params = []
-        where_clause = ""
-        if search:
-            where_clause = "WHERE u.username LIKE ?"
-            params.append(f"%{search}%")
-            
-        # Critical attack pattern (Yesterday 14:00)
-        yesterday = (datetime.datetime.now(datetime.timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
-        attack_pattern = f"{yesterday}%14:%"
-        
-        # SQL Logic:
-        # High Risk = Fresh Bot OR (Sleeper Bot AND Active in Spike)
-        # Alert Reason = Text description
-        query = f"""
-            WITH UserStats AS (
-                SELECT 
-                    u.id, u.username, u.created_at, u.is_bot,
-                    EXISTS (
-                        SELECT 1 FROM likes l WHERE l.user_id = u.id 
-                        AND l.video_id = 20 AND l.timestamp LIKE ?
-                    ) as in_attack,
-                    (SELECT COUNT(*) FROM likes WHERE user_id = u.id) as total_likes
-                FROM users u
-                {where_clause}
-            )
-            SELECT *,
-                CASE 
-                    WHEN (julianday('now') - julianday(created_at)) * 24 < 48 THEN 50
-                    WHEN (julianday('now') - julianday(created_at)) > 90 AND in_attack THEN 40
-                    ELSE 0 
-                END + (CASE WHEN in_attack THEN 50 ELSE 0 END) as risk_score,
-                
-                CASE
-                    WHEN (julianday('now') - julianday(created_at)) * 24 < 48 THEN 'New Account Velocity'
-                    WHEN in_attack AND (julianday('now') - julianday(created_at)) > 90 THEN 'Sleeper Activation'
-                    WHEN in_attack THEN 'Spike Participation'
-                    ELSE 'Normal'
-                END as alert_reason
-                
-            FROM UserStats
-            ORDER BY risk_score DESC, total_likes DESC
-            LIMIT ?
-        """
-        params.insert(0, attack_pattern) # Prepend attack_pattern
-        params.append(limit)
+    if cursor and search:
+        raise HTTPException(status_code=400, detail="cursor cannot be combined with search")
+    layout = parse_layout(format)
+    headers = {}
+    with pool.reader() as conn:
+        # Scores are materialized in user_risk (see risk.py); only users whose
+        # account age bucket went stale since the last call are re-scored here,
+        # and the writer is only taken when there is something to re-score.
+        if risk.ages_stale(conn):
+            with pool.writer.transaction() as w:
+                risk.refresh_ages(w)
         
-        rows = conn.execute(query, params).fetchall()
+        if search:
+            # Substring match through the trigram index (see user_search.py)
+            rows = user_search.find_users(conn, search, limit)
+        else:
+            # Walks idx_user_risk_score from the cursor and stops after `limit` rows
+            try:
+                rows, next_cursor = pagination.risk_page(conn, user_search.RISK_COLUMNS, limit, cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if next_cursor: headers["X-Next-Cursor"] = next_cursor
+        speed = tracker.features([r["id"] for r in rows], conn=conn) if tracker is not None else {}
+        columns = user_search.RISK_FIELDS
+        data = [tuple(to_iso(r[c]) if c == "created_at" else r[c] for c in columns)
+                + (speed[r["id"]]["score"] if tracker is not None else None,) for r in rows]
+        return responses.rows(columns + ["velocity_score"], data, layout, headers)
+
+@app.get("/api/users/search")
+def search_users_api(q: str, limit: int = 20, prefix: bool = True, pool: db.Pool = Depends(get_pool)):
+    """Users whose username starts with (or, with prefix=false, contains) q, highest risk first."""
+    with pool.reader() as conn:
+        rows = user_search.find_users(conn, q, limit, prefix)
+        return [dict(r, created_at=to_iso(r["created_at"])) for r in rows]
+
+@app.get("/api/users/typeahead")
+def typeahead_api(q: str, limit: int = 8, pool: db.Pool = Depends(get_pool)):
+    """Username completions for a search box: prefix matches, highest risk first, minimal payload."""
+    with pool.reader() as conn:
+        rows = user_search.find_users(conn, q, limit, prefix=True, columns="username, risk_score, alert_reason")
         return [dict(r) for r in rows]
-    finally:
-        conn.close()
 
 @app.get("/api/users/{username}")
-def get_user_details_api(username: str):
-    """Fetch details for a specific user (Account age, activity)."""
-    conn = get_db_connection()
-    try:
-        user = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
-        if not user: raise HTTPException(status_code=404, detail="User not found")
-        
-        stats = conn.execute("SELECT COUNT(*) as count, MAX(timestamp) as last_active FROM likes WHERE user_id = ?", (user['id'],)).fetchone()
-        recent = conn.execute("""
-            SELECT v.title, l.timestamp 
-            FROM likes l JOIN videos v ON l.video_id = v.id 
-            WHERE l.user_id = ? ORDER BY l.timestamp DESC LIMIT 5
-        """, (user['id'],)).fetchall()
-        
-        # --- Mock Profile Generation (Deterministic) ---
-        import hashlib
-        h = int(hashlib.md5(username.encode()).hexdigest(), 16)
-        
-        locations = ["New York, USA", "London, UK", "Toronto, Canada", "Berlin, Germany", "Sydney, Australia", "Unknown Proxy", "Data Center (AWS-East)"]
-        bios = [
-            "Just here for the vibes.", "Crypto enthusiast 🚀", "Travel | Food | Tech", 
-            "Digital Nomad.", "Official Account.", "DM for collab.", "Automation script (DEBUG)", "..."
-        ]
-        
-        profile = {
-            "followers": (h % 5000) + 12,
-            "following": (h % 500) + 50,
-            "posts": (h % 100),
-            "location": locations[h % len(locations)],
-            "bio": bios[h % len(bios)],
-            "avatar": f"https://api.dicebear.com/7.x/identicon/svg?seed={username}"
-        }
-        
-        # --- Risk Narrative Generation ---
-        created = datetime.datetime.fromisoformat(user['created_at'])
-        if created.tzinfo: created = created.replace(tzinfo=None) # Make naive
-        now = datetime.datetime.utcnow() # Naive UTC
-        age_hours = (now - created).total_seconds() / 3600
-        total_likes = stats['count']
-        
-        narrative = []
-        if age_hours < 48:
-             narrative.append(f"Account is extremely fresh (created {int(age_hours)} hours ago). High velocity activity immediately after creation suggests automated scripting.")
-        
-        if total_likes > 50: # Arbitrary high threshold for POC
-             narrative.append(f"Abnormally high engagement volume ({total_likes} likes) detected, exceeding human click-rate benchmarks.")
-             
-        if user['is_bot']:
-             narrative.append(f"Pattern matches known botnet signature 'Spike-Walker-V2'. User was dormant until activation event.")
-        
-        if not narrative:
-             narrative.append("User exhibits generally organic behavior, though minor anomalies in timing were flagged.")
-             
-        risk_narrative = " ".join(narrative)
-        
-        return {
-            "id": user['id'],
-            "username": user['username'],
-            "created_at": user['created_at'],
-            "is_bot": user['is_bot'],
-            "total_likes": stats['count'],
-            "last_active": stats['last_active'],
-            "recent_activity": [dict(r) for r in recent],
-            "profile": profile,
-            "risk_narrative": risk_narrative
-        }
-    finally:
-        conn.close()
+def get_user_details_api(username: str, pool: db.Pool = Depends(get_pool),
+                         profile_cache: profiles.ProfileCache = Depends(get_profile_cache),
+                         request: Request = None, response: Response = None):
+    """
+    Fetch details for a specific user (Account age, activity).
+    Built from user_summary (never reads likes) and served from the profile cache.
+    Responses carry an ETag; a request whose If-None-Match matches it gets 304.
+    """
+    with pool.reader() as conn:
+        entry = profile_cache.get(conn, username)
+    if entry is None: raise HTTPException(status_code=404, detail="User not found")
+    tag, profile = entry
+    if request is not None and tag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": tag, "Cache-Control": "no-cache"})
+    if response is not None:
+        response.headers["ETag"] = tag
+        response.headers["Cache-Control"] = "no-cache"  # always revalidate: clicks cost a 304, never stale data
+    return profile
+
+class UserBatchRequest(BaseModel):
+    ids: list[int] = []
+    usernames: list[str] = []
+    fields: list[str] = None  # default: profiles.BATCH_DEFAULT
+
+@app.post("/api/users/batch")
+def get_users_batch(request: UserBatchRequest, pool: db.Pool = Depends(get_pool),
+                    tracker: velocity.Tracker = Depends(get_velocity)):
+    """
+    Profiles and risk scores of up to profiles.MAX_BATCH users (by id and/or username)
+    in a few set-based queries. `fields` picks from profiles.BATCH_FIELDS; the rendered
+    ones (recent_activity, profile, risk_narrative, cluster, velocity) cost more per user.
+    """
+    if len(request.ids) + len(request.usernames) > profiles.MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {profiles.MAX_BATCH} users per request")
+    unknown = [f for f in request.fields or [] if f not in profiles.BATCH_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown}. Use any of {profiles.BATCH_FIELDS}")
+    with pool.reader() as conn:
+        rows, missing = profiles.batch(conn, request.ids, request.usernames, request.fields, tracker)
+    return {"users": rows, "missing": missing}
 
 # --- Data Endpoints ---
 
 @app.get("/api/videos")
-def list_videos():
+def list_videos(pool: db.Pool = Depends(get_pool)):
     """Get list of all videos for the dropdown."""
-    conn = get_db_connection()
-    try:
+    with pool.reader() as conn:
         videos = conn.execute("SELECT * FROM videos ORDER BY id ASC").fetchall()
-        return [dict(v) for v in videos]
-    finally:
-        conn.close()
+        return [dict(v, upload_date=to_iso(v["upload_date"])) for v in videos]
 
 @app.get("/api/likes/{video_id}")
-def get_video_likes_series(video_id: int):
+def get_video_likes_series(video_id: int, start: str = None, end: str = None, resolution: str = "hour", max_points: int = 2000,
+                           pool: db.Pool = Depends(get_pool), cold: archive.Archive = Depends(get_archive)):
     """
-    Get hourly like counts for a video to plot on a chart.
-    Returns: { "labels": [...dates], "data": [...counts] }
+    Get like counts for a video to plot on a chart, read from the rollup tables.
+    start/end: epoch seconds or ISO dates (UTC), resolution: 'minute' | 'hour' | 'day'.
+    Series longer than max_points are downsampled with LTTB. Minute buckets of compacted
+    months (whose minute rollups are dropped) are computed from the Parquet archive.
+    Returns: { "labels": [...dates], "data": [...counts], "fresh": [...], "sleeper": [...] }
     """
-    conn = get_db_connection()
+    if resolution not in rollups.RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid resolution. Use one of {list(rollups.RESOLUTIONS)}")
+    if max_points < 1:
+        raise HTTPException(status_code=400, detail="max_points must be at least 1")
     try:
-        # Get video range to limit query efficiency
-        # For this POC, we just aggregate all likes for the video by hour
-        query = """
-            SELECT strftime('%Y-%m-%d %H:00', timestamp) as hour_bucket, COUNT(*) as count
-            FROM likes
-            WHERE video_id = ?
-            GROUP BY hour_bucket
-            ORDER BY hour_bucket ASC
-        """
-        rows = conn.execute(query, (video_id,)).fetchall()
+        start_ts = parse_time(start)
+        end_ts = parse_time(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid start/end. Use epoch seconds or ISO-8601")
+    
+    with pool.reader() as conn:
+        rows = rollups.series(conn, video_id, resolution, start_ts, end_ts)
+        until = partitions.compacted_until(conn)
+        if resolution == "minute" and cold is not None and until is not None and (start_ts or 0) < until:
+            cut = min(until, end_ts if end_ts is not None else until)
+            rows = cold.series(video_id, 60, start_ts or 0, cut) + [r for r in rows if r[0] >= cut]
         
-        # Format for Chart.js
-        labels = [row["hour_bucket"] for row in rows]
-        data = [row["count"] for row in rows]
+        keep = rollups.lttb([r[0] for r in rows], [r[1] for r in rows], max_points)
+        rows = [rows[i] for i in keep]
         
-        return {"labels": labels, "data": data}
-    finally:
-        conn.close()
+        # Format for Chart.js
+        return responses.JSON({
+            "labels": [rollups.label(r[0], resolution) for r in rows],
+            "data": [r[1] for r in rows],
+            "fresh": [r[2] for r in rows],
+            "sleeper": [r[3] for r in rows],
+            "resolution": resolution,
+        })
 
 @app.get("/api/activity")
-def get_video_activity(video_id: int, hour: str):
+def get_video_activity(video_id: int, hour: str, pool: db.Pool = Depends(get_pool),
+                       engine: analytics.Engine = Depends(get_analytics),
+                       limit: int = None, cursor: str = None, format: str = "objects",
+                       cold: archive.Archive = Depends(get_archive)):
     """
     Get all users who liked a video during a specific hour.
     Query param hour format: 'YYYY-MM-DD HH'
+    With `limit`, returns one page; pass the X-Next-Cursor header back as `cursor` for the next.
+    Hours in compacted months are read from the Parquet archive.
+    format=columnar returns {"columns", "rows"} (ACTIVITY_COLUMNS) instead of one object per like.
     """
-    conn = get_db_connection()
-    try:
+    layout = parse_layout(format)
+    with pool.reader() as conn:
         try:
-            target_dt = datetime.datetime.strptime(hour, "%Y-%m-%d %H")
+            s = parse_hour(hour)
         except ValueError:
              raise HTTPException(status_code=400, detail="Invalid hour format. Use 'YYYY-MM-DD HH'")
              
-        s = target_dt.strftime("%Y-%m-%d %H:00:00")
-        e = (target_dt + timedelta(hours=1)).strftime("%Y-%m-%d %H:00:00")
+        e = s + 3600
+        likes = partitions.likes_sql(conn, s, e)
+        archived = cold_activity(conn, cold, video_id, s, e)
+        
+        if limit is not None or cursor is not None:
+            # Keyset page: a seek into idx_likes_video_ts past the cursor
+            try:
+                after, params = pagination.likes_after(cursor)
+            except ValueError as err:
+                raise HTTPException(status_code=400, detail=str(err))
+            limit = limit or 1000
+            rows = conn.execute(f"""
+                SELECT u.username, u.is_bot, u.created_at, l.timestamp,
+                       l.timestamp as _ts, l.user_id as _uid, l.id as _id
+                FROM {likes} l JOIN users u ON l.user_id = u.id
+                WHERE l.video_id = ? AND l.timestamp >= ? AND l.timestamp < ? AND {after}
+                ORDER BY l.timestamp, l.user_id, l.id
+                LIMIT ?
+            """, (video_id, s, e, *params, limit)).fetchall()
+            if archived:
+                key = lambda r: (r["_ts"], r["_uid"], r["_id"])
+                rows = sorted([r for r in archived if key(r) > tuple(params)] + rows, key=key)[:limit]
+            next_cursor = pagination.likes_cursor(rows, limit)
+            return responses.rows(ACTIVITY_COLUMNS, activity_rows(rows), layout,
+                                  {"X-Next-Cursor": next_cursor} if next_cursor else None)
+        
+        # The engine holds the hot likes table only
+        if engine is not None and likes == "likes" and not archived:
+            w = engine.window(video_id, s, e)
+            return responses.rows(ACTIVITY_COLUMNS, list(zip(
+                w.username.tolist(), w.is_bot.astype(int).tolist(), responses.iso_times(w.created_at),
+                responses.iso_times(w.timestamp), analytics.risk_labels(w))), layout)
         
         # Join with users to get details
-        query = """
+        query = f"""
             SELECT u.username, u.is_bot, u.created_at, l.timestamp 
-            FROM likes l 
+            FROM {likes} l 
             JOIN users u ON l.user_id = u.id 
             WHERE l.video_id = ? AND l.timestamp >= ? AND l.timestamp < ?
             ORDER BY l.timestamp ASC
         """
         rows = conn.execute(query, (video_id, s, e)).fetchall()
+        if archived: rows = sorted(archived + rows, key=lambda r: r["timestamp"])
         
         # Calculate flags dynamically
-        results = []
-        for r in rows:
-            mapped = dict(r)
-            created = datetime.datetime.fromisoformat(str(r["created_at"]))
-            liked = datetime.datetime.fromisoformat(str(r["timestamp"]))
-            age = liked - created
-            
-            # Risk Flags
-            mapped['risk_label'] = 'Normal'
-            if age < timedelta(hours=48): mapped['risk_label'] = 'Fresh Account'
-            elif mapped['is_bot'] and age > timedelta(days=90): mapped['risk_label'] = 'Sleeper Pattern'
-            
-            results.append(mapped)
-            
-        return results
-    finally:
-        conn.close()
+        return responses.rows(ACTIVITY_COLUMNS, activity_rows(rows), layout)
+
+ACTIVITY_COLUMNS = ("username", "is_bot", "created_at", "timestamp", "risk_label")
+
+def risk_label(is_bot, age):
+    """Risk flag of a like by an account `age` seconds old."""
+    if age < 48 * 3600: return 'Fresh Account'
+    if is_bot and age > 90 * 86400: return 'Sleeper Pattern'
+    return 'Normal'
+
+def activity_row(r):
+    """An activity like (username, is_bot, created_at, timestamp) as returned by the API, with its risk flag."""
+    mapped = dict(r, created_at=to_iso(r["created_at"]), timestamp=to_iso(r["timestamp"]))
+    mapped['risk_label'] = risk_label(mapped['is_bot'], r["timestamp"] - r["created_at"])
+    return mapped
+
+def activity_rows(rows):
+    """activity_row of many likes as ACTIVITY_COLUMNS tuples, the timestamps converted in one pass."""
+    if not rows: return []
+    names, bots, created, ts = zip(*((r["username"], r["is_bot"], r["created_at"], r["timestamp"]) for r in rows))
+    labels = [risk_label(b, t - c) for b, c, t in zip(bots, created, ts)]
+    return list(zip(names, bots, responses.iso_times(created), responses.iso_times(ts), labels))
+
+# --- Cluster Endpoints ---
+
+@app.get("/api/clusters")
+def list_clusters(min_size: int = clusters.MIN_CLUSTER_SIZE, limit: int = 20, pool: db.Pool = Depends(get_pool)):
+    """
+    Groups of users that repeatedly liked the same videos within the same minute
+    (see clusters.py), largest first, with member stats and their riskiest usernames.
+    """
+    with pool.reader() as conn:
+        return clusters.top(conn, min_size, limit)
+
+@app.get("/api/clusters/{cluster_id}")
+def get_cluster_members(cluster_id: int, limit: int = 100, pool: db.Pool = Depends(get_pool)):
+    """Members of one cluster, highest risk first."""
+    with pool.reader() as conn:
+        rows = clusters.members(conn, cluster_id, user_search.RISK_COLUMNS, limit)
+        if not rows: raise HTTPException(status_code=404, detail="Cluster not found")
+        return [dict(r, created_at=to_iso(r["created_at"])) for r in rows]
+
+@app.get("/api/alerts")
+def list_alerts(limit: int = 20, pool: db.Pool = Depends(get_pool)):
+    """
+    Hourly spikes ranked by fresh-account likes, then z-score, as precomputed by the
+    background spike_alerts job (see scheduler.py).
+    """
+    with pool.reader() as conn:
+        rows = scheduler.ranked(conn, limit)
+    if rows is None:
+        raise HTTPException(status_code=503, detail="Alerts have not been computed yet")
+    return [dict(r, start=to_iso(r["start"]), end=to_iso(r["end"]), updated_at=to_iso(r["updated_at"])) for r in rows]
+
+@app.get("/api/alerts/jobs")
+def list_detection_jobs(request: Request, pool: db.Pool = Depends(get_pool)):
+    """Background detection jobs: interval, runs, errors and timing (this process), watermark (database)."""
+    with pool.reader() as conn:
+        stored = {r["job"]: dict(r, last_run=to_iso(r["last_run"])) for r in conn.execute("SELECT * FROM detection_jobs")}
+    running = request.app.state.scheduler.report() if request.app.state.scheduler is not None else {}
+    return {name: {"scheduler": running.get(name), "stored": stored.get(name)} for name in scheduler.JOBS}
+
+# --- Export Endpoints ---
+
+def export_format(format):
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use one of {list(export.FORMATS)}")
+    return format
+
+@app.get("/api/export/users/risk")
+def export_user_risk(format: str = "ndjson", min_score: int = 0, alert_reason: str = None,
+                     pool: db.Pool = Depends(get_pool)):
+    """
+    Stream every user with risk_score >= min_score (optionally one alert_reason), highest risk
+    first, as NDJSON or CSV. Rows are read from a server-side cursor, never buffered.
+    """
+    fmt = export_format(format)
+    where, params = "risk_score >= ?", [min_score]
+    if alert_reason:
+        where += " AND alert_reason = ?"
+        params.append(alert_reason)
+    sql = f"SELECT {user_search.RISK_COLUMNS} FROM user_risk WHERE {where} {pagination.RISK_ORDER}"
+    rows = export.stream(pool.db_name, sql, params, fmt, lambda r: dict(r, created_at=to_iso(r["created_at"])))
+    return StreamingResponse(rows, media_type=export.FORMATS[fmt], headers=export.filename("user_risk", fmt))
+
+@app.get("/api/export/activity")
+def export_activity(video_id: int, hour: str = None, start: str = None, end: str = None, format: str = "ndjson",
+                    pool: db.Pool = Depends(get_pool), cold: archive.Archive = Depends(get_archive)):
+    """
+    Stream every like on a video in one hour ('YYYY-MM-DD HH') or between start and end
+    (epoch seconds or ISO), with the liker's account details and risk flag, as NDJSON or CSV.
+    Likes of compacted months come first, from the Parquet archive.
+    """
+    fmt = export_format(format)
+    try:
+        if hour:
+            s = parse_hour(hour)
+            e = s + 3600
+        else:
+            s, e = parse_time(start), parse_time(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid hour/start/end")
+    if s is None or e is None:
+        raise HTTPException(status_code=400, detail="Pass hour, or both start and end")
+    with pool.reader() as conn:
+        likes = partitions.likes_sql(conn, s, e)
+        archived = [pagination.strip(r) for r in cold_activity(conn, cold, video_id, s, e)]
+    sql = f"""
+        SELECT u.username, u.is_bot, u.created_at, l.timestamp
+        FROM {likes} l JOIN users u ON l.user_id = u.id
+        WHERE l.video_id = ? AND l.timestamp >= ? AND l.timestamp < ?
+        ORDER BY l.timestamp, l.user_id, l.id
+    """
+    rows = export.stream(pool.db_name, sql, (video_id, s, e), fmt, activity_row, head=archived)
+    return StreamingResponse(rows, media_type=export.FORMATS[fmt], headers=export.filename(f"activity_{video_id}", fmt))
+
+# --- Ingest Endpoint ---
+
+def get_ingest_writer(request: Request):
+    """Single background writer shared by all ingest requests (created on first use, closed by lifespan)."""
+    state = request.app.state
+    if state.ingest_writer is None:
+        notify = state.scheduler.notify if state.scheduler is not None else None
+        tracker = state.velocity if WORKERS == 1 else None  # workers sync from the likes table instead
+        state.ingest_writer = ingest.LikeWriter(DB_NAME, writer=state.db.writer, tracker=tracker, on_batch=notify)
+    return state.ingest_writer
+
+def parse_likes(pool, parse, data):
+    """Parse likes (in a worker thread, off the event loop) and reject unknown users and videos before queueing them."""
+    rows = list(parse(data))
+    if rows:
+        with pool.reader() as conn:
+            ingest.check_known(conn, rows)
+    return rows
+
+@app.post("/api/ingest/likes", status_code=202)
+async def ingest_likes(request: Request, wait: bool = False):
+    """
+    Accept likes as NDJSON (streamed line by line) or a JSON array.
+    Each like: {"user_id", "video_id", "timestamp"} or [user_id, video_id, timestamp];
+    timestamp is epoch seconds or ISO-8601, user and video must exist. Rows are queued
+    to the background writer; pass ?wait=true to return only after they are committed.
+    """
+    writer = get_ingest_writer(request)
+    pool = request.app.state.db
+    accepted, ticket = 0, None
+    try:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            rows = await run_in_threadpool(parse_likes, pool, ingest.parse_body, await request.body())
+            ticket = await run_in_threadpool(writer.submit, rows)
+            accepted = len(rows)
+        else:
+            # NDJSON: parse and hand off one network chunk at a time
+            buf = b""
+            async for data in request.stream():
+                buf += data
+                *lines, buf = buf.split(b"\n")
+                rows = await run_in_threadpool(parse_likes, pool, ingest.parse_ndjson, lines)
+                if rows:
+                    ticket = await run_in_threadpool(writer.submit, rows, ticket)
+                    accepted += len(rows)
+            rows = await run_in_threadpool(parse_likes, pool, ingest.parse_ndjson, [buf])
+            if rows:
+                ticket = await run_in_threadpool(writer.submit, rows, ticket)
+                accepted += len(rows)
+    except (ValueError, KeyError, TypeError, OverflowError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid like record after {accepted} accepted: {e}")
+    
+    if wait:
+        try:
+            await run_in_threadpool(writer.flush, ticket)
+        except ingest.IngestError as e:
+            # Bad data is the client's; anything else (e.g. the database busy or full) is ours, retryable
+            bad = isinstance(e.__cause__, (ValueError, OverflowError, sqlite3.IntegrityError))
+            raise HTTPException(status_code=400 if bad else 503, detail=str(e))
+    return {"accepted": accepted, "committed": wait, "writer": writer.stats()}
 
 # --- Chat Endpoint (Gemini Integration) ---
 
@@ -252,105 +592,141 @@ class ChatRequest(BaseModel):
     message: str
     history: list = [] # Not used yet, simple stateless for now or just current turn
 
-@app.post("/api/chat")
-def chat_agent(request: ChatRequest):
-    if not API_KEY:
+def get_model_client(request: Request):
+    """Dependency: the shared genai client (override with agent.ScriptedClient to test offline)."""
+    client = request.app.state.model_client
+    if client is None:
         raise HTTPException(status_code=500, detail="API Key not found")
+    return client
+
+def get_tool_cache(request: Request) -> tool_cache.ToolCache:
+    return request.app.state.tool_cache
 
-    client = genai.Client(api_key=API_KEY)
+# Deterministic read tools whose results are cached (see tool_cache.py)
+CACHED_TOOLS = ["get_security_briefing", "get_video_stats", "analyze_hourly_spike", "fetch_suspicious_users",
+                "get_coordinated_clusters"]
+
+def build_tools(pool, engine, cache=None, profile_cache=None, cold=None):
+    """
+    The agent's tools (name -> function), bound to the request's pool and analytics engine.
+    With a cache, CACHED_TOOLS are served from it. get_user_details renders through
+    profile_cache (the app's shared one; a private one if not given). With the Parquet
+    archive `cold`, fetch_suspicious_users also covers compacted months.
+    """
+    profile_cache = profile_cache or profiles.ProfileCache()
     
     # --- TOOLS ---
     
     def get_video_stats(video_id: int):
-        conn = get_db_connection()
-        try:
+        with pool.reader() as conn:
             video = conn.execute("SELECT * FROM videos WHERE id = ?", (video_id,)).fetchone()
             if not video: return f"Error: Video ID {video_id} not found."
             
-            # Basic stats
-            count = conn.execute("SELECT COUNT(*) FROM likes WHERE video_id = ?", (video_id,)).fetchone()[0]
+            # Basic stats (daily rollup has the fewest rows per video)
+            count = conn.execute("SELECT COALESCE(SUM(count), 0) FROM likes_daily WHERE video_id = ?", (video_id,)).fetchone()[0]
             
             # Peak detection
             peak = conn.execute("""
-                SELECT strftime('%Y-%m-%d %H:00', timestamp) as hour, COUNT(*) as cnt 
-                FROM likes WHERE video_id = ? 
-                GROUP BY hour ORDER BY cnt DESC LIMIT 1
+                SELECT hour_epoch / 3600 as hour, count as cnt 
+                FROM likes_hourly WHERE video_id = ? 
+                ORDER BY cnt DESC LIMIT 1
             """, (video_id,)).fetchone()
             
-            peak_info = f", Peak Activity: {peak['hour']} ({peak['cnt']} likes)" if peak else ", Peak Activity: None"
+            peak_info = f", Peak Activity: {hour_label(peak['hour'])} ({peak['cnt']} likes)" if peak else ", Peak Activity: None"
             
-            return f"ID: {video['id']}, Title: {video['title']}, Uploaded: {video['upload_date']}, Total Likes: {count}, Archetype: {video['archetype']}{peak_info}"
-        finally:
-            conn.close()
+            return f"ID: {video['id']}, Title: {video['title']}, Uploaded: {to_iso(video['upload_date'])}, Total Likes: {count}, Archetype: {video['archetype']}{peak_info}"
 
     def analyze_hourly_spike(video_id: int, target_hour: str):
-        conn = get_db_connection()
-        try:
+        with pool.reader() as conn:
             try:
-                target_dt = datetime.datetime.strptime(target_hour, "%Y-%m-%d %H")
+                target = parse_hour(target_hour)
             except ValueError:
                 return "Error: Invalid date format. Use 'YYYY-MM-DD HH'."
-            prev = target_dt - timedelta(hours=1)
-            next_h = target_dt + timedelta(hours=1)
             
-            def count(dt):
-                s = dt.strftime("%Y-%m-%d %H:00:00")
-                e = (dt + timedelta(hours=1)).strftime("%Y-%m-%d %H:00:00")
-                return conn.execute("SELECT COUNT(*) FROM likes WHERE video_id=? AND timestamp>=? AND timestamp<?", (video_id,s,e)).fetchone()[0]
+            def count(s):
+                row = conn.execute("SELECT count FROM likes_hourly WHERE video_id=? AND hour_epoch=?", (video_id,s)).fetchone()
+                return row[0] if row else 0
             
-            return f"Analysis {target_hour}: Prev={count(prev)}, Target={count(target_dt)}, Next={count(next_h)}"
-        finally:
-            conn.close()
+            spike = spikes.spike_at(conn, video_id, target)
+            verdict = (f"DETECTED SPIKE (z={spike['score']}, baseline {spike['baseline']:g}/hour)" if spike
+                       else "No spike detected")
+            return f"Analysis {target_hour}: Prev={count(target-3600)}, Target={count(target)}, Next={count(target+3600)}. {verdict}"
 
     def fetch_suspicious_users(video_id: int, target_hour: str):
         """Analyze users in a spike."""
-        conn = get_db_connection()
-        try:
+        with pool.reader() as conn:
             try:
-                target_dt = datetime.datetime.strptime(target_hour, "%Y-%m-%d %H")
+                s = parse_hour(target_hour)
             except ValueError: return "Error: Date format YYYY-MM-DD HH"
-            s = target_dt.strftime("%Y-%m-%d %H:00:00")
-            e = (target_dt + timedelta(hours=1)).strftime("%Y-%m-%d %H:00:00")
+            e = s + 3600
+            likes = partitions.likes_sql(conn, s, e)
+            archived = [(r["username"], r["created_at"], r["timestamp"]) for r in cold_activity(conn, cold, video_id, s, e)]
             
-            query = """
+            if engine is not None and likes == "likes" and not archived:
+                w = engine.window(video_id, s, e)
+                flagged = (w.age < 24 * 3600) | (w.age > 90 * 86400)
+                results = [f"User: {name}, Age: {timedelta(seconds=age)}, {'[FRESH ACCOUNT]' if age < 24 * 3600 else '[SLEEPER]'}"
+                           for name, age in zip(w.username[flagged][:51].tolist(), w.age[flagged][:51].tolist())]
+                return "\n".join(results[:50]) + ("..." if len(results)>50 else "") if results else "No users found."
+            
+            query = f"""
                 SELECT u.username, u.created_at, l.timestamp 
-                FROM likes l JOIN users u ON l.user_id = u.id 
+                FROM {likes} l JOIN users u ON l.user_id = u.id 
                 WHERE l.video_id=? AND l.timestamp>=? AND l.timestamp<?
             """
-            rows = conn.execute(query, (video_id, s, e)).fetchall()
+            rows = archived + conn.execute(query, (video_id, s, e)).fetchall()
             results = []
             for r in rows:
                 try:
-                    created = datetime.datetime.fromisoformat(str(r[1]))
-                    liked = datetime.datetime.fromisoformat(str(r[2]))
-                    age = liked - created
+                    age = timedelta(seconds=r[2] - r[1])
                     flag = "[FRESH ACCOUNT]" if age < timedelta(hours=24) else ("[SLEEPER]" if age > timedelta(days=90) else "")
                     if flag: results.append(f"User: {r[0]}, Age: {age}, {flag}")
                 except: continue
             return "\n".join(results[:50]) + ("..." if len(results)>50 else "") if results else "No users found."
-        finally:
-            conn.close()
 
     def get_user_details(username: str):
         """Get details about a specific user."""
         try:
-            res = get_user_details_api(username) # Reuse the API function logic
+            res = get_user_details_api(username, pool, profile_cache) # Reuse the API function logic
             return str(res)
         except Exception as e: return f"Error: {e}"
 
+    def score_users(usernames: list):
+        """
+        Risk scores of many users at once (e.g. everyone from fetch_suspicious_users):
+        how many carry each alert reason, and the riskiest ones.
+        """
+        names = [str(n) for n in usernames][:profiles.MAX_BATCH]
+        with pool.reader() as conn:
+            rows, missing = profiles.batch(conn, usernames=names, tracker=profile_cache.tracker,
+                                           fields=["username", "created_at", "total_likes", "risk_score", "alert_reason", "velocity_score"])
+        if not rows: return "No such users."
+        reasons = {}
+        for r in rows: reasons[r["alert_reason"]] = reasons.get(r["alert_reason"], 0) + 1
+        report = f"{len(rows)} users scored" + (f" ({len(missing)} not found)" if missing else "") + ": "
+        report += ", ".join(f"{n} {reason}" for reason, n in sorted(reasons.items(), key=lambda x: -x[1])) + "\n"
+        for r in sorted(rows, key=lambda r: -(r["risk_score"] or 0))[:20]:
+            report += (f"- {r['username']}: risk {r['risk_score']} ({r['alert_reason']}), {r['total_likes']} likes, "
+                       f"created {r['created_at']}, velocity {r['velocity_score']}\n")
+        return report
+
     def run_read_only_sql(sql_query: str):
         """
         Run a READ-ONLY SQL query on 'social_media_logs.db'.
         Tables: users(id, username, created_at, is_bot), videos(id, title), likes(user_id, video_id, timestamp).
+        Timestamps are integer epoch seconds (UTC).
+        Full scans of large tables are rejected: filter likes on video_id (+ timestamp) or user_id.
+        At most 20 rows are returned; use aggregates or LIMIT for more.
         """
-        if not sql_query.lower().strip().startswith("select"):
-            return "Error: Only SELECT queries are allowed."
-        conn = get_db_connection()
         try:
-            rows = conn.execute(sql_query).fetchall()
-            return str([dict(r) for r in rows][:20]) # Limit to 20 rows
+            with pool.reader() as conn:
+                result = sql_guard.execute(conn, sql_query)
+        except sql_guard.QueryRejected as e: return f"Rejected: {e}"
         except Exception as e: return f"SQL Error: {e}"
-        finally: conn.close()
+        stats = result["stats"]
+        more = " (truncated; more rows exist)" if result["truncated"] else ""
+        return (f"{[dict(r) for r in result['rows']]}\n"
+                f"[{stats['rows_returned']} rows{more}, <{stats['vm_steps'] + sql_guard.PROGRESS_EVERY} VM steps, {stats['elapsed_ms']}ms]")
 
     
     def get_security_briefing(limit: int = 5):
@@ -359,50 +735,70 @@ def chat_agent(request: ChatRequest):
         Returns videos and times with high 'Fresh Bot' activity.
         Use this when asked "Tell me about alerts" or "What is suspicious?".
         """
-        conn = get_db_connection()
-        try:
-            # Detect clusters of Fresh Accounts (Created < 48 hours before Like)
-            # This is the strongest signal of a bot attack
-            query = """
-                SELECT 
-                    v.id as video_id, v.title,
-                    strftime('%Y-%m-%d %H:00', l.timestamp) as hour,
-                    COUNT(*) as total_likes,
-                    SUM(CASE 
-                        WHEN (julianday(l.timestamp) - julianday(u.created_at)) * 24 < 48 THEN 1 
-                        ELSE 0 
-                    END) as fresh_bot_count
-                FROM likes l
-                JOIN users u ON l.user_id = u.id
-                JOIN videos v ON l.video_id = v.id
-                GROUP BY video_id, hour
-                HAVING fresh_bot_count > 10
-                ORDER BY fresh_bot_count DESC
-                LIMIT ?
-            """
-            rows = conn.execute(query, (limit,)).fetchall()
+        with pool.reader() as conn:
+            # Ranked in the background by the spike_alerts job (see scheduler.py)
+            rows = scheduler.ranked(conn, int(limit))
+            if rows is None:
+                # Not computed yet: examine the detected hourly spikes now, counting Fresh
+                # Accounts (Created < 48 hours before Like) in each via idx_likes_video_ts.
+                # Fresh accounts are the strongest signal of a bot attack
+                rows = conn.execute("""
+                    SELECT s.video_id, v.title, s.start, s.end, s.count as total_likes, s.baseline, s.score
+                    FROM spikes s JOIN videos v ON s.video_id = v.id
+                    WHERE s.resolution = 'hour'
+                """).fetchall()
+                windows = [(r["video_id"], r["start"], r["end"]) for r in rows]
+                if engine is not None:
+                    # Spikes before the hot table are counted in SQL (the engine holds hot likes only)
+                    hot = partitions.hot_since(conn) or 0
+                    fresh = [n if w[1] >= hot else fresh_count(conn, *w, cold) for n, w in zip(engine.fresh_counts(windows), windows)]
+                else:
+                    fresh = [fresh_count(conn, *w, cold) for w in windows]
+                rows = sorted((dict(r, fresh_bots=n) for r, n in zip(rows, fresh)),
+                              key=lambda r: (-r["fresh_bots"], -r["score"]))[:limit]
             
             if not rows: return "No major anomalies detected in the system."
             
             report = "Security Briefing (Top Anomalies):\n"
             for r in rows:
-                report += f"- ALERT: Video {r['video_id']} ('{r['title']}') at {r['hour']}. Detected {r['fresh_bot_count']} fresh bots (Total Likes: {r['total_likes']}).\n"
+                report += (f"- ALERT: Video {r['video_id']} ('{r['title']}') at {hour_label(r['start'] // 3600)}. "
+                           f"Detected {r['fresh_bots']} fresh bots (Total Likes: {r['total_likes']}, "
+                           f"baseline {r['baseline']:g}/hour, z={r['score']}).\n")
             
             return report + "\nAnalysis: Please investigate these specific timeframes using 'fetch_suspicious_users'."
-        finally:
-             conn.close()
+
+    def get_coordinated_clusters(limit: int = 5):
+        """
+        Botnet scan: groups of accounts that repeatedly liked the same videos within
+        the same minute, largest first, with how many are bots/fresh/dormant.
+        """
+        with pool.reader() as conn:
+            rows = clusters.top(conn, limit=int(limit))
+        if not rows: return "No coordinated clusters detected."
+        report = "Coordinated Clusters:\n"
+        for c in rows:
+            report += (f"- Cluster {c['id']}: {c['size']} accounts, {c['edges']} repeated co-likes, "
+                       f"{c['bots']} bots, {c['fresh']} fresh, {c['dormant']} dormant, avg risk {c['avg_risk']}. "
+                       f"Top members: {', '.join(c['sample'])}\n")
+        return report + "\nAnalysis: Use 'get_user_details' on members to confirm."
 
     tools_map = {
         "get_video_stats": get_video_stats,
         "analyze_hourly_spike": analyze_hourly_spike,
         "fetch_suspicious_users": fetch_suspicious_users,
         "get_user_details": get_user_details,
+        "score_users": score_users,
         "run_read_only_sql": run_read_only_sql,
-        "get_security_briefing": get_security_briefing
+        "get_security_briefing": get_security_briefing,
+        "get_coordinated_clusters": get_coordinated_clusters
     }
+    if cache is not None:
+        for name in CACHED_TOOLS:
+            tools_map[name] = cache.wrap(name, tools_map[name])
+    return tools_map
 
-    # System Prompt
-    sys_instruct = """You are a Forensics Analyst.
+# System Prompt
+SYS_INSTRUCT = """You are a Forensics Analyst.
     
     CORE WORKFLOWS:
     1. GENERAL ALERTS ("What's happening?", "Any alerts?"):
@@ -415,62 +811,83 @@ def chat_agent(request: ChatRequest):
        
     3. DEEP DIVE ("Who is user_123?"):
        -> Call 'get_user_details'.
+       -> For many users at once (e.g. everyone in a spike), call 'score_users' with all their usernames.
+
+    Independent tool calls can be made together in one turn; they run in parallel.
 
     Tools:
     - 'get_security_briefing': **START HERE** for open-ended queries. Finds high-risk attacks.
     - 'get_video_stats': Peak activity detection.
     - 'fetch_suspicious_users': List users in a specific hour.
+    - 'get_coordinated_clusters': Botnets (accounts that repeatedly like together).
     - 'run_read_only_sql': Advanced custom queries.
     
     Be concise and professional."""
 
-    # Chat execution
-    chat = client.chats.create(
-        model="gemini-2.5-flash",
-        config=types.GenerateContentConfig(
-            system_instruction=sys_instruct,
-            tools=[types.Tool(function_declarations=[
-                types.FunctionDeclaration(name="get_video_stats", description="Get video stats", parameters={"type":"object","properties":{"video_id":{"type":"integer"}}}),
-                types.FunctionDeclaration(name="analyze_hourly_spike", description="Check neighbors", parameters={"type":"object","properties":{"video_id":{"type":"integer"},"target_hour":{"type":"string"}}}),
-                types.FunctionDeclaration(name="fetch_suspicious_users", description="List users in spike", parameters={"type":"object","properties":{"video_id":{"type":"integer"},"target_hour":{"type":"string"}}}),
-                types.FunctionDeclaration(name="get_user_details", description="Get details for a username", parameters={"type":"object","properties":{"username":{"type":"string"}}}),
-                types.FunctionDeclaration(name="run_read_only_sql", description="Run generic SQL query", parameters={"type":"object","properties":{"sql_query":{"type":"string"}}}),
-                types.FunctionDeclaration(name="get_security_briefing", description="Global security summary", parameters={"type":"object","properties":{"limit":{"type":"integer"}}})
-            ])],
-            temperature=0
-        )
-    )
+MODEL = "gemini-2.5-flash"
 
-    try:
-        response = chat.send_message(request.message)
-        
-        for _ in range(5):
-             try:
-                part = response.candidates[0].content.parts[0]
-             except: break
-             
-             if hasattr(part, "function_call") and part.function_call:
-                 fn = part.function_call
-                 name = fn.name
-                 args = fn.args
-                 print(f"Calling Tool: {name}")
-                 if name in tools_map:
-                     res_txt = str(tools_map[name](**args))
-                 else:
-                     res_txt = "Error: Tool not found"
-                 
-                 response = chat.send_message(
-                     types.Part.from_function_response(name=name, response={"result": res_txt})
-                 )
-             else:
-                 return {"response": response.text}
-                 
-        return {"response": response.text}
-
-    except Exception as e:
-        print(f"Chat Error: {e}")
-        return {"response": f"Error interacting with Agent: {e}"}
+AGENT_CONFIG = types.GenerateContentConfig(
+    system_instruction=SYS_INSTRUCT,
+    tools=[types.Tool(function_declarations=[
+        types.FunctionDeclaration(name="get_video_stats", description="Get video stats", parameters={"type":"object","properties":{"video_id":{"type":"integer"}}}),
+        types.FunctionDeclaration(name="analyze_hourly_spike", description="Check neighbors", parameters={"type":"object","properties":{"video_id":{"type":"integer"},"target_hour":{"type":"string"}}}),
+        types.FunctionDeclaration(name="fetch_suspicious_users", description="List users in spike", parameters={"type":"object","properties":{"video_id":{"type":"integer"},"target_hour":{"type":"string"}}}),
+        types.FunctionDeclaration(name="get_user_details", description="Get details for a username", parameters={"type":"object","properties":{"username":{"type":"string"}}}),
+        types.FunctionDeclaration(name="score_users", description="Risk scores of many users at once", parameters={"type":"object","properties":{"usernames":{"type":"array","items":{"type":"string"}}}}),
+        types.FunctionDeclaration(name="run_read_only_sql", description="Run generic SQL query", parameters={"type":"object","properties":{"sql_query":{"type":"string"}}}),
+        types.FunctionDeclaration(name="get_security_briefing", description="Global security summary", parameters={"type":"object","properties":{"limit":{"type":"integer"}}}),
+        types.FunctionDeclaration(name="get_coordinated_clusters", description="Clusters of accounts that repeatedly like together", parameters={"type":"object","properties":{"limit":{"type":"integer"}}})
+    ])],
+    temperature=0
+)
+
+@app.post("/api/chat")
+async def chat_agent(request: ChatRequest, pool: db.Pool = Depends(get_pool),
+                     engine: analytics.Engine = Depends(get_analytics), client = Depends(get_model_client),
+                     cache: tool_cache.ToolCache = Depends(get_tool_cache),
+                     profile_cache: profiles.ProfileCache = Depends(get_profile_cache),
+                     cold: archive.Archive = Depends(get_archive)):
+    """Run the agent to completion and return its final answer."""
+    executor = agent.AgentExecutor(client, MODEL, AGENT_CONFIG, build_tools(pool, engine, cache, profile_cache, cold))
+    return {"response": await agent.collect(executor.run(request.message))}
+
+@app.post("/api/chat/stream")
+async def chat_agent_stream(request: ChatRequest, pool: db.Pool = Depends(get_pool),
+                            engine: analytics.Engine = Depends(get_analytics), client = Depends(get_model_client),
+                            cache: tool_cache.ToolCache = Depends(get_tool_cache),
+                            profile_cache: profiles.ProfileCache = Depends(get_profile_cache),
+                            cold: archive.Archive = Depends(get_archive)):
+    """
+    Same agent, streamed as Server-Sent Events: text chunks as the model writes them,
+    tool_start/tool_end as tools run, then done (or error). See agent.AgentExecutor.
+    """
+    executor = agent.AgentExecutor(client, MODEL, AGENT_CONFIG, build_tools(pool, engine, cache, profile_cache, cold))
+    return StreamingResponse(agent.sse(executor.run(request.message)), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/chat/cache")
+def get_tool_cache_stats(cache: tool_cache.ToolCache = Depends(get_tool_cache)):
+    """Hit/miss counters of the agent tool cache."""
+    return cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(request: Request):
+    """Prometheus scrape endpoint: request/SQL/agent latency histograms plus pool and cache gauges."""
+    state = request.app.state
+    pool, cache = state.db.stats(), state.tool_cache.stats()
+    gauges = {
+        "db_pool_size": pool["size"],
+        "db_pool_idle": pool["idle"],
+        "db_writer_version": state.db.writer.version,
+        "tool_cache_entries": cache["entries"],
+        "tool_cache_hits": cache["hits"],
+        "tool_cache_misses": cache["misses"],
+        "profile_cache_entries": len(state.profile_cache),
+        "velocity_tracked_users": len(state.velocity) if state.velocity is not None else 0,
+    }
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
+    # Development server; serve.py runs several worker processes
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)